@@ -0,0 +1,181 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Benchmark create_deps_tree on a synthetic deep-diamond working set
+
+Every layer of the working set has ``width`` packages and every package
+requires all packages of the next layer, so the number of paths grows as
+``width ** depth`` while the number of distinct subtrees stays linear.
+
+    python benchmark/bench_deps_tree.py --depth 6 --width 3
+
+With ``--width 1`` the working set is a single chain, which exercises
+depths far beyond the interpreter recursion limit:
+
+    python benchmark/bench_deps_tree.py --depth 5000 --width 1
+
+``--memory`` compares the memory held by the nested dicts payload and by
+the compact tree it is serialized from.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from mosec.pip_resolve import build_deps_tree, create_deps_tree  # noqa: E402
+
+
+class FakeDist(object):
+    def __init__(self, name, version='1.0.0'):
+        self.project_name = name
+        self.key = name.lower()
+        self.version = version
+
+
+class FakeRequirement(object):
+    def __init__(self, name):
+        self.name = name
+
+
+def make_diamond_working_set(depth, width, cycle=False):
+    """Build ``{dist: [required dists]}`` with ``depth`` fully connected layers
+    :param int  depth: number of layers
+    :param int  width: number of packages per layer
+    :param bool cycle: make the last layer require the first one
+    """
+    layers = [[FakeDist('pkg-{}-{}'.format(d, w)) for w in range(width)] for d in range(depth)]
+    dist_tree = {}
+    for d, layer in enumerate(layers):
+        for dist in layer:
+            if d + 1 < depth:
+                dist_tree[dist] = list(layers[d + 1])
+            elif cycle:
+                dist_tree[dist] = list(layers[0])
+            else:
+                dist_tree[dist] = []
+    top_level = [FakeRequirement(dist.project_name) for dist in layers[0]]
+    return dist_tree, top_level
+
+
+def legacy_create_deps_tree(dist_tree, top_level_requirements):
+    """Tree building before subtree memoization, kept as the baseline"""
+    key_tree = dict((k.key, sorted(v, key=lambda d: d.key)) for k, v in dist_tree.items())
+    names = [p.name.lower() for p in top_level_requirements]
+
+    def _node(dist, parent):
+        return {'name': dist.project_name, 'version': dist.version,
+                'from': parent['from'] + [dist.project_name + '@' + dist.version],
+                'dependencies': {}}
+
+    def _children(node, ancestors):
+        ancestors = ancestors.copy()
+        ancestors.add(node['name'].lower())
+        for child in key_tree[node['name'].lower()]:
+            if child.key in ancestors:
+                continue
+            child_node = _node(child, node)
+            _children(child_node, ancestors)
+            node['dependencies'][child_node['name']] = child_node
+        return node
+
+    root = {'name': 'bench', 'version': '1.0.0', 'from': ['bench@1.0.0'], 'dependencies': {}}
+    for dist in sorted(dist_tree, key=lambda d: d.key):
+        if dist.key in names:
+            root['dependencies'][dist.project_name] = _children(_node(dist, root), set())
+    return root
+
+
+def _timeit(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--width", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cycle", action="store_true")
+    parser.add_argument("--memory", action="store_true",
+                        help="compare the memory held by the nested dicts and the compact tree")
+    args = parser.parse_args()
+
+    dist_tree, top_level = make_diamond_working_set(args.depth, args.width, args.cycle)
+    req_file = os.path.join('bench', 'requirements.txt')
+
+    if args.memory:
+        dict_size, _ = _peak_memory(lambda: create_deps_tree(dist_tree, top_level, req_file))
+        compact_size, compact = _peak_memory(lambda: build_deps_tree(dist_tree, top_level, req_file))
+        print("nested dicts : {:.1f} MB".format(dict_size / 1024.0 / 1024))
+        print("compact tree : {:.1f} MB".format(compact_size / 1024.0 / 1024))
+        return 0
+
+    current_time, current = _timeit(lambda: create_deps_tree(dist_tree, top_level, req_file), args.repeat)
+    try:
+        legacy_time, legacy = _timeit(lambda: legacy_create_deps_tree(dist_tree, top_level), args.repeat)
+    except RecursionError:
+        legacy_time, legacy = None, None
+
+    def _flatten(root):
+        # json.dumps and == recurse, deep chains are compared node by node
+        nodes, stack = [], [root]
+        while stack:
+            node = stack.pop()
+            nodes.append((node['name'], node['version'], node.get('from'), list(node['dependencies'])))
+            stack.extend(child for child in node['dependencies'].values() if child)
+        return nodes
+
+    print("working set: {} dists, depth {}, width {}, cycle {}".format(
+        len(dist_tree), args.depth, args.width, args.cycle))
+    print("tree    : {} nodes".format(len(_flatten(current))))
+    print("current : {:.3f}s".format(current_time))
+    if legacy is None:
+        print("legacy  : RecursionError")
+        return 0
+
+    same = _flatten(legacy)[1:] == _flatten(current)[1:]
+    print("legacy  : {:.3f}s".format(legacy_time))
+    print("speedup : {:.2f}x, same payload: {}".format(legacy_time / current_time, same))
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
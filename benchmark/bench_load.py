@@ -0,0 +1,137 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""End-to-end load benchmark of the mosec CLI against the stand-in API
+
+For every payload size, a site-packages directory of deep-diamond dists
+(see bench_deps_tree.py) is written, ``DEPTHxWIDTH``. ``mosec`` runs in
+its own process on it, the tree build included, against a local stand-in
+API (mosec/standin.py) with injected latency and errors. For every
+concurrency level, ``--scans`` scans run with at most that many processes
+at once, the p50/p95/p99 latency of a scan and the throughput are reported:
+
+    python benchmark/bench_load.py --sizes 3x3,5x3,7x3 --concurrency 1,4,16 --scans 32
+
+    python benchmark/bench_load.py --latency 50 --jitter 50 --error-rate 0.05 --mosec-args "--compress"
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from mosec.batch import latency_percentiles  # noqa: E402
+from mosec.standin import StandinServer  # noqa: E402
+
+MOSEC_COMMAND = [sys.executable, '-c', 'import sys; from mosec.pip_resolve import main; sys.exit(main())']
+
+
+def make_site_packages(directory, depth, width):
+    """Write ``depth`` fully connected layers of ``width`` dists, and the
+    requirements file of a project requiring the first layer
+    :returns: (site-packages path, requirements file path)
+    """
+    site_packages = os.path.join(directory, 'site-packages')
+    os.makedirs(site_packages)
+    for layer in range(depth):
+        for i in range(width):
+            name = 'bench_l{}_p{}'.format(layer, i)
+            dist_info = os.path.join(site_packages, '{}-1.0.0.dist-info'.format(name))
+            os.makedirs(dist_info)
+            lines = ['Metadata-Version: 2.1', 'Name: {}'.format(name), 'Version: 1.0.0']
+            if layer + 1 < depth:
+                lines.extend('Requires-Dist: bench_l{}_p{}'.format(layer + 1, j) for j in range(width))
+            with open(os.path.join(dist_info, 'METADATA'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    project = os.path.join(directory, 'project')
+    os.makedirs(project)
+    requirements = os.path.join(project, 'requirements.txt')
+    with open(requirements, 'w') as f:
+        f.write(''.join('bench_l0_p{}\n'.format(i) for i in range(width)))
+    return site_packages, requirements
+
+
+def run_scan(argv, env):
+    """Run the CLI once
+    :returns: (seconds, exit code)
+    """
+    start = time.perf_counter()
+    code = subprocess.call(MOSEC_COMMAND + argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, code
+
+
+def run_level(argv, env, scans, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: run_scan(argv, env), range(scans)))
+    return time.perf_counter() - start, results
+
+
+def parse_sizes(value):
+    return [tuple(int(n) for n in size.split('x')) for size in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes('3x3,5x3,7x3'))
+    parser.add_argument("--concurrency", default='1,4,16')
+    parser.add_argument("--scans", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=20, help="ms")
+    parser.add_argument("--jitter", type=float, default=0, help="ms")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mosec-args", default='', help="more arguments of mosec, e.g. \"--compress\"")
+    args = parser.parse_args()
+
+    concurrency_levels = [int(n) for n in args.concurrency.split(',')]
+    failed = 0
+    print("{:>6} {:>12} {:>5} {:>9} {:>9} {:>9} {:>9} {:>7} {:>7}".format(
+        'size', 'payload', 'conc', 'scans/s', 'p50 ms', 'p95 ms', 'p99 ms', 'failed', 'faults'))
+    with tempfile.TemporaryDirectory() as directory:
+        for depth, width in args.sizes:
+            size_dir = os.path.join(directory, '{}x{}'.format(depth, width))
+            site_packages, requirements = make_site_packages(size_dir, depth, width)
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.pathsep.join([site_packages, ROOT])
+
+            for concurrency in concurrency_levels:
+                with StandinServer(latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                                   error_rate=args.error_rate, drop_rate=args.drop_rate, seed=args.seed) as server:
+                    argv = [requirements, '--endpoint', server.endpoint, '--no-index'] + shlex.split(args.mosec_args)
+                    elapsed, results = run_level(argv, env, args.scans, concurrency)
+                    payload_size = len(json.dumps(server.requests[-1][1])) if server.requests else 0
+                    faults = server.faults['errors'] + server.faults['drops']
+
+                p50, p95, p99 = latency_percentiles([seconds for seconds, _ in results])
+                errors = sum(1 for _, code in results if code != 0)
+                failed += errors
+                print("{:>6} {:>12,} {:>5} {:>9.1f} {:>9.0f} {:>9.0f} {:>9.0f} {:>7} {:>7}".format(
+                    '{}x{}'.format(depth, width), payload_size, concurrency, len(results) / elapsed,
+                    p50 * 1000, p95 * 1000, p99 * 1000, errors, faults))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
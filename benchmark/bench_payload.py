@@ -0,0 +1,150 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Compare the size and encoding time of the tree and graph payload formats,
+plain and gzip compressed
+
+On a synthetic deep-diamond working set (see bench_deps_tree.py):
+
+    python benchmark/bench_payload.py --depth 8 --width 3
+
+On a requirements file of the current environment:
+
+    python benchmark/bench_payload.py --requirements test/vuln-project/requirements.txt
+
+With --standin, every payload is also uploaded gzip compressed to a local
+stand-in API (mosec/standin.py), in one body and streamed chunked, the
+stand-in must decode the same payload. The tree is then uploaded twice with
+the merkle protocol, the second upload only sends the subtree hashes.
+
+With --memory, the peak memory of compressing the whole tree payload is
+compared to the streamed one.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_deps_tree import make_diamond_working_set  # noqa: E402
+from mosec.payload import (GRAPH_FORMAT, MERKLE_FORMAT, PAYLOAD_FORMATS, TREE_FORMAT, encode_chunks,  # noqa: E402
+                           encode_payload, expand_graph_payload, expand_merkle_payload, iter_payload)
+from mosec.pip_resolve import build_deps_tree, build_dependencies_tree_by_req_file, open_merkle_response  # noqa: E402
+from mosec.standin import StandinServer  # noqa: E402
+from mosec.transport import Transport, gzip_chunks, post_json  # noqa: E402
+
+
+def check_standin_roundtrip(deps_tree, fields, payloads):
+    """Upload every payload gzip compressed, the stand-in must decode the same payload"""
+    same = True
+    with StandinServer() as server:
+        for payload_format, payload in sorted(payloads.items()):
+            for stream in (False, True):
+                if stream:
+                    body = lambda: encode_chunks(iter_payload(deps_tree, fields, payload_format))  # noqa: E731
+                else:
+                    body = payload.encode('utf-8')
+                start = time.perf_counter()
+                response = json.loads(post_json(server.endpoint, body, compress=True).decode('utf-8'))
+                elapsed = time.perf_counter() - start
+                headers, received = server.requests[-1]
+                ok = headers.get('Content-Encoding') == 'gzip' and json.dumps(received) == payload
+                print("{:<6}: uploaded{} in {:.3f}s, {} dependencies, same payload: {}".format(
+                    payload_format, ' streamed' if stream else '', elapsed, response['dependencyCount'], ok))
+                same = same and ok
+
+    # a stand-in which stores no subtree yet
+    with StandinServer() as server, Transport() as client:
+        for upload in ('first', 'repeated'):
+            count = len(server.requests)
+            with open_merkle_response(client, server.endpoint, deps_tree, fields) as response:
+                response.read()
+            sent = [len(json.dumps(payload)) for _, payload in server.requests[count:]]
+            print("merkle: {} upload, {} requests, {:,} bytes".format(upload, len(sent), sum(sent)))
+    return same
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare_memory(deps_tree, fields):
+    def _whole():
+        return len(gzip.compress(encode_payload(deps_tree, fields, TREE_FORMAT).encode('utf-8'), 6))
+
+    def _streamed():
+        return sum(len(c) for c in gzip_chunks(encode_chunks(iter_payload(deps_tree, fields, TREE_FORMAT))))
+
+    for name, func in (('whole', _whole), ('stream', _streamed)):
+        start = time.perf_counter()
+        peak = _peak_memory(func)
+        elapsed = time.perf_counter() - start
+        print("{:<6}: gzip tree payload peak memory {:>12,} bytes in {:.3f}s".format(name, peak, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requirements")
+    parser.add_argument("--depth", type=int, default=8)
+    parser.add_argument("--width", type=int, default=3)
+    parser.add_argument("--standin", action="store_true")
+    parser.add_argument("--memory", action="store_true")
+    args = parser.parse_args()
+
+    if args.requirements:
+        deps_tree = build_dependencies_tree_by_req_file(args.requirements, allow_missing=True)
+    else:
+        dist_tree, top_level = make_diamond_working_set(args.depth, args.width)
+        deps_tree = build_deps_tree(dist_tree, top_level, os.path.join('bench', 'requirements.txt'))
+
+    fields = {'severityLevel': 'High', 'type': 'pip', 'language': 'python'}
+    payloads = {}
+    for payload_format in PAYLOAD_FORMATS:
+        start = time.perf_counter()
+        payloads[payload_format] = encode_payload(deps_tree, fields, payload_format)
+        elapsed = time.perf_counter() - start
+        compressed = gzip.compress(payloads[payload_format].encode('utf-8'))
+        print("{:<6}: {:>12,} bytes, {:>10,} bytes gzip, encoded in {:.3f}s".format(
+            payload_format, len(payloads[payload_format]), len(compressed), elapsed))
+
+    same = True
+    for payload_format, expand in ((GRAPH_FORMAT, expand_graph_payload), (MERKLE_FORMAT, expand_merkle_payload)):
+        start = time.perf_counter()
+        expanded = expand(json.loads(payloads[payload_format]))
+        elapsed = time.perf_counter() - start
+        expanded_same = json.dumps(expanded) == payloads[TREE_FORMAT]
+        print("expand {}: {:.3f}s, same tree: {}".format(payload_format, elapsed, expanded_same))
+        same = same and expanded_same
+
+    if args.standin:
+        same = check_standin_roundtrip(deps_tree, fields, payloads) and same
+    if args.memory:
+        compare_memory(deps_tree, fields)
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Benchmark the requirements.txt parser on large generated files
+
+Most lines of the generated file are plain specifiers (``name==1.0``,
+ranges, extras, markers), the others are comments, editable, URL, VCS and
+local path requirements. The parse with the plain specifier classifier is
+compared to the full classification of every line, which stats
+``<line>/setup.py``; ``--stat-latency`` adds a delay to every stat, as on
+a networked filesystem:
+
+    python benchmark/bench_requirements.py --lines 800 --stat-latency 2
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from mosec import requirements  # noqa: E402
+from mosec.requirements.requirement import Requirement  # noqa: E402
+
+LINE_TEMPLATES = (
+    'package-{0}==1.{0}.0',
+    'package_{0}>=1.0,<2.{0}',
+    'Package.{0}[security,socks]~=3.{0}',
+    'package-{0} ; python_version < "3.8"',
+    'package-{0}',
+    'package-{0}==2.{0} ; sys_platform == "linux"',
+    '# comment {0}',
+    '',
+    'package-{0}!=1.{0}.*',
+    'package-{0}===4.0+local.{0}',
+)
+OTHER_LINES = (
+    '-e git+https://github.com/org/package-{0}.git@v1.{0}#egg=package-{0}',
+    'https://example.com/packages/package-{0}-1.0.tar.gz#egg=package-{0}',
+    './libs/package-{0}',
+    'git+https://github.com/org/package-{0}.git#egg=package-{0}',
+)
+
+
+def make_requirements(lines):
+    out = []
+    for i in range(lines):
+        if i % 25 == 24:
+            out.append(OTHER_LINES[(i // 25) % len(OTHER_LINES)].format(i))
+        else:
+            out.append(LINE_TEMPLATES[i % len(LINE_TEMPLATES)].format(i))
+    return '\n'.join(out) + '\n'
+
+
+def _fields(req):
+    return (req.line, req.name, sorted(req.specs), sorted(req.extras), req.specifier, req.local_file,
+            req.editable, req.uri, req.vcs, req.path)
+
+
+def parse(text, filename):
+    f = io.StringIO(text)
+    f.name = filename
+    return list(requirements.parse(f))
+
+
+def measure(text, filename, rounds, classifier, stat_latency):
+    stats = [0]
+    isfile = os.path.isfile
+    parse_specifier = Requirement.__dict__['parse_specifier']
+
+    def _isfile(path):
+        stats[0] += 1
+        if stat_latency:
+            time.sleep(stat_latency)
+        return isfile(path)
+
+    os.path.isfile = _isfile
+    if not classifier:
+        Requirement.parse_specifier = classmethod(lambda cls, line: None)
+    try:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            reqs = parse(text, filename)
+        elapsed = (time.perf_counter() - start) / rounds
+    finally:
+        os.path.isfile = isfile
+        Requirement.parse_specifier = parse_specifier
+    return reqs, elapsed, stats[0] // rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=800)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--stat-latency", type=float, default=0, help="ms added to every stat")
+    args = parser.parse_args()
+
+    text = make_requirements(args.lines)
+    filename = os.path.join('bench', 'requirements.txt')
+    results = {}
+    for name, classifier in (('full', False), ('fast', True)):
+        reqs, elapsed, stats = measure(text, filename, args.rounds, classifier, args.stat_latency / 1000.0)
+        results[name] = reqs
+        print("{}: {} requirements in {:.2f} ms, {} stats".format(name, len(reqs), elapsed * 1000, stats))
+
+    same = [_fields(r) for r in results['full']] == [_fields(r) for r in results['fast']]
+    print("same requirements: {}".format(same))
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
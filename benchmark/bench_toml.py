@@ -0,0 +1,92 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Benchmark the vendored TOML parser on large generated Pipfiles
+
+Every generated Pipfile has a source, ``packages`` pinned by version
+strings and inline tables, ``dev-packages``, comments, arrays spanning
+lines and multi-line strings. The parse time per KB stays the same from
+the smallest to the largest file when parsing is linear:
+
+    python benchmark/bench_toml.py --packages 100,1000,10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from mosec.pytoml import loads  # noqa: E402
+
+
+def make_pipfile(packages):
+    lines = [
+        '# generated Pipfile',
+        '[[source]]',
+        'url = "https://pypi.org/simple"',
+        'verify_ssl = true',
+        'name = "pypi"',
+        '',
+        '[packages]',
+    ]
+    for i in range(packages):
+        if i % 3 == 0:
+            lines.append('package-{0} = "=={0}.0.1"  # pinned'.format(i))
+        elif i % 3 == 1:
+            lines.append('package-{0} = {{version = ">={0}.0", extras = ["a", "b"], markers = '
+                         '"python_version >= \'3.5\'"}}'.format(i))
+        else:
+            lines.append('"package.{0}" = "*"'.format(i))
+    lines.extend([
+        '',
+        '[dev-packages]',
+        'pytest = "*"',
+        '',
+        '[requires]',
+        'python_version = "3.8"',
+        '',
+        '[scripts]',
+        'notes = """',
+        'multi-line',
+        'string"""',
+        'ports = [',
+    ])
+    lines.extend('    {},'.format(8000 + i) for i in range(packages // 10 + 1))
+    lines.append(']')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", default='100,1000,10000')
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    for packages in [int(n) for n in args.packages.split(',')]:
+        text = make_pipfile(packages)
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            data = loads(text)
+        elapsed = (time.perf_counter() - start) / args.rounds
+        size = len(text) / 1024.0
+        print("{:>7} packages, {:>10,.1f} KB: {:.3f}s, {:.3f} ms per KB, {} packages parsed".format(
+            packages, size, elapsed, elapsed * 1000 / size, len(data['packages'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
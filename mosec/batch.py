@@ -0,0 +1,367 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Submission of many payloads to the vulnerability API from one event loop
+
+submit_batch() keeps up to ``concurrency`` requests in flight, a
+TokenBucket limits the rate at which they start so the API is not
+overloaded. Every request is timed, see BatchResult.latency.
+
+AsyncTransport speaks HTTP/1.1 over asyncio streams with the standard
+library only: keep-alive connections per host, request bodies with a
+Content-Length, responses with a Content-Length or chunked. Like
+transport.Transport, it retries on 5xx responses and connection errors
+with backoff, gzip compresses the request bodies when asked to and falls
+back to uncompressed ones on ``415``. It goes through the same proxies,
+from the ``http_proxy`` / ``https_proxy`` / ``no_proxy`` environment
+variables, https through a ``CONNECT`` tunnel.
+"""
+import asyncio
+import http.client
+import json
+import math
+import random
+import time
+
+from mosec import transport
+
+DEFAULT_CONCURRENCY = 8
+
+
+class TokenBucket(object):
+    """Token bucket rate limit, ``rate`` tokens per second, at most ``burst`` at once
+
+    :param float rate: tokens added per second
+    :param int burst: capacity of the bucket
+    :raises ValueError: when ``rate`` is not positive
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive: {}".format(rate))
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait for a token and take it"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BatchResult(object):
+    """Outcome of the submission of one payload
+
+    :ivar str name: name of the payload, e.g. its requirements file
+    :ivar float latency: seconds from the start of the request to the
+        end of the response, retries included
+    :ivar transport.Response response: the response, None on error
+    :ivar Exception error: the error, None on success
+    """
+
+    def __init__(self, name, latency, response=None, error=None):
+        self.name = name
+        self.latency = latency
+        self.response = response
+        self.error = error
+
+    @property
+    def status(self):
+        if self.response is not None:
+            return self.response.status
+        return getattr(self.error, 'status', None)
+
+    def json(self):
+        """The decoded JSON response"""
+        return json.loads(self.response.read().decode('utf-8'))
+
+
+def latency_percentiles(latencies, percentiles=(50, 95, 99)):
+    """Nearest-rank percentiles
+    :param list latencies: seconds
+    :param tuple percentiles: the percentiles to compute
+    :returns: list of seconds, in the order of percentiles
+    """
+    ordered = sorted(latencies)
+    if not ordered:
+        return [0.0 for _ in percentiles]
+    return [ordered[max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)] for p in percentiles]
+
+
+class AsyncTransport(object):
+    """Keep-alive HTTP client on asyncio streams, with retries
+
+    :param float connect_timeout: seconds to connect, TLS handshake included
+    :param float timeout: seconds to send the request and read the response once connected
+    :param int retries: retries of a request after a 5xx response or a connection error
+    :param float backoff: first retry delay in seconds, doubled for every retry
+    :param float max_backoff: maximum retry delay in seconds
+    :param int pool_size: idle connections kept per host
+    """
+
+    def __init__(self,
+                 connect_timeout=transport.DEFAULT_CONNECT_TIMEOUT,
+                 timeout=transport.DEFAULT_TIMEOUT,
+                 retries=transport.DEFAULT_RETRIES,
+                 backoff=transport.DEFAULT_BACKOFF,
+                 max_backoff=transport.DEFAULT_MAX_BACKOFF,
+                 pool_size=transport.DEFAULT_POOL_SIZE):
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._pool = {}
+
+    def close(self):
+        """Close the idle connections"""
+        pools, self._pool = self._pool, {}
+        for connections in pools.values():
+            for conn in connections:
+                conn[1].close()
+
+    async def _connect(self, origin):
+        """A new connection, (reader, writer, whether the absolute url is sent)"""
+        scheme, host, port = origin
+        address, proxy = transport.connect_address(origin)
+        ssl_context = transport.ssl_context() if scheme == 'https' else None
+        if proxy and ssl_context:
+            # the tunnel is opened by http.client, then TLS is started on its socket
+            loop = asyncio.get_event_loop()
+            sock = await asyncio.wait_for(
+                loop.run_in_executor(None, _open_tunnel, address, host, port, self.connect_timeout),
+                self.connect_timeout)
+            connection = asyncio.open_connection(sock=sock, ssl=ssl_context, server_hostname=host)
+        else:
+            connection = asyncio.open_connection(
+                address[0], address[1], ssl=ssl_context, server_hostname=host if ssl_context else None)
+        reader, writer = await asyncio.wait_for(connection, self.connect_timeout)
+        # plain http through a proxy sends the absolute url
+        return reader, writer, proxy and scheme == 'http'
+
+    def _release(self, origin, conn):
+        connections = self._pool.setdefault(origin, [])
+        if len(connections) < self.pool_size:
+            connections.append(conn)
+        else:
+            conn[1].close()
+
+    async def _send(self, origin, target, method, body, headers):
+        """Send once, on an idle connection if any. A reused connection may
+        have been closed by the server meanwhile, it is replaced by a new one.
+        """
+        connections = self._pool.get(origin)
+        conn = connections.pop() if connections else None
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect(origin)
+            try:
+                response, will_close = await asyncio.wait_for(
+                    _exchange(conn, origin, target, method, body, headers), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, http.client.HTTPException, asyncio.TimeoutError) as e:
+                conn[1].close()
+                if reused and isinstance(e, (ConnectionError, asyncio.IncompleteReadError)):
+                    conn = None
+                    continue
+                if isinstance(e, asyncio.IncompleteReadError):
+                    raise ConnectionResetError("Connection closed by the server")
+                raise
+            if will_close:
+                conn[1].close()
+            else:
+                self._release(origin, conn)
+            return response
+
+    def retry_delay(self, attempt):
+        """Delay before a retry, exponential backoff with full jitter
+        :param int attempt: 0 for the first retry
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    async def request(self, method, url, body=b'', headers=None):
+        """Send a request, retrying on 5xx responses and connection errors
+        :rtype: transport.Response
+        :raises transport.HTTPError: on a non 2xx response
+        :raises OSError: on a connection error
+        """
+        origin = transport._origin(url)
+        target = transport._target(url)
+        attempt = 0
+        while True:
+            try:
+                response = await self._send(origin, target, method, body, headers or {})
+            except (ConnectionError, http.client.HTTPException):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if not transport.is_retryable_status(response.status) or attempt >= self.retries:
+                    break
+            await asyncio.sleep(self.retry_delay(attempt))
+            attempt += 1
+
+        if not 200 <= response.status < 300:
+            raise transport.HTTPError(url, response.status, response.reason, response.body)
+        return response
+
+    async def post_json(self, url, payload, compress=False):
+        """POST a JSON payload
+        :param bytes payload: the JSON payload
+        :param bool compress: gzip the request body
+        :rtype: transport.Response
+        """
+        body, headers = transport.encode_body(payload, compress)
+        try:
+            return await self.request('POST', url, body, headers)
+        except transport.HTTPError as e:
+            if not compress or e.status != transport.UNSUPPORTED_MEDIA_TYPE:
+                raise
+        body, headers = transport.encode_body(payload)
+        return await self.request('POST', url, body, headers)
+
+
+def _open_tunnel(proxy_address, host, port, timeout):
+    """A socket tunneled to host:port through a proxy, with ``CONNECT``"""
+    conn = http.client.HTTPConnection(proxy_address[0], proxy_address[1], timeout=timeout)
+    conn.set_tunnel(host, port)
+    conn.connect()
+    sock, conn.sock = conn.sock, None
+    return sock
+
+
+async def _exchange(conn, origin, target, method, body, headers):
+    reader, writer, absolute_url = conn
+    scheme, host, port = origin
+    if absolute_url:
+        target = transport._absolute(origin, target)
+    lines = ['{} {} HTTP/1.1'.format(method, target),
+             'Host: {}'.format(host if port == transport._DEFAULT_PORTS[scheme] else '{}:{}'.format(host, port)),
+             'Content-Length: {}'.format(len(body))]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed by the server")
+    parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise http.client.BadStatusLine(status_line)
+    version, status, reason = parts[0], int(parts[1]), parts[2] if len(parts) > 2 else ''
+
+    response_headers = http.client.HTTPMessage()
+    while True:
+        line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        response_headers[name.strip()] = value.strip()
+
+    will_close = version == 'HTTP/1.0' or (response_headers.get('Connection') or '').lower() == 'close'
+    if (response_headers.get('Transfer-Encoding') or '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # trailer headers end with a blank line
+                while (await reader.readline()).strip():
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        data = b''.join(chunks)
+    elif response_headers.get('Content-Length') is not None:
+        data = await reader.readexactly(int(response_headers['Content-Length']))
+    else:
+        data = await reader.read()
+        will_close = True
+
+    body = transport.decode_body(data, response_headers.get('Content-Encoding'))
+    return transport.Response(status, reason, response_headers, body), will_close
+
+
+async def submit_all(client, url, payloads, concurrency=DEFAULT_CONCURRENCY, bucket=None, compress=False):
+    """Submit every payload, at most ``concurrency`` at once
+    :param AsyncTransport client: the transport
+    :param str url: API url
+    :param iterable payloads: (name, JSON payload bytes)
+    :param int concurrency: maximum requests in flight
+    :param TokenBucket bucket: rate limit of the request starts, None for no limit
+    :param bool compress: gzip the request bodies
+    :returns: list of BatchResult, in the order of payloads
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _submit(name, payload):
+        async with semaphore:
+            if bucket is not None:
+                await bucket.acquire()
+            start = time.monotonic()
+            try:
+                response = await client.post_json(url, payload, compress)
+            except (transport.HTTPError, OSError, http.client.HTTPException, asyncio.TimeoutError, ValueError) as e:
+                return BatchResult(name, time.monotonic() - start, error=e)
+            return BatchResult(name, time.monotonic() - start, response=response)
+
+    return await asyncio.gather(*[_submit(name, payload) for name, payload in payloads])
+
+
+def submit_batch(
+        url,
+        payloads,
+        concurrency=DEFAULT_CONCURRENCY,
+        rate=None,
+        burst=None,
+        compress=False,
+        connect_timeout=transport.DEFAULT_CONNECT_TIMEOUT,
+        timeout=transport.DEFAULT_TIMEOUT,
+        retries=transport.DEFAULT_RETRIES
+):
+    """Submit many payloads concurrently from a new event loop
+    :param str url: API url
+    :param iterable payloads: (name, JSON payload bytes)
+    :param int concurrency: maximum requests in flight
+    :param float rate: maximum requests started per second, None for no limit
+    :param int burst: requests which may start at once within the rate, default concurrency
+    :param bool compress: gzip the request bodies
+    :param float connect_timeout: seconds to connect
+    :param float timeout: seconds to wait for a response once connected
+    :param int retries: retries after a 5xx response or a connection error
+    :returns: list of BatchResult, in the order of payloads
+    """
+    # idle connections beyond the requests in flight are never reused
+    client = AsyncTransport(connect_timeout=connect_timeout, timeout=timeout, retries=retries, pool_size=concurrency)
+    bucket = TokenBucket(rate, burst or concurrency) if rate else None
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            submit_all(client, url, list(payloads), concurrency, bucket, compress))
+    finally:
+        client.close()
+        # the closed connections are released by the loop
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
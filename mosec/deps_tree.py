@@ -0,0 +1,652 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Memoized resolution of installed dists dependencies subtrees
+
+A dependency reached through several parents (``six``, ``urllib3`` ...)
+expands to the same subtree every time, except for the packages that are
+skipped because they already appear on the current path. A package on the
+path can only be reached again from inside the subtree when both belong to
+the same strongly connected component, so a subtree is fully determined by
+``(dist key, ancestors in the same component)``. Subtrees are built once per
+such key and shared by every parent.
+
+The walk uses an explicit stack rather than Python recursion, so deep
+dependency chains do not hit the interpreter recursion limit.
+
+Resolved nodes are ``__slots__`` records with interned name and version
+strings. A node does not know its ``from`` path, the path is rebuilt from
+the walk when the tree is serialized, so shared subtrees are stored once.
+"""
+import json
+import sys
+from operator import attrgetter
+from mosec.utils import NameIndex, canonical_name
+
+DEPENDENCIES = 'dependencies'
+VERSION = 'version'
+NAME = 'name'
+FROM = 'from'
+TRUNCATED = 'truncated'
+
+_NO_ANCESTORS = frozenset()
+
+try:
+    from json.encoder import encode_basestring_ascii as _encode_str
+except ImportError:
+    _encode_str = json.dumps
+
+
+class DepNode(object):
+    """A dependency node
+
+    :param str   name: package name
+    :param str   version: package version
+    :param tuple dependencies: children nodes, None when the package is not
+        installed (serialized as null)
+    :param bool  truncated: the dependencies were not expanded because of
+        the traversal bounds
+    """
+    __slots__ = ('name', 'version', 'dependencies', 'truncated')
+
+    def __init__(self, name, version, dependencies=(), truncated=False):
+        self.name = sys.intern(name)
+        self.version = sys.intern(version)
+        self.dependencies = dependencies
+        self.truncated = truncated
+
+    def __repr__(self):
+        return '<DepNode: "{}@{}">'.format(self.name, self.version)
+
+    @property
+    def label(self):
+        return self.name + '@' + self.version
+
+
+def unique_children(children, name=attrgetter('name')):
+    """Children with distinct PEP 503 normalized names, a later child
+    replaces an earlier one with the same name at its position, as
+    assigning them to a dict would
+    :param list children: DepNode list
+    :param callable name: child => package name
+    :rtype: tuple
+    """
+    positions = {}
+    unique = []
+    for child in children:
+        key = canonical_name(name(child))
+        if key in positions:
+            unique[positions[key]] = child
+        else:
+            positions[key] = len(unique)
+            unique.append(child)
+    return tuple(unique)
+
+
+class TreeBounds(object):
+    """Bounded expansion of the top-level subtrees of a tree, in order
+
+    Nodes at ``max_depth`` (top-level packages are at depth 1), and nodes
+    of a package already reached through ``max_paths_per_package`` paths,
+    keep their place in the tree but their dependencies are not expanded,
+    they are marked as truncated. The paths are counted across the
+    top-level subtrees bounded so far.
+
+    SubtreeResolver.resolve_bounded() enforces the bounds while resolving,
+    bound() applies them to an already resolved node. Either way the
+    subtrees without truncated nodes are kept shared.
+
+    :param int max_depth: maximum depth of the expanded nodes
+    :param int max_paths_per_package: maximum number of expanded paths
+        to a same package version
+    """
+
+    def __init__(self, max_depth=None, max_paths_per_package=None):
+        self.max_depth = max_depth
+        self.max_paths_per_package = max_paths_per_package
+        self.paths = {}
+        self.truncated_count = 0
+
+    @property
+    def active(self):
+        return bool(self.max_depth or self.max_paths_per_package)
+
+    def exceeded(self, label, depth):
+        """Count a path to a node with dependencies, True when the node
+        is not to be expanded
+        :param str label: name@version of the node
+        :param int depth: depth of the node
+        """
+        self.paths[label] = self.paths.get(label, 0) + 1
+        if (self.max_depth and depth >= self.max_depth) or \
+                (self.max_paths_per_package and self.paths[label] > self.max_paths_per_package):
+            self.truncated_count += 1
+            return True
+        return False
+
+    def bound(self, top_level_node):
+        """The bounded top-level node
+        :param DepNode top_level_node: a child of the root
+        :rtype: DepNode
+        """
+        if not self.active:
+            return top_level_node
+
+        # frames of [node, depth, children iterator, bounded children, truncated below],
+        # the first one stands for the root
+        stack = [[None, 0, iter((top_level_node,)), [], False]]
+        while True:
+            frame = stack[-1]
+            descend = None
+            for node in frame[2]:
+                if not node.dependencies:
+                    frame[3].append(node)
+                    continue
+                if self.exceeded(node.label, frame[1] + 1):
+                    frame[3].append(DepNode(node.name, node.version, (), truncated=True))
+                    frame[4] = True
+                    continue
+                descend = [node, frame[1] + 1, iter(node.dependencies), [], False]
+                break
+
+            if descend is not None:
+                stack.append(descend)
+                continue
+
+            if len(stack) == 1:
+                return frame[3][0]
+            stack.pop()
+            if frame[4]:
+                stack[-1][3].append(DepNode(frame[0].name, frame[0].version, tuple(frame[3])))
+                stack[-1][4] = True
+            else:
+                # nothing truncated below, the subtree stays shared
+                stack[-1][3].append(frame[0])
+
+
+class DepsTree(object):
+    """A project dependencies tree
+
+    :param DepNode root: the project node
+    """
+
+    def __init__(self, root, truncated_count=0):
+        self.root = root
+        self.truncated_count = truncated_count
+
+    def bounded(self, max_depth=None, max_paths_per_package=None):
+        """The tree with bounded expansion, see TreeBounds
+        :param int max_depth: maximum depth of the expanded nodes
+        :param int max_paths_per_package: maximum number of expanded paths
+            to a same package version
+        :rtype: DepsTree
+        """
+        if not max_depth and not max_paths_per_package:
+            return self
+        bounds = TreeBounds(max_depth, max_paths_per_package)
+        root = self.root
+        dependencies = tuple(bounds.bound(node) for node in root.dependencies)
+        return DepsTree(DepNode(root.name, root.version, dependencies), bounds.truncated_count)
+
+    def distinct_nodes(self):
+        """Every node below the root once, shared subtrees are walked once
+        :returns: generator of DepNode
+        """
+        seen = set()
+        stack = [iter(self.root.dependencies)]
+        while stack:
+            for node in stack[-1]:
+                if id(node) in seen:
+                    continue
+                seen.add(id(node))
+                yield node
+                if node.dependencies:
+                    stack.append(iter(node.dependencies))
+                    break
+            else:
+                stack.pop()
+
+    def pruned(self, predicate):
+        """The tree restricted to the paths leading to the nodes matching
+        predicate, the root is always kept
+        :param callable predicate: DepNode => bool
+        :rtype: DepsTree
+        """
+        root = self.root
+        # id(node) => pruned node, None when no node of its subtree matches
+        kept = {}
+        stack = [(root, iter(root.dependencies))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if id(child) not in kept and child.dependencies:
+                    stack.append((child, iter(child.dependencies)))
+                    break
+                if id(child) not in kept:
+                    kept[id(child)] = child if predicate(child) else None
+            else:
+                stack.pop()
+                dependencies = tuple(kept[id(c)] for c in node.dependencies if kept[id(c)] is not None)
+                if node is not root and not dependencies and not predicate(node):
+                    kept[id(node)] = None
+                elif len(dependencies) == len(node.dependencies) and \
+                        all(kept[id(c)] is c for c in node.dependencies):
+                    kept[id(node)] = node
+                else:
+                    kept[id(node)] = DepNode(node.name, node.version, dependencies, node.truncated)
+        return DepsTree(kept[id(root)], self.truncated_count)
+
+    def walk(self):
+        """Every node below the root with its ``from`` path, in the order
+        of the serialized tree
+        :returns: generator of (DepNode, list of name@version labels)
+        """
+        root = self.root
+        stack = [(iter(root.dependencies), [root.label])]
+        while stack:
+            children, path = stack[-1]
+            for node in children:
+                if node.dependencies is None:
+                    yield node, path + [node.name]
+                    continue
+                node_path = path + [node.label]
+                yield node, node_path
+                if node.dependencies:
+                    stack.append((iter(node.dependencies), node_path))
+                    break
+            else:
+                stack.pop()
+
+    def to_dict(self):
+        """The tree as nested dicts, every node with its own ``from`` path
+        :rtype: dict
+        """
+        root = self.root
+        tree_root = {NAME: root.name, VERSION: root.version, DEPENDENCIES: {}}
+        tree_root[FROM] = [root.label]
+
+        stack = [(tree_root, iter(root.dependencies))]
+        while stack:
+            parent, children_iter = stack[-1]
+            for node in children_iter:
+                if node.dependencies is None:
+                    parent[DEPENDENCIES][node.name] = None
+                    continue
+                tree_node = {
+                    NAME: node.name,
+                    VERSION: node.version,
+                    FROM: parent[FROM] + [node.label],
+                    DEPENDENCIES: {}
+                }
+                if node.truncated:
+                    tree_node[TRUNCATED] = True
+                parent[DEPENDENCIES][node.name] = tree_node
+                if node.dependencies:
+                    stack.append((tree_node, iter(node.dependencies)))
+                    break
+            else:
+                stack.pop()
+        return tree_root
+
+    def iter_json(self, extra=None):
+        """Serialize the tree as to_dict() then json.dumps() would, without
+        building the nested dicts
+        :param dict extra: more fields of the root object
+        :returns: generator of JSON text chunks
+        """
+        root = self.root
+        root_from = _encode_str(root.label)
+        root_close = '}, "from": [' + root_from + ']'
+        for key, value in (extra or {}).items():
+            root_close += ', ' + _encode_str(key) + ': ' + json.dumps(value)
+        root_close += '}'
+
+        yield '{"name": ' + _encode_str(root.name) + ', "version": ' + _encode_str(root.version) + \
+              ', "dependencies": {'
+        # frames of [children iterator, encoded from path, closing text, first child]
+        stack = [[iter(root.dependencies), root_from, root_close, True]]
+        while stack:
+            frame = stack[-1]
+            for node in frame[0]:
+                sep = '' if frame[3] else ', '
+                frame[3] = False
+                if node.dependencies is None:
+                    yield sep + _encode_str(node.name) + ': null'
+                    continue
+                node_from = frame[1] + ', ' + _encode_str(node.label)
+                yield sep + _encode_str(node.name) + ': {"name": ' + _encode_str(node.name) + \
+                    ', "version": ' + _encode_str(node.version) + ', "from": [' + node_from + \
+                    '], "dependencies": {'
+                stack.append([iter(node.dependencies), node_from,
+                              '}, "truncated": true}' if node.truncated else '}}', True])
+                break
+            else:
+                stack.pop()
+                yield frame[2]
+
+    def to_json(self, extra=None):
+        """The tree as a JSON string, see iter_json()"""
+        return ''.join(self.iter_json(extra))
+
+
+class DistTree(object):
+    """Installed dists and their required dists
+
+    Requirements of an installed dist are only loaded, wrapped and sorted
+    the first time the dist is reached, so dists which are not reachable
+    from the project requirements cost nothing.
+
+    Dists are keyed by PEP 503 normalized name, so that a requirement on
+    ``zope-interface`` resolves to an installed ``zope.interface``.
+
+    :param dict     dists: dist key => installed dist
+    :param callable requires: installed dist => list of required dists
+    """
+
+    def __init__(self, dists, requires):
+        self.dists = NameIndex(dists.values())
+        self._requires = requires
+        self._children = {}
+
+    @classmethod
+    def from_dict(cls, dist_tree):
+        """Wrap a dict of installed dist => required dists"""
+        return cls(dict((dist.key, dist) for dist in dist_tree), dist_tree.__getitem__)
+
+    def __contains__(self, key):
+        return key in self.dists
+
+    def find(self, name):
+        """Installed dist by package name, compared PEP 503 normalized
+        :param str name: package name, as written in a requirements file
+        :returns: the installed dist, or None
+        """
+        return self.dists.get(name)
+
+    def __getitem__(self, key):
+        children = self._children.get(key)
+        if children is None:
+            dist = self.dists.get(key)
+            if dist is None:
+                raise KeyError(key)
+            children = unique_children(
+                sorted(self._requires(dist), key=attrgetter('key')), attrgetter('project_name'))
+            self._children[key] = children
+        return children
+
+
+class SubtreeResolver(object):
+    """Resolve and share dependencies subtrees of installed dists
+
+    A resolved subtree is a tuple of DepNode children, the dependencies of
+    a DepNode are its resolved subtree. Only complete subtrees are
+    memoized, the subtrees with nodes truncated by bounds depend on the
+    path to them.
+
+    :param DistTree key_tree: normalized dist name => sorted list of required dists
+    :param callable on_missing: called with the name of a required package
+        which is not installed
+    """
+
+    def __init__(self, key_tree, on_missing=None):
+        self.key_tree = key_tree
+        self.on_missing = on_missing
+        self._subtrees = {}
+        # id of a memoized subtree => (height, paths to its nodes by label), see resolve_bounded()
+        self._stats = {}
+        self._missing = set()
+        self._scc = {}
+        self._scc_count = 0
+        # the current path, pushed and popped while walking
+        self._path = set()
+        self._scc_path = {}
+
+    def resolve(self, key):
+        """Resolve the subtree below an installed dist
+        :param str key: PEP 503 normalized name of the dist
+        :rtype: tuple
+        """
+        memo_key = self._memo_key(key)
+        subtree = self._subtrees.get(memo_key)
+        if subtree is not None:
+            return subtree
+
+        # frames of [key, memo key, (name, version) in parent, resolved children, children iterator]
+        stack = [self._enter(key, memo_key, None)]
+        while stack:
+            frame = stack[-1]
+            descend = None
+            for child_dist in frame[4]:
+                child_key = canonical_name(child_dist.project_name)
+                if child_key in self._path:
+                    continue
+                entry = (child_dist.project_name, dist_version(child_dist))
+                if child_key not in self.key_tree:
+                    self._report_missing(child_dist.project_name)
+                    frame[3].append(DepNode(entry[0], entry[1], None))
+                    continue
+                child_memo_key = self._memo_key(child_key)
+                child_subtree = self._subtrees.get(child_memo_key)
+                if child_subtree is None:
+                    descend = self._enter(child_key, child_memo_key, entry)
+                    break
+                frame[3].append(DepNode(entry[0], entry[1], child_subtree))
+
+            if descend is not None:
+                stack.append(descend)
+                continue
+
+            stack.pop()
+            self._leave(frame[0])
+            subtree = unique_children(frame[3])
+            self._subtrees[frame[1]] = subtree
+            if stack:
+                stack[-1][3].append(DepNode(frame[2][0], frame[2][1], subtree))
+        return subtree
+
+    def resolve_bounded(self, dist, bounds):
+        """Resolve an installed dist as a top-level node, within bounds
+
+        Nodes out of the bounds are not resolved further. A memoized
+        subtree is reused as it is when it fits in the bounds, so the
+        subtrees without truncated nodes are shared like with resolve().
+        The tree is the one TreeBounds.bound() makes of the unbounded
+        node.
+
+        :param dist: the installed dist
+        :param TreeBounds bounds: the bounds, shared by the top-level nodes
+        :rtype: DepNode
+        """
+        if not bounds.active:
+            key = canonical_name(dist.project_name)
+            return DepNode(dist.project_name, dist_version(dist), self.resolve(key))
+
+        # frames of [key, memo key, (name, version) in parent, resolved children, children iterator,
+        # depth, truncated below], the first one stands for the root
+        stack = [[None, None, None, [], iter((dist,)), 0, False]]
+        while True:
+            frame = stack[-1]
+            depth = frame[5] + 1
+            descend = None
+            for child_dist in frame[4]:
+                child_key = canonical_name(child_dist.project_name)
+                if child_key in self._path:
+                    continue
+                name, version = child_dist.project_name, dist_version(child_dist)
+                if child_key not in self.key_tree:
+                    self._report_missing(name)
+                    frame[3].append(DepNode(name, version, None))
+                    continue
+                child_memo_key = self._memo_key(child_key)
+                child_subtree = self._subtrees.get(child_memo_key)
+                if child_subtree is None and self._is_leaf(child_key):
+                    child_subtree = ()
+                if child_subtree is not None and not child_subtree:
+                    frame[3].append(DepNode(name, version, child_subtree))
+                    continue
+                node = DepNode(name, version)
+                if bounds.exceeded(node.label, depth):
+                    node.truncated = True
+                    frame[3].append(node)
+                    frame[6] = True
+                    continue
+                if child_subtree is not None and self._fits(child_subtree, depth, bounds):
+                    node.dependencies = child_subtree
+                    frame[3].append(node)
+                    continue
+                descend = self._enter(child_key, child_memo_key, (name, version)) + [depth, False]
+                break
+
+            if descend is not None:
+                stack.append(descend)
+                continue
+
+            if len(stack) == 1:
+                return frame[3][0]
+            stack.pop()
+            self._leave(frame[0])
+            subtree = unique_children(frame[3])
+            if frame[6]:
+                stack[-1][6] = True
+            else:
+                self._subtrees[frame[1]] = subtree
+                self._stats[id(subtree)] = self._subtree_stats(subtree, bounds)
+            stack[-1][3].append(DepNode(frame[2][0], frame[2][1], subtree))
+
+    def _is_leaf(self, key):
+        # every required dist is on the path, or the dist itself
+        return all(canonical_name(c.project_name) in self._path or canonical_name(c.project_name) == key
+                   for c in self.key_tree[key])
+
+    def _subtree_stats(self, subtree, bounds):
+        height = 0
+        paths = {}
+        for child in subtree:
+            if not child.dependencies:
+                height = max(height, 1)
+                continue
+            child_height, child_paths = self._stats_of(child.dependencies, bounds)
+            height = max(height, 1 + child_height)
+            if bounds.max_paths_per_package:
+                paths[child.label] = paths.get(child.label, 0) + 1
+                for label, count in child_paths.items():
+                    paths[label] = paths.get(label, 0) + count
+        return height, paths
+
+    def _stats_of(self, subtree, bounds):
+        stats = self._stats.get(id(subtree))
+        if stats is None:
+            # resolved by resolve(), without the stats
+            stats = self._subtree_stats(subtree, bounds)
+            self._stats[id(subtree)] = stats
+        return stats
+
+    def _fits(self, subtree, depth, bounds):
+        """Whether a memoized subtree below a node at depth is not truncated,
+        the paths to its nodes are then counted
+        """
+        height, paths = self._stats_of(subtree, bounds)
+        if bounds.max_depth and depth + height > bounds.max_depth:
+            return False
+        if bounds.max_paths_per_package:
+            limit = bounds.max_paths_per_package
+            if any(bounds.paths.get(label, 0) + count > limit for label, count in paths.items()):
+                return False
+            for label, count in paths.items():
+                bounds.paths[label] = bounds.paths.get(label, 0) + count
+        return True
+
+    def _memo_key(self, key):
+        # only ancestors in the same component can be reached again below key
+        same_scc_path = self._scc_path.get(self.scc_id(key))
+        return key, frozenset(same_scc_path) if same_scc_path else _NO_ANCESTORS
+
+    def _enter(self, key, memo_key, entry):
+        self._path.add(key)
+        self._scc_path.setdefault(self._scc[key], []).append(key)
+        return [key, memo_key, entry, [], iter(self.key_tree[key])]
+
+    def _leave(self, key):
+        self._path.discard(key)
+        self._scc_path[self._scc[key]].pop()
+
+    def _report_missing(self, name):
+        if name in self._missing:
+            return
+        self._missing.add(name)
+        if self.on_missing:
+            self.on_missing(name)
+
+    def scc_id(self, key):
+        """Strongly connected component id of an installed dist, computed
+        lazily with Tarjan's algorithm over the dists reachable from it
+        :param str key: key of the dist
+        :rtype: int
+        """
+        if key not in self._scc:
+            self._tarjan(key)
+        return self._scc[key]
+
+    def _tarjan(self, start):
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+
+        def _children(k):
+            keys = [canonical_name(c.project_name) for c in self.key_tree[k]]
+            return [c for c in keys if c in self.key_tree and c not in self._scc]
+
+        index[start] = lowlink[start] = 0
+        stack.append(start)
+        on_stack.add(start)
+        work = [(start, iter(_children(start)))]
+        while work:
+            node, it = work[-1]
+            pushed = False
+            for child in it:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(_children(child))))
+                    pushed = True
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if pushed:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    self._scc[member] = self._scc_count
+                    if member == node:
+                        break
+                self._scc_count += 1
+
+
+def dist_version(dist):
+    """Version string of a dist or required dist"""
+    version = dist.version
+    if isinstance(version, tuple):
+        version = '.'.join(map(str, version))
+    return version
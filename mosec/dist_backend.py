@@ -0,0 +1,403 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Installed distributions backends
+
+The ``importlib`` backend lists the ``*.dist-info`` / ``*.egg-info`` entries
+of every ``sys.path`` directory and reads their metadata through
+``importlib.metadata``, only when the requirements of a dist are needed.
+The ``*.egg`` directories and zip files put on ``sys.path`` (by
+``easy-install.pth``) are read from their ``EGG-INFO``, like the eggs of the
+``pkg_resources`` working set, and the ``*.egg-info`` of a develop install
+is found through its ``*.egg-link``.
+``pkg_resources`` is kept as a fallback, importing it scans every
+``sys.path`` entry up front.
+"""
+import logging
+import os
+import re
+import sys
+import zipfile
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    importlib_metadata = None
+
+from mosec.requirement_dist import parse_requirement, safe_name
+
+DIST_INFO_EXT = '.dist-info'
+EGG_INFO_EXT = '.egg-info'
+EGG_EXT = '.egg'
+EGG_LINK_EXT = '.egg-link'
+
+# Same as pkg_resources.EGG_NAME
+EGG_NAME_REGEX = re.compile(
+    r'^(?P<name>[^-]+)'
+    r'(-(?P<version>[^-]+)(-py(?P<pyver>[^-]+)(-(?P<plat>.+))?)?)?$'
+)
+
+log = logging.getLogger("mosec")
+
+# environment marker evaluation is only needed for requirements with markers
+_marker_class = None
+
+
+def _get_marker_class():
+    global _marker_class
+    if _marker_class is None:
+        try:
+            from packaging.markers import Marker
+        except ImportError:
+            try:
+                from pip._vendor.packaging.markers import Marker
+            except ImportError:
+                Marker = _pkg_resources_marker_class()
+        _marker_class = Marker
+    return _marker_class
+
+
+def _pkg_resources_marker_class():
+    # the packaging vendored by setuptools, pkg_resources evaluates its markers with it
+    try:
+        pkg_resources = import_pkg_resources()
+    except ImportError:
+        return False
+    markers = getattr(getattr(pkg_resources, 'packaging', None), 'markers', None)
+    return getattr(markers, 'Marker', False)
+
+
+def marker_matches(marker):
+    """Whether a requirement with this environment marker is required when
+    no extra is requested, the way ``pkg_resources`` Distribution.requires() does.
+    A marker which cannot be evaluated is skipped, with a debug log
+    :param str marker: the environment marker, may be None
+    :rtype: bool
+    """
+    if not marker:
+        return True
+    marker_class = _get_marker_class()
+    if not marker_class:
+        log.debug("Skipped a requirement, no packaging to evaluate its marker: {}".format(marker))
+        return False
+    try:
+        return marker_class(marker).evaluate({'extra': ''})
+    except Exception as e:
+        log.debug("Skipped a requirement with an unknown marker: {} ({})".format(marker, e))
+        return False
+
+
+def parse_metadata_headers(text):
+    """Parse the headers of a METADATA / PKG-INFO file
+    :param str text: content of the metadata file
+    :returns: dict of header name => list of values
+    """
+    headers = {}
+    for line in text.splitlines():
+        if not line:
+            # headers end at the first blank line, the description follows
+            break
+        if line[0] in ' \t' or ':' not in line:
+            continue
+        name, value = line.split(':', 1)
+        headers.setdefault(name.strip(), []).append(value.strip())
+    return headers
+
+
+def parse_requires_txt(text):
+    """Requirements of an egg-info ``requires.txt``, without extras"""
+    requires = []
+    required_section = True
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            extra, _, marker = line[1:-1].partition(':')
+            required_section = not extra.strip() and marker_matches(marker.strip())
+            continue
+        if required_section:
+            requires.append(line)
+    return requires
+
+
+class InstalledDist(object):
+    """An installed distribution found in a ``sys.path`` directory
+
+    The name and version are taken from the metadata directory name, the
+    way ``pkg_resources`` does. The metadata files are only read when the
+    version is not part of the name, or when requires() is called.
+
+    :param str path: path of the ``*.dist-info`` / ``*.egg-info`` / ``*.egg`` entry
+    :param str name: project name
+    :param str version: version, None to read it from the metadata
+    :param list requires: requirements when already known, e.g. from the index
+    """
+
+    def __init__(self, path, name, version=None, requires=None):
+        self.path = path
+        self.project_name = safe_name(name)
+        self.key = self.project_name.lower()
+        self._version = version
+        self._requires = requires
+
+    def __repr__(self):
+        return '<InstalledDist: "{}">'.format(self.project_name)
+
+    @classmethod
+    def from_path(cls, path):
+        """Create from a metadata entry path, or return None if not one"""
+        basename = os.path.basename(path)
+        base, ext = os.path.splitext(basename)
+        if ext.lower() not in (DIST_INFO_EXT, EGG_INFO_EXT, EGG_EXT):
+            return None
+        if ext.lower() == DIST_INFO_EXT:
+            name, _, version = base.partition('-')
+            return cls(path, name, version or None)
+        match = EGG_NAME_REGEX.match(base)
+        if match is None:
+            return None
+        version = match.group('version')
+        return cls(path, match.group('name'), version.replace('_', '-') if version else None)
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self._metadata_headers().get('Version', [''])[0]
+        return self._version
+
+    def requires(self):
+        """Requirements of the dist, evaluated for the running environment
+        :rtype: list of requirement_dist.Requirement
+        """
+        if self._requires is None:
+            self._requires = []
+            for line in self._requirement_lines():
+                req = parse_requirement(line)
+                if req is None:
+                    req = _pkg_resources_requirement(line)
+                if marker_matches(req.marker):
+                    self._requires.append(req)
+        return self._requires
+
+    def _requirement_lines(self):
+        if self.path.endswith(DIST_INFO_EXT):
+            return self._metadata_headers().get('Requires-Dist', [])
+        return parse_requires_txt(self._read_text('requires.txt') or '')
+
+    def _metadata_headers(self):
+        name = 'METADATA' if self.path.endswith(DIST_INFO_EXT) else 'PKG-INFO'
+        return parse_metadata_headers(self._read_text(name) or '')
+
+    def top_level_modules(self):
+        """Top-level module names provided by the dist, from ``top_level.txt``,
+        or the files listed in ``RECORD`` / ``installed-files.txt``
+        :rtype: list
+        """
+        text = self._read_text('top_level.txt')
+        if text:
+            return [line.strip() for line in text.splitlines() if line.strip()]
+
+        if self.path.endswith(DIST_INFO_EXT):
+            files = [line.split(',', 1)[0] for line in (self._read_text('RECORD') or '').splitlines()]
+        else:
+            # paths relative to the egg-info directory
+            files = [f[3:] for f in (self._read_text('installed-files.txt') or '').splitlines()
+                     if f.startswith('../')]
+        modules = []
+        for f in files:
+            top = f.replace('\\', '/').split('/', 1)[0]
+            if top.endswith('.py'):
+                top = top[:-3]
+            if top.isidentifier() and top != '__pycache__' and top not in modules:
+                modules.append(top)
+        return modules
+
+    def _read_text(self, filename):
+        if self.path.lower().endswith(EGG_EXT):
+            return _read_egg_text(self.path, filename)
+        if os.path.isfile(self.path):
+            # a single file egg-info is the PKG-INFO itself
+            if filename != 'PKG-INFO':
+                return None
+            with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        if importlib_metadata is None:
+            try:
+                with open(os.path.join(self.path, filename), 'r', encoding='utf-8') as f:
+                    return f.read()
+            except (IOError, OSError):
+                return None
+        return importlib_metadata.Distribution.at(self.path).read_text(filename)
+
+
+def _read_egg_text(path, filename):
+    """A file of the ``EGG-INFO`` of an egg directory or zip file"""
+    try:
+        if os.path.isdir(path):
+            with open(os.path.join(path, 'EGG-INFO', filename), 'r', encoding='utf-8') as f:
+                return f.read()
+        with zipfile.ZipFile(path) as egg:
+            return egg.read('EGG-INFO/' + filename).decode('utf-8', 'replace')
+    except (IOError, OSError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def _pkg_resources_requirement(line):
+    # fallback for requirement specifiers parse_requirement does not understand
+    req = import_pkg_resources().Requirement.parse(line)
+    req.marker = str(req.marker) if req.marker else None
+    return req
+
+
+def import_pkg_resources():
+    try:
+        import pkg_resources
+    except ImportError:
+        # try using the version vendored by pip
+        try:
+            import pip._vendor.pkg_resources as pkg_resources
+        except ImportError:
+            raise ImportError(
+                "Could not import pkg_resources; please install setuptools or pip.")
+    return pkg_resources
+
+
+def is_egg(path):
+    """An egg zip file, or an egg directory with its ``EGG-INFO``"""
+    return os.path.isfile(path) or os.path.isdir(os.path.join(path, 'EGG-INFO'))
+
+
+def is_egg_link(name):
+    return name.lower().endswith(EGG_LINK_EXT)
+
+
+def egg_link_target(path):
+    """Project directory of a develop install, the first line of its ``*.egg-link``"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+    except (IOError, OSError):
+        return None
+    return os.path.join(os.path.dirname(path), lines[0]) if lines else None
+
+
+def list_metadata_entries(directory):
+    """Names of the metadata entries and of the ``*.egg-link`` files of a directory
+    :param str directory: directory to list
+    :returns: sorted list of names, empty when the directory cannot be listed
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    return [name for name in names if name.lower().endswith((DIST_INFO_EXT, EGG_INFO_EXT, EGG_LINK_EXT))]
+
+
+def _iter_directory_entries(directory, follow_links=True):
+    for name in list_metadata_entries(directory):
+        if not is_egg_link(name):
+            yield directory, name
+        elif follow_links:
+            target = egg_link_target(os.path.join(directory, name))
+            if target and os.path.isdir(target):
+                for entry in _iter_directory_entries(target, follow_links=False):
+                    yield entry
+
+
+def iter_metadata_entries(paths=None):
+    """Metadata entries of the installed dists
+    :param list paths: directories to look into, default sys.path
+    :returns: generator of (directory, entry name)
+    """
+    for directory in (sys.path if paths is None else paths):
+        directory = directory or '.'
+        if directory.lower().endswith(EGG_EXT) and is_egg(directory):
+            # an egg put on sys.path by easy-install.pth
+            yield os.path.dirname(directory), os.path.basename(directory)
+        elif os.path.isdir(directory):
+            for entry in _iter_directory_entries(directory):
+                yield entry
+
+
+_module_dists = None
+
+
+def module_dists():
+    """Top-level module name => installed dist providing it, built once
+    from the metadata of the dists found on ``sys.path``
+    :rtype: dict
+    """
+    global _module_dists
+    if _module_dists is None:
+        mapping = {}
+        for directory, name in iter_metadata_entries():
+            dist = InstalledDist.from_path(os.path.join(directory, name))
+            if dist is None:
+                continue
+            for module in dist.top_level_modules():
+                mapping.setdefault(module.lower(), dist)
+        _module_dists = mapping
+    return _module_dists
+
+
+class ImportlibBackend(object):
+    """Installed dists read through ``importlib.metadata``"""
+    name = 'importlib'
+
+    def installed_dists(self, paths=None):
+        """
+        :param list paths: directories to look into, default sys.path
+        :returns: dict of dist key => installed dist, the first one found wins
+        """
+        dists = {}
+        for directory, name in iter_metadata_entries(paths):
+            dist = InstalledDist.from_path(os.path.join(directory, name))
+            if dist is not None and dist.key not in dists:
+                dists[dist.key] = dist
+        return dists
+
+
+class PkgResourcesBackend(object):
+    """Installed dists of the ``pkg_resources`` working set"""
+    name = 'pkg_resources'
+
+    def installed_dists(self, paths=None):
+        pkg_resources = import_pkg_resources()
+        working_set = pkg_resources.working_set if paths is None else pkg_resources.WorkingSet(paths)
+        return dict((p.key, p) for p in working_set)
+
+
+BACKENDS = {
+    ImportlibBackend.name: ImportlibBackend,
+    PkgResourcesBackend.name: PkgResourcesBackend,
+}
+
+
+def get_backend(name=None):
+    """Installed dists backend by name
+
+    :param str name: importlib or pkg_resources, default to the MOSEC_DIST_BACKEND
+        environment variable, then importlib if available
+    """
+    name = name or os.environ.get('MOSEC_DIST_BACKEND')
+    if not name:
+        name = ImportlibBackend.name if importlib_metadata is not None else PkgResourcesBackend.name
+    if name not in BACKENDS:
+        raise ValueError("Unknown dist backend: {}".format(name))
+    if name == ImportlibBackend.name and importlib_metadata is None:
+        raise ValueError("importlib.metadata is not available, use the pkg_resources backend")
+    return BACKENDS[name]()
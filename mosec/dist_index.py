@@ -0,0 +1,267 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Persistent index of installed dists
+
+The index file keeps the name, version and requirement edges of every
+``*.dist-info`` / ``*.egg-info`` / ``*.egg`` entry of the ``sys.path`` directories,
+together with the mtime of the entry and its source: the ``sys.path``
+directory, the egg on ``sys.path`` or the ``*.egg-link`` file of a develop
+install it was found through. Every source keeps its mtime and the names
+it listed. On load, a source whose mtime did not change is not listed and
+its entries are taken from the index as they are; the entries of a changed
+source have their mtime compared, only new or modified entries have their
+metadata read again. Entries no longer listed by their source, or whose
+source is gone, are removed.
+
+The mtime of a directory only changes when a file is added, removed or
+renamed in it, as pip does when it installs, upgrades or uninstalls a dist:
+a METADATA or PKG-INFO rewritten in place is not noticed until the index
+file is removed.
+
+The default index file is named after the interpreter and its ``sys.prefix``,
+every virtualenv has its own index instead of overwriting a shared one.
+"""
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+
+from mosec.dist_backend import (EGG_EXT, InstalledDist, egg_link_target, is_egg, is_egg_link,
+                                list_metadata_entries)
+from mosec.requirement_dist import Requirement
+
+INDEX_FORMAT_VERSION = 2
+INDEX_FILE_ENV = 'MOSEC_INDEX_FILE'
+
+
+def default_index_path():
+    """Index file path, from MOSEC_INDEX_FILE or the user cache directory,
+    one file per interpreter and ``sys.prefix``
+    """
+    if os.environ.get(INDEX_FILE_ENV):
+        return os.environ[INDEX_FILE_ENV]
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'mosec', 'dist-index-{}.json'.format(environment_key()))
+
+
+def environment_key():
+    """Short hash of the interpreter and its ``sys.prefix``"""
+    environment = '\0'.join([sys.prefix, sys.executable or '', environment_marker()])
+    return hashlib.sha256(environment.encode('utf-8')).hexdigest()[:16]
+
+
+def environment_marker():
+    """Requirement markers are evaluated for this environment only"""
+    return '{}-{}-{}-{}'.format(
+        platform.python_implementation(), platform.python_version(), sys.platform, platform.machine())
+
+
+def _dump_requirement(req):
+    return [getattr(req, 'unsafe_name', req.project_name), list(req.extras), [list(s) for s in req.specs],
+            getattr(req, 'url', None)]
+
+
+def _load_requirement(record):
+    name, extras, specs, url = record
+    return Requirement(name, extras, [tuple(s) for s in specs], url)
+
+
+class DistIndex(object):
+    """Installed dists index stored in a JSON file
+
+    :param str path: path of the index file
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        self.entries = {}
+        self.sources = {}
+        self.changed = False
+        self.stats = {'reused': 0, 'loaded': 0, 'removed': 0}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') != INDEX_FORMAT_VERSION or data.get('environment') != environment_marker():
+            return
+        self.entries = data.get('entries', {})
+        self.sources = data.get('sources', {})
+
+    def save(self):
+        """Write the index file atomically"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_path = tempfile.mkstemp(prefix='.dist-index-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': INDEX_FORMAT_VERSION,
+                    'environment': environment_marker(),
+                    'sources': self.sources,
+                    'entries': self.entries,
+                }, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self.changed = False
+
+    def installed_dists(self, paths=None):
+        """Installed dists, refreshing the entries which changed on disk
+        :param list paths: directories to look into, default sys.path
+        :returns: dict of dist key => installed dist, the first one found wins
+        """
+        dists = {}
+        seen = set()
+        visited = set()
+        for directory in (sys.path if paths is None else paths):
+            directory = os.path.abspath(directory or '.')
+            if directory.lower().endswith(EGG_EXT) and is_egg(directory):
+                # an egg put on sys.path by easy-install.pth is its own source
+                entries = [(directory, directory, True)]
+            else:
+                entries = self._iter_source_entries(directory, directory, True, visited)
+            for entry_path, source, listed in entries:
+                seen.add(entry_path)
+                visited.add(source)
+                dist = self._entry_dist(entry_path, source, listed)
+                if dist is not None and dist.key not in dists:
+                    dists[dist.key] = dist
+        self._prune(seen, visited)
+        return dists
+
+    def _iter_source_entries(self, source, directory, follow_links, visited):
+        """The entries of a sys.path directory, or of the project directory
+        of an egg-link source, only listed again when the source changed
+        :returns: generator of (entry path, source, listed)
+        """
+        stamp = _source_stamp(source, directory)
+        if stamp is None:
+            return
+        visited.add(source)
+        record = self.sources.get(source)
+        listed = record is None or record['stamp'] != stamp
+        if listed:
+            record = {'stamp': stamp, 'names': list_metadata_entries(directory)}
+            self.sources[source] = record
+            self.changed = True
+        for name in record['names']:
+            path = os.path.join(directory, name)
+            if not is_egg_link(name):
+                yield path, source, listed
+            elif follow_links:
+                target = egg_link_target(path)
+                if target:
+                    for entry in self._iter_source_entries(path, os.path.abspath(target), False, visited):
+                        yield entry
+
+    def _entry_dist(self, entry_path, source, listed):
+        record = self.entries.get(entry_path)
+        if record is not None and not listed:
+            # the source did not change, neither did its entries
+            self.stats['reused'] += 1
+            return _record_dist(entry_path, record)
+
+        try:
+            mtime = os.stat(entry_path).st_mtime_ns
+        except OSError:
+            return None
+        if record is not None and record['mtime'] == mtime:
+            self.stats['reused'] += 1
+            return _record_dist(entry_path, record)
+
+        dist = InstalledDist.from_path(entry_path)
+        if dist is None:
+            return None
+        self.entries[entry_path] = {
+            'mtime': mtime,
+            'source': source,
+            'name': dist.project_name,
+            'version': dist.version,
+            'requires': [_dump_requirement(r) for r in dist.requires()],
+        }
+        self.stats['loaded'] += 1
+        self.changed = True
+        return dist
+
+    def _prune(self, seen, visited):
+        # only forget the entries of the sources looked into, or whose
+        # source is gone, e.g. a removed egg-link
+        for source in [s for s in self.sources if s not in visited and not os.path.exists(s)]:
+            del self.sources[source]
+            self.changed = True
+        for entry_path, record in list(self.entries.items()):
+            if entry_path in seen:
+                continue
+            if record['source'] in visited or not os.path.exists(record['source']):
+                del self.entries[entry_path]
+                self.stats['removed'] += 1
+                self.changed = True
+
+
+def _source_stamp(source, directory):
+    """mtimes of a source and of the directory of its entries, None when gone"""
+    try:
+        stamp = [os.stat(source).st_mtime_ns]
+        if directory != source:
+            stamp.append(os.stat(directory).st_mtime_ns)
+    except OSError:
+        return None
+    return stamp
+
+
+def _record_dist(entry_path, record):
+    return InstalledDist(entry_path, record['name'], record['version'],
+                         [_load_requirement(r) for r in record['requires']])
+
+
+def build_index(path=None, paths=None):
+    """Create or refresh the index file
+    :param str path: path of the index file
+    :param list paths: directories to look into, default sys.path
+    :rtype: DistIndex
+    """
+    index = DistIndex(path)
+    index.installed_dists(paths)
+    if index.changed or not os.path.isfile(index.path):
+        index.save()
+    return index
+
+
+def indexed_installed_dists(path=None):
+    """Installed dists from an existing index file, refreshed and saved
+    when changed. Returns None when there is no index file.
+    """
+    path = path or default_index_path()
+    if not os.path.isfile(path):
+        return None
+    index = DistIndex(path)
+    dists = index.installed_dists()
+    if index.changed:
+        try:
+            index.save()
+        except (IOError, OSError):
+            # a read-only index still saves reading the unchanged entries
+            pass
+    return dists
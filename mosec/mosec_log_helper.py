@@ -40,6 +40,9 @@ class Logger(object):
     def error(self, msg):
         self.logger.error(Fore.LIGHTRED_EX + str(msg) + Style.RESET_ALL)
 
+    def is_debug_enabled(self):
+        return self.logger.isEnabledFor(logging.DEBUG)
+
     def set_log_level(self, level):
         self.logger.setLevel(level)
         self.ch.setLevel(level)
@@ -0,0 +1,364 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Payload formats of the dependencies tree upload
+
+``tree`` is the nested tree where every node repeats its ``from`` path.
+
+``graph`` sends every distinct node once and the edges between them::
+
+    {
+        "payloadFormat": "graph",
+        "name": "project", "version": "1.0.0",
+        "root": 0,
+        "nodes": [{"name": "project", "version": "1.0.0"}, {"name": "six", "version": "1.15.0"}, ...],
+        "edges": [[0, 1], ...],
+        "severityLevel": "High", ...
+    }
+
+``merkle`` is content addressed: every distinct subtree is a node keyed by
+the sha256 of its record, which holds the hashes of its children::
+
+    {
+        "payloadFormat": "merkle",
+        "name": "project", "version": "1.0.0",
+        "root": "5d1c...",
+        "hashes": ["8f0e...", ...],
+        "nodes": {"8f0e...": {"name": "six", "version": "1.15.0", "dependencies": []}, ...},
+        "severityLevel": "High", ...
+    }
+
+A backend which already stores a subtree knows every subtree below it. The
+upload first sends the ``hashes`` only, the backend answers
+``{"unknownHashes": [...]}`` with the subtrees it does not store, or with
+the result when it stores them all. The ``nodes`` of the unknown subtrees
+are sent next. A payload with every node and no hashes is a complete
+submission by itself.
+
+iter_payload() yields any format in chunks, a ``tree`` payload is
+serialized while its nodes are walked, so memory is bounded by the depth of
+the tree rather than by the size of the JSON text.
+
+A node stands for a package together with its resolved subtree, packages
+which are not installed are marked with ``"missing": true`` and nodes
+which were not expanded with ``"truncated": true``. The children
+of a node are its edges, in order. expand_graph_payload() rebuilds the
+``tree`` payload from a ``graph`` one.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+from mosec.deps_tree import DEPENDENCIES, FROM, NAME, TRUNCATED, VERSION
+
+PAYLOAD_FORMAT = 'payloadFormat'
+TREE_FORMAT = 'tree'
+GRAPH_FORMAT = 'graph'
+MERKLE_FORMAT = 'merkle'
+PAYLOAD_FORMATS = (TREE_FORMAT, GRAPH_FORMAT, MERKLE_FORMAT)
+UNKNOWN_HASHES = 'unknownHashes'
+
+CHUNK_SIZE = 64 * 1024
+
+_GRAPH_KEYS = (PAYLOAD_FORMAT, NAME, VERSION, 'root', 'nodes', 'edges')
+_MERKLE_KEYS = (PAYLOAD_FORMAT, NAME, VERSION, 'root', 'hashes', 'nodes')
+
+
+def graph_payload(deps_tree, fields=None):
+    """Nodes and edges payload of a dependencies tree
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :rtype: OrderedDict
+    """
+    node_ids = {}
+    nodes = []
+    edges = []
+
+    def _node_id(node):
+        # nodes sharing the same resolved subtree are the same graph node
+        key = (node.name, node.version, id(node.dependencies) if node.dependencies is not None else None,
+               node.truncated)
+        node_id = node_ids.get(key)
+        if node_id is None:
+            node_id = node_ids[key] = len(nodes)
+            record = OrderedDict([(NAME, node.name), (VERSION, node.version)])
+            if node.dependencies is None:
+                record['missing'] = True
+            if node.truncated:
+                record[TRUNCATED] = True
+            nodes.append(record)
+            return node_id, True
+        return node_id, False
+
+    root_id, _ = _node_id(deps_tree.root)
+    stack = [(root_id, deps_tree.root)]
+    while stack:
+        parent_id, parent = stack.pop()
+        for node in parent.dependencies:
+            node_id, is_new = _node_id(node)
+            edges.append([parent_id, node_id])
+            if is_new and node.dependencies:
+                stack.append((node_id, node))
+
+    payload = OrderedDict([
+        (PAYLOAD_FORMAT, GRAPH_FORMAT),
+        (NAME, deps_tree.root.name),
+        (VERSION, deps_tree.root.version),
+        ('root', root_id),
+        ('nodes', nodes),
+        ('edges', edges),
+    ])
+    payload.update(fields or {})
+    return payload
+
+
+def subtree_hash(record):
+    """Hash of a ``merkle`` node record
+    :param dict record: name, version, missing and truncated flags when set,
+        then the hashes of the children, in this order
+    :rtype: str
+    """
+    data = json.dumps(record, separators=(',', ':'), ensure_ascii=True)
+    return hashlib.sha256(data.encode('ascii')).hexdigest()
+
+
+def subtree_nodes(deps_tree):
+    """``merkle`` node records of the distinct subtrees of a dependencies tree
+    :param DepsTree deps_tree: the dependencies tree
+    :returns: (root hash, OrderedDict of hash => record, children first)
+    """
+    records = OrderedDict()
+    # id(node) => hash, shared subtrees are hashed once
+    hashes = {}
+
+    def _add(node, child_hashes):
+        record = OrderedDict([(NAME, node.name), (VERSION, node.version)])
+        if node.dependencies is None:
+            record['missing'] = True
+        if node.truncated:
+            record[TRUNCATED] = True
+        record[DEPENDENCIES] = child_hashes
+        digest = subtree_hash(record)
+        records.setdefault(digest, record)
+        return digest
+
+    root = deps_tree.root
+    stack = [(root, iter(root.dependencies))]
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if id(child) in hashes:
+                continue
+            if child.dependencies:
+                stack.append((child, iter(child.dependencies)))
+                break
+            hashes[id(child)] = _add(child, [])
+        else:
+            stack.pop()
+            hashes[id(node)] = _add(node, [hashes[id(c)] for c in node.dependencies])
+    return hashes[id(root)], records
+
+
+def merkle_payload(deps_tree, root_hash, fields=None, hashes=None, nodes=None):
+    """A ``merkle`` payload
+    :param DepsTree deps_tree: the dependencies tree
+    :param str root_hash: hash of the tree, see subtree_nodes()
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param list hashes: subtree hashes to send
+    :param dict nodes: hash => record of the subtrees to send
+    :rtype: OrderedDict
+    """
+    payload = OrderedDict([
+        (PAYLOAD_FORMAT, MERKLE_FORMAT),
+        (NAME, deps_tree.root.name),
+        (VERSION, deps_tree.root.version),
+        ('root', root_hash),
+    ])
+    if hashes is not None:
+        payload['hashes'] = hashes
+    if nodes is not None:
+        payload['nodes'] = nodes
+    payload.update(fields or {})
+    return payload
+
+
+def encode_payload(deps_tree, fields=None, payload_format=TREE_FORMAT):
+    """JSON payload of a dependencies tree
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param str payload_format: tree, graph or merkle, a merkle payload holds
+        every node
+    :rtype: str
+    """
+    if payload_format == GRAPH_FORMAT:
+        return json.dumps(graph_payload(deps_tree, fields))
+    if payload_format == MERKLE_FORMAT:
+        root_hash, records = subtree_nodes(deps_tree)
+        return json.dumps(merkle_payload(deps_tree, root_hash, fields, nodes=records))
+    if payload_format == TREE_FORMAT:
+        return deps_tree.to_json(fields)
+    raise ValueError("Unknown payload format: {}".format(payload_format))
+
+
+def iter_payload(deps_tree, fields=None, payload_format=TREE_FORMAT):
+    """JSON payload of a dependencies tree in chunks, joined they are
+    encode_payload()
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param str payload_format: tree or graph
+    :returns: iterator of str
+    """
+    if payload_format in (GRAPH_FORMAT, MERKLE_FORMAT):
+        return iter([encode_payload(deps_tree, fields, payload_format)])
+    if payload_format == TREE_FORMAT:
+        return deps_tree.iter_json(fields)
+    raise ValueError("Unknown payload format: {}".format(payload_format))
+
+
+def encode_chunks(chunks, chunk_size=CHUNK_SIZE):
+    """UTF-8 encode text chunks, joining small ones
+    :param chunks: iterable of str
+    :param int chunk_size: minimum size of the yielded chunks, except the last one
+    :returns: generator of bytes
+    """
+    buf = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield ''.join(buf).encode('utf-8')
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
+
+
+def write_payload(fp, deps_tree, fields=None, payload_format=TREE_FORMAT):
+    """Write the JSON payload of a dependencies tree to a binary file
+    :param fp: file object opened for binary writing
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param str payload_format: tree or graph
+    """
+    for chunk in encode_chunks(iter_payload(deps_tree, fields, payload_format)):
+        fp.write(chunk)
+
+
+def expand_graph_payload(payload):
+    """Rebuild the ``tree`` payload from a ``graph`` one, reference
+    implementation for the backend side
+    :param dict payload: decoded graph payload
+    :rtype: OrderedDict
+    """
+    nodes = payload['nodes']
+    children = [[] for _ in nodes]
+    for parent_id, child_id in payload['edges']:
+        children[parent_id].append(child_id)
+
+    root = nodes[payload['root']]
+    tree_root = OrderedDict([(NAME, root[NAME]), (VERSION, root[VERSION]), (DEPENDENCIES, OrderedDict())])
+    tree_root[FROM] = [root[NAME] + '@' + root[VERSION]]
+    for key, value in payload.items():
+        if key not in _GRAPH_KEYS:
+            tree_root[key] = value
+
+    stack = [(tree_root, iter(children[payload['root']]))]
+    while stack:
+        parent, children_iter = stack[-1]
+        for child_id in children_iter:
+            node = nodes[child_id]
+            if node.get('missing'):
+                parent[DEPENDENCIES][node[NAME]] = None
+                continue
+            tree_node = OrderedDict([
+                (NAME, node[NAME]),
+                (VERSION, node[VERSION]),
+                (FROM, parent[FROM] + [node[NAME] + '@' + node[VERSION]]),
+                (DEPENDENCIES, OrderedDict()),
+            ])
+            if node.get(TRUNCATED):
+                tree_node[TRUNCATED] = True
+            parent[DEPENDENCIES][node[NAME]] = tree_node
+            if children[child_id]:
+                stack.append((tree_node, iter(children[child_id])))
+                break
+        else:
+            stack.pop()
+    return tree_root
+
+
+def is_graph_payload(payload):
+    return payload.get(PAYLOAD_FORMAT) == GRAPH_FORMAT
+
+
+def is_merkle_payload(payload):
+    return payload.get(PAYLOAD_FORMAT) == MERKLE_FORMAT
+
+
+def unknown_subtrees(payload, store):
+    """Hashes a backend has to ask for before expanding a ``merkle`` payload,
+    reference implementation for the backend side
+    :param dict payload: decoded merkle payload
+    :param dict store: hash => record of the subtrees the backend stores
+    :rtype: list
+    """
+    nodes = payload.get('nodes') or {}
+    unknown = OrderedDict((h, True) for h in payload.get('hashes') or () if h not in store and h not in nodes)
+    seen = set()
+    stack = [payload['root']]
+    while stack:
+        digest = stack.pop()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        record = nodes.get(digest) or store.get(digest)
+        if record is None:
+            unknown[digest] = True
+        else:
+            stack.extend(record[DEPENDENCIES])
+    return list(unknown)
+
+
+def expand_merkle_payload(payload, store=None):
+    """Rebuild the ``tree`` payload from a ``merkle`` one whose subtrees are
+    all known, reference implementation for the backend side
+    :param dict payload: decoded merkle payload
+    :param dict store: hash => record of the subtrees the backend stores
+    :rtype: OrderedDict
+    """
+    records = dict(store or {})
+    records.update(payload.get('nodes') or {})
+    # the same as a graph whose nodes are the distinct subtrees
+    ids = {}
+    nodes = []
+    edges = []
+    stack = [payload['root']]
+    ids[payload['root']] = 0
+    nodes.append(records[payload['root']])
+    while stack:
+        digest = stack.pop()
+        for child in records[digest][DEPENDENCIES]:
+            if child not in ids:
+                ids[child] = len(nodes)
+                nodes.append(records[child])
+                stack.append(child)
+            edges.append([ids[digest], ids[child]])
+    graph = OrderedDict([(PAYLOAD_FORMAT, GRAPH_FORMAT), ('root', 0), ('nodes', nodes), ('edges', edges)])
+    for key, value in payload.items():
+        if key not in _MERKLE_KEYS:
+            graph[key] = value
+    return expand_graph_payload(graph)
@@ -17,149 +17,189 @@ import logging
 import sys
 import os
 import argparse
+import gzip
 import json
-import ssl
-import urllib.error
-import urllib.request
-from operator import attrgetter
+import http.client
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from mosec import batch
+from mosec import dist_backend
+from mosec import dist_index
 from mosec import mosec_log_helper
 from mosec import setup_file
+from mosec import transport
 from mosec import utils
-from mosec.requirement_file_parser import get_requirements_list
+from mosec import verdict_cache
+from mosec.requirement_file_parser import get_requirements_list, is_lock_file
 from mosec.requirement_dist import ReqDist
+from mosec.payload import (MERKLE_FORMAT, PAYLOAD_FORMATS, TREE_FORMAT, UNKNOWN_HASHES, encode_chunks, encode_payload,
+                           iter_payload, merkle_payload, subtree_nodes, write_payload)
+from mosec.deps_tree import DepNode, DepsTree, DistTree, SubtreeResolver, TreeBounds, dist_version, unique_children
 
-try:
-    import pkg_resources
-except ImportError:
-    # try using the version vendored by pip
-    try:
-        import pip._vendor.pkg_resources as pkg_resources
-    except ImportError:
-        raise ImportError(
-            "Could not import pkg_resources; please install setuptools or pip.")
 
-try:
-    from collections import OrderedDict
-except ImportError:
-    from ordereddict import OrderedDict
+log = mosec_log_helper.Logger(name="mosec")
 
+# vulnerabilities are rendered as they arrive when the API streams NDJSON
+ACCEPT_RESPONSE_TYPES = '{}, {};q=0.9'.format(transport.NDJSON_TYPE, transport.JSON_TYPE)
 
-log = mosec_log_helper.Logger(name="mosec")
+# requests of the merkle upload before giving up on the unknown subtrees
+MERKLE_MAX_ROUNDS = 3
 
+# version of the root when it is not a setup.py project
+DIR_VERSION = '1.0.0'
 
-def create_deps_tree(
+# concurrent shard uploads of --shards
+DEFAULT_SHARD_WORKERS = 4
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _root_name_version(req_file_path):
+    name, version = None, None
+    if os.path.basename(req_file_path) == 'setup.py':
+        with open(req_file_path, "r") as setup_py_file:
+            name, version = setup_file.parse_name_and_version(setup_py_file.read())
+    return (name or os.path.basename(os.path.dirname(os.path.abspath(req_file_path))),
+            version or DIR_VERSION)
+
+
+def _iter_top_level_nodes(dist_tree, top_level_requirements, allow_missing, only_provenance, bounds):
+    if not isinstance(dist_tree, DistTree):
+        dist_tree = DistTree.from_dict(dist_tree)
+
+    top_level_req_dists = dict((dist.key, dist) for dist in map(
+        dist_tree.find, (p.name for p in top_level_requirements)) if dist is not None)
+    top_level_req_dists = [top_level_req_dists[key] for key in sorted(top_level_req_dists)]
+
+    def _on_missing(name):
+        msg = 'Required packages missing: ' + name
+        if allow_missing:
+            log.error(msg)
+        else:
+            sys.exit(msg)
+
+    if only_provenance:
+        # fast path, requirements of installed dists are never loaded
+        for dist in top_level_req_dists:
+            yield DepNode(dist.project_name, dist_version(dist))
+        return
+
+    resolver = SubtreeResolver(dist_tree, on_missing=_on_missing)
+    for dist in top_level_req_dists:
+        # subtrees resolved for a top-level dependency are reused by the next ones,
+        # the bounds are enforced while resolving
+        yield resolver.resolve_bounded(dist, bounds)
+
+
+def build_deps_tree(
         dist_tree,
         top_level_requirements,
         req_file_path,
         allow_missing=False,
-        only_provenance=False
+        only_provenance=False,
+        max_depth=None,
+        max_paths_per_package=None
 ):
-    """Create dist dependencies tree
-    :param dict  dist_tree: the installed dists tree
+    """Build dist dependencies tree
+    :param DistTree dist_tree: the installed dists tree, a dict of
+        installed dist => required dists is also accepted
     :param list  top_level_requirements: list of required dists
     :param str   req_file_path: path to the dependencies file (e.g. requirements.txt)
     :param bool  allow_missing: ignore uninstalled dependencies
     :param bool  only_provenance: only care provenance dependencies
-    :rtype: dict
+    :param int   max_depth: do not expand dependencies deeper than this
+    :param int   max_paths_per_package: do not expand a package reached through more paths
+    :rtype: DepsTree
     """
-    DEPENDENCIES = 'dependencies'
-    VERSION = 'version'
-    NAME = 'name'
-    DIR_VERSION = '1.0.0'
-    FROM = 'from'
-
-    tree = OrderedDict(
-        sorted(
-            [(k, sorted(v, key=attrgetter('key'))) for k, v in dist_tree.items()]
-            , key=lambda kv: kv[0].key
-        )
-    )
-    nodes = tree.keys()
-    key_tree = dict((k.key, v) for k, v in tree.items())
-
-    top_level_req_lower_names = [p.name.lower() for p in top_level_requirements]
-    top_level_req_dists = [p for p in nodes if p.key in top_level_req_lower_names]
-
-    def _create_children_recursive(root_package, ancestors):
-        root_name = root_package[NAME]
-        if root_name.lower() not in key_tree:
-            msg = 'Required packages missing: ' + root_name
-            if allow_missing:
-                log.error(msg)
-                return
-            else:
-                sys.exit(msg)
+    bounds = TreeBounds(max_depth, max_paths_per_package)
+    dependencies = list(_iter_top_level_nodes(
+        dist_tree, top_level_requirements, allow_missing, only_provenance, bounds))
+    name, version = _root_name_version(req_file_path)
+    return DepsTree(DepNode(name, version, unique_children(dependencies)), bounds.truncated_count)
 
-        ancestors = ancestors.copy()
-        ancestors.add(root_name.lower())
-        children_dists = key_tree[root_name.lower()]
-        for child_dist in children_dists:
-            if child_dist.key in ancestors:
-                continue
 
-            child_node = _create_tree_node(child_dist, root_package)
-            _create_children_recursive(child_node, ancestors)
-            root_package[DEPENDENCIES][child_node[NAME]] = child_node
-        return root_package
-
-    def _create_root():
-        name, version = None, None
-        if os.path.basename(req_file_path) == 'setup.py':
-            with open(req_file_path, "r") as setup_py_file:
-                name, version = setup_file.parse_name_and_version(setup_py_file.read())
-
-        root = {
-            NAME: name or os.path.basename(os.path.dirname(os.path.abspath(req_file_path))),
-            VERSION: version or DIR_VERSION,
-            DEPENDENCIES: {}
-        }
-        root[FROM] = [root[NAME] + '@' + root[VERSION]]
-        return root
-
-    def _create_tree_node(dist_node, parent):
-        version = dist_node.version
-        if isinstance(version, tuple):
-            version = '.'.join(map(str, version))
-        return {
-            NAME: dist_node.project_name,
-            VERSION: version,
-            FROM: parent[FROM] + [dist_node.project_name + '@' + version],
-            DEPENDENCIES: {}
-        }
-
-    tree_root = _create_root()
-    for dist in top_level_req_dists:
-        tree_node = _create_tree_node(dist, tree_root)
-        if only_provenance:
-            tree_root[DEPENDENCIES][tree_node[NAME]] = tree_node
-        else:
-            tree_root[DEPENDENCIES][tree_node[NAME]] = _create_children_recursive(tree_node, set([]))
-    return tree_root
+def iter_deps_tree_shards(
+        dist_tree,
+        top_level_requirements,
+        req_file_path,
+        allow_missing=False,
+        only_provenance=False,
+        bounds=None
+):
+    """Build the dist dependencies tree one shard at a time, a shard is the
+    root with a single top-level dependency. The shards together are the
+    tree build_deps_tree() builds.
+    :param DistTree dist_tree: the installed dists tree, a dict of
+        installed dist => required dists is also accepted
+    :param list  top_level_requirements: list of required dists
+    :param str   req_file_path: path to the dependencies file (e.g. requirements.txt)
+    :param bool  allow_missing: ignore uninstalled dependencies
+    :param bool  only_provenance: only care provenance dependencies
+    :param TreeBounds bounds: bounded expansion shared by the shards,
+        its truncated_count is complete once the shards are all built
+    :returns: generator of DepsTree
+    """
+    bounds = bounds or TreeBounds()
+    name, version = _root_name_version(req_file_path)
+    for node in _iter_top_level_nodes(dist_tree, top_level_requirements, allow_missing, only_provenance, bounds):
+        yield DepsTree(DepNode(name, version, (node,)))
 
 
-def create_dependencies_tree_by_req_file(
-        requirements_file,
+def split_deps_tree(deps_tree):
+    """Split a built dependencies tree into shards, see iter_deps_tree_shards()
+    :param DepsTree deps_tree: the dependencies tree
+    :rtype: list
+    """
+    root = deps_tree.root
+    return [DepsTree(DepNode(root.name, root.version, (node,))) for node in root.dependencies]
+
+
+def create_deps_tree(
+        dist_tree,
+        top_level_requirements,
+        req_file_path,
         allow_missing=False,
-        only_provenance=False
+        only_provenance=False,
+        max_depth=None,
+        max_paths_per_package=None
 ):
-    """Create dist dependencies tree from file
-    :param str   requirements_file: path to the dependencies file (e.g. requirements.txt)
+    """Create dist dependencies tree
+    :param DistTree dist_tree: the installed dists tree, a dict of
+        installed dist => required dists is also accepted
+    :param list  top_level_requirements: list of required dists
+    :param str   req_file_path: path to the dependencies file (e.g. requirements.txt)
     :param bool  allow_missing: ignore uninstalled dependencies
     :param bool  only_provenance: only care provenance dependencies
+    :param int   max_depth: do not expand dependencies deeper than this
+    :param int   max_paths_per_package: do not expand a package reached through more paths
     :rtype: dict
     """
-
-    # get all installed package distribution object list
-    dists = list(pkg_resources.working_set)
-    dists_dict = dict((p.key, p) for p in dists)
-    dists_tree = dict((p, [ReqDist(r, dists_dict.get(r.key)) for r in p.requires()]) for p in dists_dict.values())
-
-    required = get_requirements_list(requirements_file)
-    installed = [utils.canonicalize_dist_name(d) for d in dists_dict]
+    return build_deps_tree(
+        dist_tree, top_level_requirements, req_file_path, allow_missing, only_provenance,
+        max_depth, max_paths_per_package).to_dict()
+
+
+def _load_requirements(requirements_file, allow_missing, backend, index_file, use_index, guess_by_import,
+                       include_dev=False):
+    # get all installed package distribution objects,
+    # their requirements are only loaded once reached from the required dists
+    dists_backend = dist_backend.get_backend(backend)
+    dists_dict = None
+    if use_index and dists_backend.name == dist_backend.ImportlibBackend.name:
+        dists_dict = dist_index.indexed_installed_dists(index_file)
+    if dists_dict is None:
+        dists_dict = dists_backend.installed_dists()
+    # required dists are matched to the installed ones PEP 503 normalized
+    dists_tree = DistTree(
+        dists_dict, lambda p: [ReqDist(r, dists_tree.find(r.project_name), guess_by_import) for r in p.requires()])
+
+    required = get_requirements_list(requirements_file, include_dev)
     top_level_requirements = []
     missing_package_names = []
     for r in required:
-        if utils.canonicalize_dist_name(r.name) not in installed:
+        if dists_tree.find(r.name) is None:
             missing_package_names.append(r.name)
         else:
             top_level_requirements.append(r)
@@ -169,96 +209,542 @@ def create_dependencies_tree_by_req_file(
             log.error(msg)
         else:
             sys.exit(msg)
+    return dists_tree, top_level_requirements
 
-    return create_deps_tree(
-        dists_tree, top_level_requirements, requirements_file, allow_missing, only_provenance)
 
+def build_lock_deps_tree(lock_file, include_dev=False):
+    """Build the dependencies tree of a Pipfile.lock, the installed dists
+    are not read. The lock file has no dependency edges, every locked
+    package is a dependency of the root.
+    :param str   lock_file: path to the Pipfile.lock
+    :param bool  include_dev: with the ``develop`` packages
+    :rtype: DepsTree
+    """
+    dependencies = []
+    for r in sorted(get_requirements_list(lock_file, include_dev), key=lambda r: utils.canonical_name(r.name)):
+        # "==1.0", "===1.0" for arbitrary equality, a local path is not pinned
+        version = (r.version or '').lstrip('=')
+        if version and version != '*':
+            dependencies.append(DepNode(r.name, version))
+    name, version = _root_name_version(lock_file)
+    return DepsTree(DepNode(name, version, unique_children(dependencies)))
 
-def render_response(response_json):
 
-    def _print_single_vuln(vuln):
-        log.error("✗ {} severity vulnerability ({} - {}) found on {}@{}".format(
-            vuln.get('severity'),
-            vuln.get('title', ''),
-            vuln.get('cve', ''),
-            vuln.get('packageName'),
-            vuln.get('version'))
-        )
-        if vuln.get('from', None):
-            from_arr = vuln.get('from')
-            from_str = ""
-            for _from in from_arr:
-                from_str += _from + " > "
-            from_str = from_str[:-3]
-            print("- from: {}".format(from_str))
-        if vuln.get('target_version', []):
-            log.info("! Fix version {}".format(vuln.get('target_version')))
-        print("")
+def build_dependencies_tree_by_req_file(
+        requirements_file,
+        allow_missing=False,
+        only_provenance=False,
+        backend=None,
+        index_file=None,
+        use_index=True,
+        guess_by_import=False,
+        max_depth=None,
+        max_paths_per_package=None,
+        include_dev=False
+):
+    """Create dist dependencies tree from file
+    :param str   requirements_file: path to the dependencies file (e.g. requirements.txt)
+    :param bool  allow_missing: ignore uninstalled dependencies
+    :param bool  only_provenance: only care provenance dependencies
+    :param str   backend: installed dists backend, importlib or pkg_resources
+    :param str   index_file: installed dists index file, see `mosec index`
+    :param bool  use_index: use the installed dists index file when it exists
+    :param bool  guess_by_import: import uninstalled required packages to guess their version
+    :param int   max_depth: do not expand dependencies deeper than this
+    :param int   max_paths_per_package: do not expand a package reached through more paths
+    :param bool  include_dev: with the development dependencies of a Pipfile or Pipfile.lock
+    :rtype: DepsTree
+    """
+    if is_lock_file(requirements_file):
+        return build_lock_deps_tree(requirements_file, include_dev)
+    dists_tree, top_level_requirements = _load_requirements(
+        requirements_file, allow_missing, backend, index_file, use_index, guess_by_import, include_dev)
+    return build_deps_tree(
+        dists_tree, top_level_requirements, requirements_file, allow_missing, only_provenance,
+        max_depth, max_paths_per_package)
 
-    if response_json.get('ok', False):
-        log.info("✓ Tested {} dependencies for known vulnerabilities, no vulnerable paths found."
-                 .format(response_json.get('dependencyCount', 0)))
-    elif response_json.get('vulnerabilities', None):
-        vulns = response_json.get('vulnerabilities')
-        for vuln in vulns:
-            _print_single_vuln(vuln)
 
-        log.warn("Tested {} dependencies for known vulnerabilities, found {} vulnerable paths."
-                 .format(response_json.get('dependencyCount', 0), len(vulns)))
+def iter_dependencies_tree_shards_by_req_file(
+        requirements_file,
+        allow_missing=False,
+        only_provenance=False,
+        backend=None,
+        index_file=None,
+        use_index=True,
+        guess_by_import=False,
+        bounds=None,
+        include_dev=False
+):
+    """Build the dist dependencies tree from file one shard at a time,
+    see build_dependencies_tree_by_req_file() and iter_deps_tree_shards()
+    :returns: generator of DepsTree
+    """
+    if is_lock_file(requirements_file):
+        return iter(split_deps_tree(build_lock_deps_tree(requirements_file, include_dev)))
+    dists_tree, top_level_requirements = _load_requirements(
+        requirements_file, allow_missing, backend, index_file, use_index, guess_by_import, include_dev)
+    return iter_deps_tree_shards(
+        dists_tree, top_level_requirements, requirements_file, allow_missing, only_provenance, bounds)
 
 
-def run(args):
-    deps_tree = create_dependencies_tree_by_req_file(
-        args.requirements,
-        allow_missing=args.allow_missing,
-        only_provenance=args.only_provenance,
+def create_dependencies_tree_by_req_file(requirements_file, allow_missing=False, only_provenance=False, **kwargs):
+    """Create dist dependencies tree from file, see build_dependencies_tree_by_req_file()
+    :rtype: dict
+    """
+    return build_dependencies_tree_by_req_file(
+        requirements_file, allow_missing, only_provenance, **kwargs).to_dict()
+
+
+def render_vulnerability(vuln):
+    log.error("✗ {} severity vulnerability ({} - {}) found on {}@{}".format(
+        vuln.get('severity'),
+        vuln.get('title', ''),
+        vuln.get('cve', ''),
+        vuln.get('packageName'),
+        vuln.get('version'))
     )
+    if vuln.get('from', None):
+        from_arr = vuln.get('from')
+        from_str = ""
+        for _from in from_arr:
+            from_str += _from + " > "
+        from_str = from_str[:-3]
+        print("- from: {}".format(from_str))
+    if vuln.get('target_version', []):
+        log.info("! Fix version {}".format(vuln.get('target_version')))
+    print("")
+
+
+def render_vulnerabilities(vulns, fail_fast_level=None):
+    """Render vulnerabilities as they come
+    :param iterable vulns: vulnerabilities
+    :param str fail_fast_level: stop after the first vulnerability at or
+        above this severity level
+    :returns: (number of vulnerabilities rendered, whether it stopped early)
+    """
+    count = 0
+    for vuln in vulns:
+        render_vulnerability(vuln)
+        count += 1
+        if fail_fast_level and utils.severity_rank(vuln.get('severity')) >= utils.severity_rank(fail_fast_level):
+            return count, True
+    return count, False
+
+
+def render_summary(dependency_count, vuln_count, stopped=False):
+    if stopped:
+        log.warn("Stopped at the first vulnerable path at or above the severity level (--fail-fast).")
+    elif vuln_count:
+        log.warn("Tested {} dependencies for known vulnerabilities, found {} vulnerable paths."
+                 .format(dependency_count, vuln_count))
+    else:
+        log.info("✓ Tested {} dependencies for known vulnerabilities, no vulnerable paths found."
+                 .format(dependency_count))
 
-    deps_tree['severityLevel'] = args.level
-    deps_tree['type'] = 'pip'
-    deps_tree['language'] = 'python'
 
-    log.debug(json.dumps(deps_tree, indent=2))
+def response_records(response_json):
+    """Records of a JSON response of the API, the same as an NDJSON response:
+    the vulnerabilities, then the summary holding ``ok``
+    :raises ValueError: when the response is not a JSON object
+    """
+    if not isinstance(response_json, dict):
+        raise ValueError("API return data format error.")
+    if not response_json.get('ok', False):
+        for vuln in response_json.get('vulnerabilities') or ():
+            yield vuln
+    yield OrderedDict([
+        ('ok', response_json.get('ok', False)),
+        ('dependencyCount', response_json.get('dependencyCount', 0)),
+    ])
+
+
+def iter_ndjson_records(lines):
+    for line in lines:
+        if line.strip():
+            yield json.loads(line.decode('utf-8'))
+
+
+def render_records(records, fail_fast_level=None):
+    """Render the records of an API response as they arrive
+    :param iterable records: vulnerabilities, then the summary holding ``ok``
+    :param str fail_fast_level: stop after the first vulnerability at or
+        above this severity level
+    :returns: True when no vulnerability was found
+    :raises ValueError: when a record is not a JSON object or the summary is missing
+    """
+    summary = {}
+
+    def _vulns():
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError("API return data format error.")
+            if 'ok' in record:
+                summary.update(record)
+            else:
+                yield record
+
+    count, stopped = render_vulnerabilities(_vulns(), fail_fast_level)
+    if stopped:
+        render_summary(0, count, stopped)
+        return False
+    if not summary:
+        raise ValueError("API return data format error.")
+    if summary.get('ok', False) or count:
+        render_summary(summary.get('dependencyCount', 0), count)
+    return summary.get('ok', False)
+
+
+def render_response(response_json, fail_fast_level=None):
+    """Render the JSON response of the API
+    :returns: True when no vulnerability was found
+    """
+    return render_records(response_records(response_json), fail_fast_level)
 
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
 
-    req = urllib.request.Request(
-        method='POST',
-        url=args.endpoint,
-        headers={
-            'Content-Type': 'application/json'
-        },
-        data=bytes(json.dumps(deps_tree).encode('utf-8'))
-    )
+def render_ndjson_response(lines, fail_fast_level=None):
+    """Render an NDJSON response of the API as its records arrive, one per
+    vulnerability, then the summary record holding ``ok``
+    :param iterable lines: lines of the response body
+    :returns: True when no vulnerability was found
+    """
+    return render_records(iter_ndjson_records(lines), fail_fast_level)
+
+
+def open_merkle_response(client, url, deps_tree, fields, compress=False, accept=ACCEPT_RESPONSE_TYPES):
+    """Upload a dependencies tree with the merkle payload format: the
+    subtree hashes first, then the subtrees the API does not store yet
+    :param transport.Transport client: the transport
+    :param str url: API url
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param bool compress: gzip the request bodies
+    :param str accept: value of the Accept header
+    :returns: the response holding the result
+    """
+    root_hash, records = subtree_nodes(deps_tree)
+    payload = merkle_payload(deps_tree, root_hash, fields, hashes=list(records))
+    for _ in range(MERKLE_MAX_ROUNDS):
+        response = client.open_json(url, json.dumps(payload).encode('utf-8'), compress, accept)
+        if response.content_type == transport.NDJSON_TYPE:
+            return response
+        with response:
+            body = response.read()
+        response_json = json.loads(body.decode('utf-8'))
+        if UNKNOWN_HASHES not in response_json:
+            return transport.Response(response.status, response.reason, response.headers, body)
+
+        nodes = OrderedDict((h, records[h]) for h in response_json[UNKNOWN_HASHES] if h in records)
+        log.debug("{} of {} subtrees are unknown to the API".format(len(nodes), len(records)))
+        payload = merkle_payload(deps_tree, root_hash, fields, nodes=nodes)
+    raise ValueError("API return data format error.")
+
+
+def open_payload_response(client, url, deps_tree, fields, payload_format=TREE_FORMAT, compress=False, stream=False):
+    """Upload a dependencies tree
+    :param transport.Transport client: the transport
+    :param str url: API url
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param str payload_format: tree, graph or merkle
+    :param bool compress: gzip the request body
+    :param bool stream: serialize the payload while it is sent
+    :returns: the response holding the result
+    """
+    if payload_format == MERKLE_FORMAT:
+        return open_merkle_response(client, url, deps_tree, fields, compress=compress)
+    if stream:
+        # serialized while being sent, the whole payload is never in memory
+        payload = lambda: encode_chunks(iter_payload(deps_tree, fields, payload_format))  # noqa: E731
+    else:
+        payload = encode_payload(deps_tree, fields, payload_format).encode('utf-8')
+    return client.open_json(url, payload, compress=compress, accept=ACCEPT_RESPONSE_TYPES)
+
+
+def iter_response_records(response):
+    """Records of an API response, NDJSON or JSON, see response_records()"""
+    if response.content_type == transport.NDJSON_TYPE:
+        return iter_ndjson_records(response.iter_lines())
+    return response_records(json.loads(response.read().decode('utf-8')))
+
+
+class ShardedResult(object):
+    """Merged responses of the shards of a dependencies tree
+
+    Every distinct package of the shards is counted once in
+    ``dependencyCount``, like the API counts the packages of the whole
+    tree, and a vulnerability reported by several shards is kept once.
+    """
+
+    def __init__(self):
+        self.packages = set()
+        self.ok = True
+        self._seen = set()
+
+    def add_shard(self, shard):
+        for node in shard.distinct_nodes():
+            if node.dependencies is None:
+                # not installed, the API does not count it
+                continue
+            self.packages.add((utils.canonical_name(node.name), node.version))
+
+    def merge(self, records):
+        """Fold the summary of a shard response
+        :param iterable records: vulnerabilities, then the summary holding ``ok``
+        :returns: generator of the vulnerabilities not seen yet
+        """
+        for record in records:
+            if 'ok' in record:
+                self.ok = self.ok and bool(record.get('ok'))
+                continue
+            key = json.dumps(record, sort_keys=True)
+            if key not in self._seen:
+                self._seen.add(key)
+                yield record
+
+    def summary(self):
+        return OrderedDict([
+            ('ok', self.ok and not self._seen),
+            ('dependencyCount', len(self.packages)),
+        ])
+
+
+def _upload_shard(client, url, shard, fields, payload_format, compress, stream):
+    with open_payload_response(client, url, shard, fields, payload_format, compress, stream) as response:
+        return list(iter_response_records(response))
+
+
+def iter_sharded_records(
+        client,
+        url,
+        shards,
+        fields,
+        payload_format=TREE_FORMAT,
+        compress=False,
+        stream=False,
+        workers=DEFAULT_SHARD_WORKERS
+):
+    """Upload the shards of a dependencies tree concurrently, each one as
+    soon as it is built, and merge the responses
+    :param transport.Transport client: the transport, shared by the workers,
+        closed when the records are not consumed to the end
+    :param str url: API url
+    :param iterable shards: DepsTree shards, see iter_deps_tree_shards()
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param str payload_format: tree, graph or merkle
+    :param bool compress: gzip the request bodies
+    :param bool stream: serialize the payloads while they are sent
+    :param int workers: concurrent uploads
+    :returns: generator of the merged records, the vulnerabilities of a
+        shard as soon as its response arrives, then the summary, see ShardedResult
+    """
+    result = ShardedResult()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = set()
     try:
-        response = urllib.request.urlopen(req, timeout=15, context=ctx)
-        response_json = json.loads(response.read().decode('utf-8'))
-        render_response(response_json)
+        for shard in shards:
+            result.add_shard(shard)
+            pending.add(executor.submit(_upload_shard, client, url, shard, fields, payload_format, compress, stream))
+            # responses which arrived while the shard was built
+            for future in [f for f in pending if f.done()]:
+                pending.discard(future)
+                for record in result.merge(future.result()):
+                    yield record
+        for future in as_completed(list(pending)):
+            pending.discard(future)
+            for record in result.merge(future.result()):
+                yield record
+    finally:
+        if pending:
+            # stopped early (--fail-fast) or failed, the shards not uploaded
+            # yet are dropped and the uploads in flight aborted, so that the
+            # workers are done by the time the process exits
+            for future in pending:
+                future.cancel()
+            client.close()
+        executor.shutdown(wait=False)
+    yield result.summary()
+
+
+def _warn_truncated(truncated_count):
+    if truncated_count:
+        log.warn("{} dependencies were not expanded because of --max-depth / --max-paths-per-package."
+                 .format(truncated_count))
+
+
+def write_payload_file(path, deps_tree, fields, payload_format=TREE_FORMAT):
+    """Write the payload run() would send to a gzip compressed file, see `mosec upload`
+    :param str path: the payload file
+    :param DepsTree deps_tree: the dependencies tree
+    :param dict fields: more fields of the payload, e.g. severityLevel
+    :param str payload_format: tree, graph or merkle, a merkle payload holds every node
+    """
+    with gzip.open(path, 'wb', compresslevel=transport.GZIP_LEVEL) as f:
+        write_payload(f, deps_tree, fields, payload_format)
 
-        if not response_json.get('ok', False):
+
+def read_payload_file(path):
+    """Read a payload file, gzip compressed or not
+    :returns: (payload bytes, content encoding or None)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:2] == GZIP_MAGIC:
+        return data, transport.GZIP
+    return data, None
+
+
+def run(args):
+    build_options = _build_options(args)
+    payload_fields = OrderedDict([
+        ('severityLevel', args.level),
+        ('type', 'pip'),
+        ('language', 'python'),
+    ])
+
+    if args.output_payload:
+        # collected here, uploaded later by `mosec upload`
+        deps_tree = build_dependencies_tree_by_req_file(
+            args.requirements,
+            max_depth=args.max_depth,
+            max_paths_per_package=args.max_paths_per_package,
+            **build_options
+        )
+        _warn_truncated(deps_tree.truncated_count)
+        write_payload_file(args.output_payload, deps_tree, payload_fields, args.payload_format)
+        log.info("✓ Payload written to {}".format(args.output_payload))
+        return 0
+
+    client = transport.Transport(
+        connect_timeout=args.connect_timeout,
+        timeout=args.timeout,
+        retries=args.retries,
+        pool_size=max(transport.DEFAULT_POOL_SIZE, args.shards or 0),
+    )
+    # DNS and TLS handshake while the dependencies tree is built
+    client.warm_up(args.endpoint)
+
+    fail_fast_level = args.level if args.fail_fast else None
+    use_cache = args.cache or args.cache_dir
+    bounds = TreeBounds(args.max_depth, args.max_paths_per_package)
+    lookup = None
+    shards = None
+
+    if args.shards and not use_cache:
+        # every shard is uploaded as soon as it is built
+        deps_tree = None
+        shards = iter_dependencies_tree_shards_by_req_file(args.requirements, bounds=bounds, **build_options)
+    else:
+        # the cache lookup needs the whole tree
+        deps_tree = build_dependencies_tree_by_req_file(
+            args.requirements,
+            max_depth=args.max_depth,
+            max_paths_per_package=args.max_paths_per_package,
+            **build_options
+        )
+        _warn_truncated(deps_tree.truncated_count)
+
+        if use_cache:
+            cache = verdict_cache.VerdictCache(args.cache_dir, args.cache_ttl)
+            lookup = cache.lookup(deps_tree, args.level)
+            log.debug("{} packages with a cached verdict, {} to check".format(
+                len(lookup.cached), len(lookup.uncached)))
+            deps_tree = lookup.tree
+
+        if deps_tree is None:
+            # every verdict is cached
+            client.close()
+            if not render_records(lookup.merge_records(response_records({'ok': True})), fail_fast_level):
+                return 1
+            return
+
+        if args.shards:
+            shards = split_deps_tree(deps_tree)
+        if log.is_debug_enabled():
+            payload_text = encode_payload(deps_tree, payload_fields, args.payload_format)
+            log.debug(json.dumps(json.loads(payload_text, object_pairs_hook=OrderedDict), indent=2))
+
+    try:
+        with client:
+            if shards is not None:
+                with closing(iter_sharded_records(
+                        client, args.endpoint, shards, payload_fields, args.payload_format,
+                        compress=args.compress, stream=args.stream, workers=args.shards)) as records:
+                    if lookup is not None:
+                        records = lookup.merge_records(records)
+                    ok = render_records(records, fail_fast_level)
+                if deps_tree is None:
+                    _warn_truncated(bounds.truncated_count)
+            else:
+                with open_payload_response(client, args.endpoint, deps_tree, payload_fields, args.payload_format,
+                                           compress=args.compress, stream=args.stream) as response:
+                    records = iter_response_records(response)
+                    if lookup is not None:
+                        records = lookup.merge_records(records)
+                    ok = render_records(records, fail_fast_level)
+
+        if not ok:
             return 1
-    except urllib.error.HTTPError as e:
+    except (transport.HTTPError, OSError, http.client.HTTPException) as e:
         raise Exception("Network Error: {}".format(e))
-    except json.JSONDecodeError as e:
+    except ValueError:
+        # JSONDecodeError included
         raise Exception("API return data format error.")
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("requirements",
-                        help="依赖文件 (requirements.txt 或 Pipfile)")
-    parser.add_argument("--endpoint",
-                        action="store",
-                        required=True,
-                        help="上报API")
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is not a positive integer".format(value))
+    return number
+
+
+def _positive_float(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError("{} is not a positive number".format(value))
+    return number
+
+
+def _scan_arguments():
+    """Options of the dependencies scan, shared by `mosec` and `mosec batch`"""
+    parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument("--allow-missing",
                         action="store_true",
                         help="忽略未安装的依赖")
     parser.add_argument("--only-provenance",
                         action="store_true",
                         help="仅检查直接依赖")
+    parser.add_argument("--dev",
+                        action="store_true",
+                        help="同时检查 Pipfile 的 dev-packages 或 Pipfile.lock 的 develop 依赖")
+    parser.add_argument("--max-depth",
+                        action="store",
+                        type=_positive_int,
+                        default=None,
+                        help="依赖树最大展开深度, 直接依赖深度为 1")
+    parser.add_argument("--max-paths-per-package",
+                        action="store",
+                        type=_positive_int,
+                        default=None,
+                        help="同一依赖最多展开的路径数")
+    parser.add_argument("--dist-backend",
+                        action="store",
+                        choices=sorted(dist_backend.BACKENDS),
+                        default=None,
+                        help="已安装依赖的读取方式 [importlib|pkg_resources]. default: importlib")
+    parser.add_argument("--index-file",
+                        action="store",
+                        default=None,
+                        help="已安装依赖的索引文件, 存在时使用. default: ~/.cache/mosec/dist-index-<环境哈希>.json")
+    parser.add_argument("--no-index",
+                        action="store_true",
+                        help="不使用已安装依赖的索引文件")
+    parser.add_argument("--guess-version-by-import",
+                        action="store_true",
+                        help="通过 import 模块获取未安装依赖的版本")
+    parser.add_argument("--compress",
+                        action="store_true",
+                        help="gzip 压缩上报数据, 服务端不支持时自动改为不压缩上报")
     parser.add_argument("--level",
                         action="store",
                         default="High",
@@ -266,10 +752,269 @@ def main():
     parser.add_argument("--debug",
                         action="store_true",
                         default=False)
-    args = parser.parse_args()
+    return parser
+
+
+def _connection_arguments():
+    """Options of the connection to the API, shared by every command uploading"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--connect-timeout",
+                        action="store",
+                        type=float,
+                        default=transport.DEFAULT_CONNECT_TIMEOUT,
+                        help="连接上报API的超时时间(秒). default: {}".format(transport.DEFAULT_CONNECT_TIMEOUT))
+    parser.add_argument("--timeout",
+                        action="store",
+                        type=float,
+                        default=transport.DEFAULT_TIMEOUT,
+                        help="等待上报API返回的超时时间(秒). default: {}".format(transport.DEFAULT_TIMEOUT))
+    parser.add_argument("--retries",
+                        action="store",
+                        type=int,
+                        default=transport.DEFAULT_RETRIES,
+                        help="上报API返回 5xx 或连接断开时的重试次数. default: {}".format(transport.DEFAULT_RETRIES))
+    return parser
+
+
+def _build_options(args):
+    """Options of build_dependencies_tree_by_req_file(), from the scan arguments"""
+    return dict(
+        allow_missing=args.allow_missing,
+        only_provenance=args.only_provenance,
+        backend=args.dist_backend,
+        index_file=args.index_file,
+        use_index=not args.no_index,
+        guess_by_import=args.guess_version_by_import,
+        include_dev=args.dev,
+    )
+
+
+def run_index(args):
+    index = dist_index.build_index(args.index_file, args.path or None)
+    log.info("✓ Indexed {} installed dists in {} ({} reused, {} loaded, {} removed)".format(
+        len(index.entries), index.path,
+        index.stats['reused'], index.stats['loaded'], index.stats['removed']))
+    return 0
+
+
+def index_main(argv):
+    parser = argparse.ArgumentParser(prog="mosec index",
+                                     description="预先生成已安装依赖的索引文件")
+    parser.add_argument("--index-file",
+                        action="store",
+                        default=None,
+                        help="索引文件. default: ~/.cache/mosec/dist-index-<环境哈希>.json")
+    parser.add_argument("--path",
+                        action="append",
+                        help="索引的目录, 可多次指定. default: sys.path")
+    args = parser.parse_args(argv)
+    return run_index(args)
+
+
+def run_batch(args):
+    payload_fields = OrderedDict([
+        ('severityLevel', args.level),
+        ('type', 'pip'),
+        ('language', 'python'),
+    ])
+    payloads = []
+    for requirements in args.requirements:
+        deps_tree = build_dependencies_tree_by_req_file(
+            requirements,
+            max_depth=args.max_depth,
+            max_paths_per_package=args.max_paths_per_package,
+            **_build_options(args)
+        )
+        _warn_truncated(deps_tree.truncated_count)
+        payloads.append((requirements, encode_payload(deps_tree, payload_fields, args.payload_format).encode('utf-8')))
+
+    start = time.monotonic()
+    results = batch.submit_batch(
+        args.endpoint,
+        payloads,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        burst=args.burst,
+        compress=args.compress,
+        connect_timeout=args.connect_timeout,
+        timeout=args.timeout,
+        retries=args.retries,
+    )
+    elapsed = time.monotonic() - start
+
+    failed = 0
+    for result in results:
+        log.info("{} ({:.0f} ms)".format(result.name, result.latency * 1000))
+        if result.error is not None:
+            log.error("Network Error: {}".format(result.error))
+            ok = False
+        else:
+            try:
+                ok = render_response(result.json())
+            except ValueError:
+                log.error("API return data format error.")
+                ok = False
+        if not ok:
+            failed += 1
+        print("")
+
+    p50, p95, p99 = batch.latency_percentiles([result.latency for result in results])
+    log.info("Submitted {} scans in {:.2f}s ({:.1f}/s), latency p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms".format(
+        len(results), elapsed, len(results) / elapsed if elapsed else 0, p50 * 1000, p95 * 1000, p99 * 1000))
+    return 1 if failed else 0
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="mosec batch",
+                                     description="并发检测多个依赖文件",
+                                     parents=[_scan_arguments(), _connection_arguments()])
+    parser.add_argument("requirements",
+                        nargs="+",
+                        help="依赖文件 (requirements.txt, Pipfile 或 Pipfile.lock)")
+    parser.add_argument("--endpoint",
+                        action="store",
+                        required=True,
+                        help="上报API")
+    parser.add_argument("--payload-format",
+                        action="store",
+                        choices=[fmt for fmt in PAYLOAD_FORMATS if fmt != MERKLE_FORMAT],
+                        default=TREE_FORMAT,
+                        help="上报数据格式 [tree|graph]. default: tree")
+    parser.add_argument("--concurrency",
+                        action="store",
+                        type=_positive_int,
+                        default=batch.DEFAULT_CONCURRENCY,
+                        help="同时进行的上报请求数上限. default: {}".format(batch.DEFAULT_CONCURRENCY))
+    parser.add_argument("--rate",
+                        action="store",
+                        type=_positive_float,
+                        default=None,
+                        help="每秒最多发起的上报请求数 (令牌桶限流). default: 不限制")
+    parser.add_argument("--burst",
+                        action="store",
+                        type=_positive_int,
+                        default=None,
+                        help="限流时允许同时发起的请求数. default: --concurrency")
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        log.set_log_level(logging.DEBUG)
+
+    return run_batch(args)
+
+
+def run_upload(args):
+    client = transport.Transport(
+        connect_timeout=args.connect_timeout,
+        timeout=args.timeout,
+        retries=args.retries,
+        pool_size=1,
+    )
+    client.warm_up(args.endpoint)
+
+    failed = 0
+    with client:
+        # one after the other on the same keep-alive connection
+        for path in args.payloads:
+            log.info(path)
+            try:
+                payload, content_encoding = read_payload_file(path)
+                with client.open_json(args.endpoint, payload, compress=args.compress, accept=ACCEPT_RESPONSE_TYPES,
+                                      content_encoding=content_encoding) as response:
+                    ok = render_records(iter_response_records(response))
+            except (transport.HTTPError, OSError, http.client.HTTPException) as e:
+                log.error("Network Error: {}".format(e))
+                ok = False
+            except ValueError:
+                log.error("API return data format error.")
+                ok = False
+            if not ok:
+                failed += 1
+            print("")
+    return 1 if failed else 0
+
+
+def upload_main(argv):
+    parser = argparse.ArgumentParser(prog="mosec upload",
+                                     description="上报 --output-payload 保存的数据文件",
+                                     parents=[_connection_arguments()])
+    parser.add_argument("payloads",
+                        nargs="+",
+                        help="上报数据文件, gzip 压缩或未压缩")
+    parser.add_argument("--endpoint",
+                        action="store",
+                        required=True,
+                        help="上报API")
+    parser.add_argument("--compress",
+                        action="store_true",
+                        help="gzip 压缩未压缩的数据文件, 压缩的数据文件总是原样上报")
+    parser.add_argument("--debug",
+                        action="store_true",
+                        default=False)
+    args = parser.parse_args(argv)
 
     if args.debug:
         log.set_log_level(logging.DEBUG)
 
-    return run(args)
+    return run_upload(args)
+
+
+SUBCOMMANDS = {
+    'index': index_main,
+    'batch': batch_main,
+    'upload': upload_main,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in SUBCOMMANDS:
+        return SUBCOMMANDS[argv[0]](argv[1:])
+
+    parser = argparse.ArgumentParser(parents=[_scan_arguments(), _connection_arguments()])
+    parser.add_argument("requirements",
+                        help="依赖文件 (requirements.txt, Pipfile 或 Pipfile.lock)")
+    parser.add_argument("--endpoint",
+                        action="store",
+                        help="上报API")
+    parser.add_argument("--output-payload",
+                        action="store",
+                        default=None,
+                        help="不上报, 将上报数据 gzip 压缩保存至文件, 由 mosec upload 上报")
+    parser.add_argument("--payload-format",
+                        action="store",
+                        choices=PAYLOAD_FORMATS,
+                        default=TREE_FORMAT,
+                        help="上报数据格式 [tree|graph|merkle], graph 为去重的节点表与边表, "
+                             "merkle 先上报子树哈希, 仅上报服务端未保存的子树. default: tree")
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="边生成边上报数据 (Transfer-Encoding: chunked), 不在内存中保存完整的上报数据")
+    parser.add_argument("--shards",
+                        action="store",
+                        type=_positive_int,
+                        default=None,
+                        help="按直接依赖拆分依赖树, 边生成边以 N 个并发分片上报, 合并检测结果")
+    parser.add_argument("--cache",
+                        action="store_true",
+                        help="缓存检测结果, 仅上报未缓存的依赖")
+    parser.add_argument("--cache-dir",
+                        action="store",
+                        default=None,
+                        help="检测结果缓存目录, 可为多台机器共享的目录, 指定时启用缓存. default: ~/.cache/mosec")
+    parser.add_argument("--cache-ttl",
+                        action="store",
+                        type=_positive_int,
+                        default=verdict_cache.DEFAULT_TTL,
+                        help="检测结果缓存有效期(秒). default: {}".format(verdict_cache.DEFAULT_TTL))
+    parser.add_argument("--fail-fast",
+                        action="store_true",
+                        help="发现第一个达到 --level 威胁等级的漏洞后立即退出")
+    args = parser.parse_args(argv)
+    if not args.endpoint and not args.output_payload:
+        parser.error("the following arguments are required: --endpoint")
+
+    if args.debug:
+        log.set_log_level(logging.DEBUG)
 
+    return run(args)
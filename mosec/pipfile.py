@@ -14,11 +14,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-"""Simplistic parsing of Pipfile dependency files
+"""Simplistic parsing of Pipfile and Pipfile.lock dependency files
 
 This only extracts a small subset of the information present in a Pipfile,
 as needed for the purposes of this library.
 """
+import json
+
 from .utils import is_string
 from .pytoml import loads as pytoml_loads
 
@@ -35,7 +37,7 @@ class PipfileRequirement(object):
         self.provenance = None  # a tuple of (file name, line)
 
     @classmethod
-    def from_dict(cls, name, requirement_dict, pos_in_toml):
+    def from_dict(cls, name, requirement_dict, pos_in_toml, filename='Pipfile'):
         req = cls(name)
 
         req.version = requirement_dict.get('version')
@@ -46,8 +48,7 @@ class PipfileRequirement(object):
                 req.vcs_uri = requirement_dict[vcs]
                 break
         req.markers = requirement_dict.get('markers')
-        # proper file name to be injected into provenance by the calling code
-        req.provenance = ('Pipfile', pos_in_toml[0], pos_in_toml[0])
+        req.provenance = (filename, pos_in_toml[0], pos_in_toml[0])
 
         return req
 
@@ -77,3 +78,27 @@ def parse(file_contents):
         ]
 
     return res
+
+
+def parse_lock(file_contents, filename='Pipfile.lock'):
+    """Parse a Pipfile.lock, every locked package is pinned with ``==``
+
+    :param str file_contents: the JSON content of the lock file
+    :param str filename: the lock file name, recorded in the provenance
+    :returns: dict of section (``default``, ``develop``) => list of
+        PipfileRequirement, sorted by name
+    """
+    data = json.loads(file_contents)
+
+    sections = ['default', 'develop']
+    res = dict.fromkeys(sections)
+    for section in sections:
+        if section not in data:
+            continue
+
+        res[section] = []
+        for name, value in sorted(data[section].items()):
+            # the lock file is JSON, no line is known
+            res[section].append(PipfileRequirement.from_dict(name, value, (None, None), filename))
+
+    return res
@@ -87,27 +87,37 @@ def loads(s, filename='<string>', translate=lambda t, x, v, pos: v, object_pairs
     return merge_tables(root, tables)
 
 class _Source:
+    # a cursor over the whole string, nothing is copied as it is consumed;
+    # the line and column of a position are only computed when asked for
     def __init__(self, s, filename=None):
         self.s = s
-        self._pos = (1, 1)
+        self._i = 0
         self._last = None
         self._filename = filename
         self.backtrack_stack = []
+        # (index, line) of the last computed position
+        self._line_mark = (0, 1)
 
     def last(self):
         return self._last
 
     def pos(self):
-        return self._pos
+        i = self._i
+        mark, line = self._line_mark
+        if i >= mark:
+            line += self.s.count('\n', mark, i)
+        else:
+            line -= self.s.count('\n', i, mark)
+        self._line_mark = (i, line)
+        return (line, i - self.s.rfind('\n', 0, i))
 
     def fail(self):
         return self._expect(None)
 
     def consume_dot(self):
-        if self.s:
-            self._last = self.s[0]
-            self.s = self[1:]
-            self._advance(self._last)
+        if self._i < len(self.s):
+            self._last = self.s[self._i]
+            self._i += 1
             return self._last
         return None
 
@@ -115,7 +125,7 @@ class _Source:
         return self._expect(self.consume_dot())
 
     def consume_eof(self):
-        if not self.s:
+        if self._i >= len(self.s):
             self._last = ''
             return True
         return False
@@ -124,10 +134,9 @@ class _Source:
         return self._expect(self.consume_eof())
 
     def consume(self, s):
-        if self.s.startswith(s):
-            self.s = self.s[len(s):]
+        if self.s.startswith(s, self._i):
+            self._i += len(s)
             self._last = s
-            self._advance(s)
             return True
         return False
 
@@ -135,11 +144,10 @@ class _Source:
         return self._expect(self.consume(s))
 
     def consume_re(self, re):
-        m = re.match(self.s)
+        m = re.match(self.s, self._i)
         if m:
-            self.s = self.s[len(m.group(0)):]
+            self._i = m.end()
             self._last = m
-            self._advance(m.group(0))
             return m
         return None
 
@@ -147,30 +155,24 @@ class _Source:
         return self._expect(self.consume_re(re))
 
     def __enter__(self):
-        self.backtrack_stack.append((self.s, self._pos))
+        self.backtrack_stack.append(self._i)
 
     def __exit__(self, type, value, traceback):
         if type is None:
             self.backtrack_stack.pop()
         else:
-            self.s, self._pos = self.backtrack_stack.pop()
+            self._i = self.backtrack_stack.pop()
         return type == TomlError
 
     def commit(self):
-        self.backtrack_stack[-1] = (self.s, self._pos)
+        self.backtrack_stack[-1] = self._i
 
     def _expect(self, r):
         if not r:
-            raise TomlError('msg', self._pos[0], self._pos[1], self._filename)
+            line, col = self.pos()
+            raise TomlError('msg', line, col, self._filename)
         return r
 
-    def _advance(self, s):
-        suffix_pos = s.rfind('\n')
-        if suffix_pos == -1:
-            self._pos = (self._pos[0], self._pos[1] + len(s))
-        else:
-            self._pos = (self._pos[0] + s.count('\n'), len(s) - suffix_pos)
-
 _ews_re = re.compile(r'(?:[ \t]|#[^\n]*\n|#[^\n]*\Z|\n)*')
 def _p_ews(s):
     s.expect_re(_ews_re)
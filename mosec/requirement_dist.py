@@ -13,18 +13,97 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from pkg_resources import Requirement
+import re
 from mosec import utils
 
+REQUIREMENT_REGEX = re.compile(
+    r'^\s*(?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*'
+    r'(?:\[(?P<extras>[^\]]*)\])?\s*'
+    r'(?P<spec>[^;]*?)\s*'
+    r'(?:;\s*(?P<marker>.*?)\s*)?$'
+)
 
-class ReqDist(Requirement):
+SPEC_REGEX = re.compile(r'^\s*(?P<op>===|~=|==|!=|<=|>=|<|>)\s*(?P<version>[^\s,()]+)\s*$')
 
-    def __init__(self, req, dist=None):
-        super(ReqDist, self).__init__(str(req))
+SAFE_NAME_REGEX = re.compile(r'[^A-Za-z0-9.]+')
+
+
+def safe_name(name):
+    """Same as pkg_resources.safe_name"""
+    return SAFE_NAME_REGEX.sub('-', name)
+
+
+class Requirement(object):
+    """A parsed PEP 508 requirement, e.g. a ``Requires-Dist`` metadata entry
+
+    Exposes the same attributes as ``pkg_resources.Requirement`` that are
+    used by this package.
+    """
+
+    def __init__(self, name, extras=(), specs=(), url=None, marker=None):
+        self.unsafe_name = name
+        self.project_name = safe_name(name)
+        self.key = self.project_name.lower()
+        self.extras = tuple(extras)
+        self.specs = list(specs)
+        self.url = url
+        self.marker = marker
+
+    def __repr__(self):
+        return '<Requirement: "{}">'.format(self.project_name)
+
+
+def parse_requirement(line):
+    """Parse a requirement specifier without pkg_resources
+    :param str line: e.g. ``requests[socks] (>=2.0,<3) ; python_version >= "3"``
+    :returns: a Requirement, or None if the line can not be parsed
+    """
+    match = REQUIREMENT_REGEX.match(line)
+    if match is None:
+        return None
+
+    extras = match.group('extras')
+    extras = [e.strip() for e in extras.split(',') if e.strip()] if extras else []
+    spec = match.group('spec')
+    url = None
+    specs = []
+    if spec.startswith('@'):
+        url = spec[1:].strip()
+    elif spec:
+        if spec.startswith('(') and spec.endswith(')'):
+            spec = spec[1:-1]
+        for part in spec.split(','):
+            spec_match = SPEC_REGEX.match(part)
+            if spec_match is None:
+                return None
+            specs.append((spec_match.group('op'), spec_match.group('version')))
+
+    return Requirement(match.group('name'), extras, specs, url, match.group('marker'))
+
+
+class ReqDist(object):
+    """A required dist and the installed dist resolving it, if any
+
+    :param req: a parsed Requirement or a ``pkg_resources.Requirement``
+    :param dist: the installed dist
+    :param bool guess_by_import: import the module to guess the version of
+        a required dist which is not installed
+    """
+
+    def __init__(self, req, dist=None, guess_by_import=False):
+        self.unsafe_name = getattr(req, 'unsafe_name', req.project_name)
+        self.project_name = req.project_name
+        self.key = req.key
+        self.extras = tuple(req.extras)
+        self.specs = list(req.specs)
         self.dist = dist
+        self.guess_by_import = guess_by_import
+
+    def __repr__(self):
+        return '<ReqDist: "{}">'.format(self.project_name)
 
     @property
     def version(self):
         if not self.dist:
-            return utils.guess_version(self.key)
+            return utils.guess_version(self.key, allow_import=self.guess_by_import)
         return self.dist.version
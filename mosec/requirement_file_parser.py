@@ -16,13 +16,22 @@ limitations under the License.
 import re
 import sys
 import os
+import warnings
 from operator import le, lt, gt, ge, eq, ne
 from mosec import pipfile
 from mosec import requirements
 from mosec import setup_file
-from pkg_resources._vendor.packaging.version import parse as version_parser
+from mosec.utils import NameIndex, canonical_name
 
-PYTHON_MARKER_REGEX = re.compile(r'python_version\s*(?P<operator>==|<=|=>|>|<)\s*[\'"](?P<python_version>.+?)[\'"]')
+try:
+    from packaging.version import parse as version_parser
+except ImportError:
+    try:
+        from pip._vendor.packaging.version import parse as version_parser
+    except ImportError:
+        from pkg_resources._vendor.packaging.version import parse as version_parser
+
+PYTHON_MARKER_REGEX = re.compile(r'python_version\s*(?P<operator>==|!=|<=|>=|<|>)\s*[\'"](?P<python_version>.+?)[\'"]')
 SYSTEM_MARKER_REGEX = re.compile(r'sys_platform\s*==\s*[\'"](.+)[\'"]')
 
 
@@ -41,8 +50,10 @@ def satisfies_python_version(parsed_operator, py_version_str):
 
 
 def get_markers_text(requirement):
+    """Markers of a requirement, after a ``;`` like in a requirements.txt line"""
     if isinstance(requirement, pipfile.PipfileRequirement):
-        return requirement.markers
+        # Pipfile and Pipfile.lock markers are bare, without the requirement
+        return '; ' + requirement.markers if requirement.markers else None
     return requirement.line
 
 
@@ -89,16 +100,93 @@ def matches_environment(requirement):
     return True
 
 
+def _version_constraint(requirement):
+    """Version specifiers and markers of a requirement, to compare the
+    requirements of the same package
+    """
+    if isinstance(requirement, pipfile.PipfileRequirement):
+        version = requirement.version if requirement.version != '*' else None
+        return version, requirement.markers
+    markers_text = get_markers_text(requirement)
+    markers = markers_text.split(';', 1)[1].strip() if markers_text and ';' in markers_text else None
+    return sorted(requirement.specs), markers
+
+
+def unique_requirements(req_list):
+    """The first requirement of every package, in order. A package required
+    again with other versions or markers is warned about, only the first
+    requirement is checked
+    :param list req_list: requirements
+    :rtype: list
+    """
+    index = NameIndex(name=lambda r: r.name)
+    unique = []
+    for r in req_list:
+        first = index.get(r.name)
+        if first is None:
+            index.add(r)
+            unique.append(r)
+        elif _version_constraint(first) != _version_constraint(r):
+            warnings.warn("{} is required more than once with other versions or markers ({} and {}), "
+                          "only the first one is checked.".format(first.name, _describe(first), _describe(r)))
+    return unique
+
+
+def _describe(requirement):
+    provenance = requirement.provenance
+    if provenance is None:
+        return requirement.name
+    filename, start = provenance[0], provenance[1]
+    return '{}:{}'.format(os.path.basename(filename) if filename else '<string>', start)
+
+
+def apply_constraints(req_list, constraints):
+    """Add the version specifiers of the constraint files (``-c``) to the
+    requirements of the same packages. Like pip, a constraint never adds
+    a requirement, and constraints not for this environment are ignored
+    :param list req_list: requirements
+    :param list constraints: requirements of the constraint files
+    """
+    specs = {}
+    for c in constraints:
+        if c.name and matches_environment(c) and matches_python_version(c):
+            specs.setdefault(canonical_name(c.name), []).extend(c.specs)
+    for r in req_list:
+        for spec in specs.get(canonical_name(r.name), ()) if r.name else ():
+            if spec not in r.specs:
+                r.specs.append(spec)
+
+
 def is_testable(requirement):
     return not requirement.editable and requirement.vcs is None
 
 
-def get_requirements_list(requirements_file_path):
+def is_lock_file(requirements_file_path):
+    """Pipfile.lock, every required package and its version is locked"""
+    return os.path.basename(requirements_file_path) == 'Pipfile.lock'
+
+
+def get_requirements_list(requirements_file_path, include_dev=False):
+    """Requirements of a dependencies file, for this Python version and environment
+    :param str requirements_file_path: path to requirements.txt, setup.py, Pipfile or Pipfile.lock
+    :param bool include_dev: with the development requirements of a Pipfile
+        (``dev-packages``) or a Pipfile.lock (``develop``)
+    :rtype: list
+    """
     if os.path.basename(requirements_file_path) == 'Pipfile':
         with open(requirements_file_path, 'r', encoding='utf-8') as f:
             requirements_data = f.read()
         parsed_reqs = pipfile.parse(requirements_data)
-        req_list = list(parsed_reqs.get('packages', []))
+        req_list = list(parsed_reqs.get('packages') or [])
+        if include_dev:
+            req_list.extend(parsed_reqs.get('dev-packages') or [])
+    elif is_lock_file(requirements_file_path):
+        with open(requirements_file_path, 'r', encoding='utf-8') as f:
+            requirements_data = f.read()
+        parsed_reqs = pipfile.parse_lock(requirements_data, os.path.basename(requirements_file_path))
+        req_list = list(parsed_reqs.get('default') or [])
+        if include_dev:
+            req_list.extend(parsed_reqs.get('develop') or [])
     elif os.path.basename(requirements_file_path) == 'setup.py':
         with open(requirements_file_path, 'r') as f:
             setup_py_file_content = f.read()
@@ -108,10 +196,13 @@ def get_requirements_list(requirements_file_path):
         # assume this is a requirements.txt formatted file
         # Note: requirements.txt files are unicode and can be in any encoding.
         with open(requirements_file_path, 'r') as f:
-            req_list = list(requirements.parse(f))
+            constraints = []
+            req_list = list(requirements.parse(f, constraints))
+        apply_constraints(req_list, constraints)
 
     req_list = filter(matches_environment, req_list)
     req_list = filter(is_testable, req_list)
     req_list = filter(matches_python_version, req_list)
     req_list = [r for r in req_list if r.name]
-    return req_list
+    # a package listed more than once is only required once
+    return unique_requirements(req_list)
@@ -1,42 +1,102 @@
+import hashlib
 import os
+import re
 import warnings
 
 from .requirement import Requirement
 
+REQUIREMENT_OPTIONS = ('-r', '--requirement')
+CONSTRAINT_OPTIONS = ('-c', '--constraint')
 
-def parse(reqstr):
+# See: pip/req/req_file.py, a comment starts the line or follows a space,
+# "#egg=" fragments are kept
+COMMENT_REGEX = re.compile(r'(^|\s+)#.*$')
+
+# The options following a requirement, e.g. "--hash=sha256:..."
+INLINE_OPTIONS_REGEX = re.compile(r'\s+(--?[A-Za-z].*)$')
+
+
+def _option_value(line, options):
     """
-    Parse a requirements file into a list of Requirements
+    The value of a ``-r file`` / ``-rfile`` / ``--requirement=file`` line,
+    None when the line is not one of these options
+    """
+    for option in options:
+        if not line.startswith(option):
+            continue
+        value = line[len(option):]
+        if option.startswith('--'):
+            if value[:1] not in ('=', ' ', '\t'):
+                continue
+        return value.lstrip('= \t').strip() or None
+    return None
 
-    See: pip/req.py:parse_requirements()
 
-    :param reqstr: a string or file like object containing requirements
-    :returns: a *generator* of Requirement objects
+def logical_lines(lines):
     """
-    filename = getattr(reqstr, 'name', None)
-    try:
-        # Python 2.x compatibility
-        if not isinstance(reqstr, basestring):
-            reqstr = reqstr.read()
-    except NameError:
-        # Python 3.x only
-        if not isinstance(reqstr, str):
-            reqstr = reqstr.read()
+    Join the lines continued with a trailing backslash
+
+    :param lines: an iterable of lines, e.g. a file object
+    :returns: a *generator* of (start_line, end_line, line), line numbers
+        are 1-based
+    """
+    parts = []
+    start = number = 0
+    for number, physical in enumerate(lines, 1):
+        physical = physical.rstrip('\r\n')
+        if physical.lstrip().startswith('#'):
+            # like pip, a comment line never starts a continuation, even
+            # ending with a backslash, and ends one
+            if parts:
+                yield start, number - 1, ''.join(parts)
+                parts = []
+            continue
+        if not parts:
+            start = number
+        if physical.endswith('\\'):
+            parts.append(physical[:-1])
+            continue
+        parts.append(physical)
+        yield start, number, ''.join(parts)
+        parts = []
+    if parts:
+        yield start, number, ''.join(parts)
+
+
+def _apply_options(req, options):
+    tokens = iter(options.split())
+    for token in tokens:
+        if token == '--hash':
+            token = '--hash=' + next(tokens, '')
+        if token.startswith('--hash='):
+            hash_name, _, hash_value = token[len('--hash='):].partition(':')
+            req.hashes.append((hash_name, hash_value))
+            if req.hash is None:
+                req.hash_name, req.hash = hash_name, hash_value
+        # other per-requirement options (--install-option, --global-option)
+        # do not change what is installed
 
-    for line in reqstr.splitlines():
+
+def iter_entries(lines, filename=None):
+    """
+    Parse the lines of a single requirements file as they are read, the
+    included files are not read
+
+    :param lines: an iterable of lines, e.g. a file object
+    :param filename: (optional) where/to/requirements.txt
+    :returns: a *generator* of Requirement objects and ``(option, path)``
+        tuples, option is ``-r`` or ``-c``, path as written in the file
+    """
+    for start, end, line in logical_lines(lines):
+        if '#' in line:
+            line = COMMENT_REGEX.sub('', line)
         line = line.strip()
         if line == '':
             continue
-        elif not line or line.startswith('#'):
-            # comments are lines that start with # only
-            continue
         elif line.startswith('-r') or line.startswith('--requirement'):
-            _, new_filename = line.split()
-            new_file_path = os.path.join(os.path.dirname(filename or '.'),
-                                         new_filename)
-            with open(new_file_path) as f:
-                for requirement in parse(f):
-                    yield requirement
+            yield '-r', _option_value(line, REQUIREMENT_OPTIONS)
+        elif line.startswith('-c') or line.startswith('--constraint'):
+            yield '-c', _option_value(line, CONSTRAINT_OPTIONS)
         elif line.startswith('-f') or line.startswith('--find-links') or \
                 line.startswith('-i') or line.startswith('--index-url') or \
                 line.startswith('--extra-index-url') or \
@@ -46,5 +106,168 @@ def parse(reqstr):
         elif line.startswith('-Z') or line.startswith('--always-unzip'):
             warnings.warn('Unused option --always-unzip. Skipping.')
             continue
+        elif line.startswith('-') and not (line.startswith('-e') or line.startswith('--editable')):
+            # other global options, e.g. --require-hashes or --trusted-host,
+            # do not change the requirements
+            continue
         else:
-            yield Requirement.parse(line, filename)
+            options = None
+            if not line.startswith('-'):
+                options_match = INLINE_OPTIONS_REGEX.search(line)
+                if options_match is not None:
+                    line, options = line[:options_match.start()], options_match.group(1)
+            req = Requirement.parse(line, filename)
+            if options:
+                _apply_options(req, options)
+            req.provenance = (filename, start, end)
+            yield req
+
+
+def parse_entries(reqstr, filename=None):
+    """
+    Parse a single requirements file, see iter_entries()
+
+    :param reqstr: the content of the file
+    :param filename: (optional) where/to/requirements.txt
+    :returns: a list of entries
+    """
+    return list(iter_entries(reqstr.splitlines(), filename))
+
+
+def _requirement_key(req):
+    # a digest keeps the memory of a long streamed file small
+    markers = req.line.partition(';')[2].strip()
+    key = (req.name, sorted(req.specs), sorted(req.extras), markers, req.editable, req.specifier,
+           req.revision, req.hash_name, req.hash, req.uri, req.path)
+    return hashlib.sha1(repr(key).encode('utf-8')).digest()
+
+
+class IncludeGraph(object):
+    """
+    Requirements files and the files they include with ``-r`` and ``-c``
+
+    Every included file is parsed once: its entries are cached by path,
+    modification time and size, a file included by many others, or by the
+    files of later parses, is not read again. A file including itself, directly or
+    through other files, is only read once, the include closing the cycle
+    is skipped with a warning.
+
+    A requirement found again in another include is only kept once. The
+    requirements of constraint files, and of the files they include, never
+    add requirements, like pip they are returned apart.
+    """
+
+    def __init__(self):
+        self._files = {}
+
+    def load(self, path):
+        """
+        The entries of an included file, see iter_entries()
+
+        :param path: absolute path of the file
+        :returns: a list of entries
+        """
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(path) as f:
+            entries = list(iter_entries(f, path))
+        self._files[path] = (stamp, entries)
+        return entries
+
+    def iter_resolve(self, path, entries, constraints=None):
+        """
+        The requirements of a file and of the files it includes, in order
+
+        :param path: path of the file, None when the entries are not from a file
+        :param entries: the entries of the file, see iter_entries()
+        :param constraints: (optional) a list receiving the constraints
+        :returns: a *generator* of Requirement objects
+        """
+        seen = (set(), set())
+        root = os.path.abspath(path) if path is not None else None
+        visited = set([(root, False)])
+        # frames of (path, constraint, entries iterator)
+        stack = [(root, False, iter(entries))]
+        while stack:
+            file_path, constraint, file_entries = stack[-1]
+            for entry in file_entries:
+                if isinstance(entry, Requirement):
+                    key = _requirement_key(entry)
+                    if key in seen[constraint]:
+                        continue
+                    seen[constraint].add(key)
+                    if not constraint:
+                        yield entry
+                    elif constraints is not None:
+                        constraints.append(entry)
+                    continue
+
+                option, include = entry
+                if not include:
+                    warnings.warn('Missing file name after {0}. Skipping.'.format(option))
+                    continue
+                include_path = os.path.abspath(os.path.join(os.path.dirname(file_path or '.'), include))
+                include_constraint = constraint or option == '-c'
+                if any(frame[0] == include_path for frame in stack):
+                    warnings.warn('Requirements file {0} includes itself. Skipping.'.format(include_path))
+                    continue
+                if (include_path, include_constraint) in visited:
+                    # already included through another file
+                    continue
+                visited.add((include_path, include_constraint))
+                stack.append((include_path, include_constraint, iter(self.load(include_path))))
+                break
+            else:
+                stack.pop()
+
+    def resolve(self, path, reqstr=None):
+        """
+        The requirements and the constraints of a file
+
+        :param path: path of the file, None when reqstr is not from a file
+        :param reqstr: (optional) the content of the file, read from path otherwise
+        :returns: (list of requirements, list of constraints)
+        """
+        if reqstr is None:
+            entries = self.load(os.path.abspath(path))
+        else:
+            entries = iter_entries(reqstr.splitlines(), path)
+        constraints = []
+        requirements = list(self.iter_resolve(path, entries, constraints))
+        return requirements, constraints
+
+
+# shared by the parses of a process, e.g. service files including the same base file
+_include_graph = IncludeGraph()
+
+
+def parse(reqstr, constraints=None):
+    """
+    Parse a requirements file into a list of Requirements
+
+    A file object is read line by line as the requirements are consumed,
+    only the files it includes are read at once.
+
+    See: pip/req.py:parse_requirements()
+
+    :param reqstr: a string or file like object containing requirements
+    :param constraints: (optional) a list receiving the requirements of
+        the constraint files (``-c``)
+    :returns: a *generator* of Requirement objects
+    """
+    filename = getattr(reqstr, 'name', None)
+    try:
+        # Python 2.x compatibility
+        if isinstance(reqstr, basestring):
+            reqstr = reqstr.splitlines()
+    except NameError:
+        # Python 3.x only
+        if isinstance(reqstr, str):
+            reqstr = reqstr.splitlines()
+
+    entries = iter_entries(reqstr, filename)
+    for requirement in _include_graph.iter_resolve(filename, entries, constraints):
+        yield requirement
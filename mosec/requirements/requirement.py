@@ -2,8 +2,8 @@ from __future__ import unicode_literals
 import re
 import os
 import warnings
-from pkg_resources import Requirement as Req
 
+from ..requirement_dist import parse_requirement
 from .fragment import get_hash_info, parse_fragment, parse_extras_require
 from .vcs import VCS, VCS_SCHEMES
 
@@ -31,6 +31,27 @@ LOCAL_REGEX = re.compile(
 
 NAME_EQ_REGEX = re.compile(r'name=(?:\'|")(\S+)(?:\'|")')
 
+# Longest first, a prefix match picks the right one
+SPECIFIER_OPERATORS = ('===', '~=', '==', '!=', '<=', '>=', '<', '>')
+
+# The common "name[extras]>=1.0,<2.0 ; marker" line. A name can not be a
+# path (no separator, no leading dot) nor an URL, so the line is a
+# specifier without looking at the filesystem, like pip does.
+PLAIN_SPECIFIER_REGEX = re.compile(
+    r'^(?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*'
+    r'(?:\[(?P<extras>[A-Za-z0-9._,\s-]*)\])?\s*'
+    r'(?P<specs>(?:===|~=|==|!=|<=|>=|<|>)\s*[A-Za-z0-9.*+!_-]+'
+    r'(?:\s*,\s*(?:===|~=|==|!=|<=|>=|<|>)\s*[A-Za-z0-9.*+!_-]+)*)?\s*'
+    r'(?:;[^#]*)?$'
+)
+
+
+def _split_spec(spec):
+    spec = spec.strip()
+    for op in SPECIFIER_OPERATORS:
+        if spec.startswith(op):
+            return op, spec[len(op):].strip()
+
 
 class Requirement(object):
     """
@@ -57,6 +78,7 @@ class Requirement(object):
     * ``path`` - the local path to the requirement
     * ``hash_name`` - the type of hashing algorithm indicated in the line
     * ``hash`` - the hash value indicated by the requirement line
+    * ``hashes`` - a list of (hash_name, hash) of the ``--hash`` options of the line
     * ``extras`` - a list of extras for this requirement
       (eg. "mymodule[extra1, extra2]")
     * ``specs`` - a list of specs for this requirement
@@ -78,6 +100,7 @@ class Requirement(object):
         self.revision = None
         self.hash_name = None
         self.hash = None
+        self.hashes = []
         self.extras = []
         self.specs = []
         self.provenance = None
@@ -158,6 +181,32 @@ class Requirement(object):
 
         return req
 
+    @classmethod
+    def parse_specifier(cls, line):
+        """
+        Parses a Requirement from a plain requirement specifier, with a
+        single regex match and no filesystem access.
+
+        :param line: a "non-editable" requirement
+        :returns: a Requirement instance for the given line, or None when
+            the line is not a plain specifier
+        """
+
+        match = PLAIN_SPECIFIER_REGEX.match(line)
+        if match is None:
+            return None
+
+        req = cls(line)
+        req.specifier = True
+        req.name = match.group('name')
+        extras = match.group('extras')
+        if extras:
+            req.extras = [e.strip() for e in extras.split(',') if e.strip()]
+        specs = match.group('specs')
+        if specs:
+            req.specs = [_split_spec(spec) for spec in specs.split(',')]
+        return req
+
     @classmethod
     def parse_line(cls, line, filename=''):
         """
@@ -171,6 +220,11 @@ class Requirement(object):
         :raises: ValueError on an invalid requirement
         """
 
+        # most lines are plain specifiers
+        req = cls.parse_specifier(line)
+        if req is not None:
+            return req
+
         req = cls(line)
 
         vcs_match = VCS_REGEX.match(line)
@@ -227,10 +281,13 @@ class Requirement(object):
             req.local_file = True
         else:
             # This is a requirement specifier.
-            # Delegate to pkg_resources and hope for the best
+            # Delegate to pkg_resources when it is not a plain one and hope for the best
             req.specifier = True
             try:
-                pkg_req = Req.parse(line)
+                pkg_req = parse_requirement(line)
+                if pkg_req is None:
+                    from pkg_resources import Requirement as Req
+                    pkg_req = Req.parse(line)
                 req.name = pkg_req.unsafe_name
                 req.extras = list(pkg_req.extras)
                 req.specs = pkg_req.specs
@@ -13,13 +13,14 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import distutils.core
 import re
-import setuptools
 
 
 def parse(setup_py_content):
     """Parse a setup.py file and extract the arguments passed to the setup method"""
+    # imported here, setuptools imports pkg_resources
+    import distutils.core
+    import setuptools
 
     # Make the setup method return the arguments that are passed to it
     def _save_passed_args(**kwargs):
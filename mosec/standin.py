@@ -0,0 +1,389 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Local stand-in for the vulnerability API
+
+Implements the ``/api/plugin`` contract used by ``mosec --endpoint`` so the
+upload can be checked without the real backend::
+
+    python -m mosec.standin --port 8000 --vulns vulns.json
+    mosec requirements.txt --endpoint http://127.0.0.1:8000/api/plugin --compress
+
+``vulns.json`` is a list of canned vulnerabilities, reported for every path
+to a matching package::
+
+    [{"packageName": "django", "version": "3.0.1", "severity": "High",
+      "title": "SQL Injection", "cve": "CVE-2020-7471", "target_version": ["3.0.3"]}]
+
+Request bodies are accepted plain or gzip compressed, with a Content-Length
+or chunked, ``tree``, ``graph`` and ``merkle`` payloads are understood, the
+subtrees of merkle payloads are kept for the life of the server. Responses are
+gzip compressed when the client accepts it, and sent as NDJSON records
+when the client accepts ``application/x-ndjson``: one line per
+vulnerability, then the ``{"ok": ..., "dependencyCount": ...}`` summary.
+
+Faults of a real backend can be injected: a latency (plus a random
+jitter) before every response, a rate of error responses, e.g. ``503``,
+and a rate of connections dropped without a response::
+
+    python -m mosec.standin --latency 50 --jitter 20 --error-rate 0.05 --drop-rate 0.01
+"""
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from mosec import transport
+from mosec.deps_tree import DEPENDENCIES, FROM, NAME, VERSION
+from mosec.payload import (UNKNOWN_HASHES, expand_graph_payload, expand_merkle_payload, is_graph_payload,
+                           is_merkle_payload, subtree_hash, unknown_subtrees)
+from mosec.utils import canonical_name, severity_rank
+
+API_PATH = '/api/plugin'
+
+
+def _iter_tree_nodes(tree):
+    # children of the root first, in the order of the payload
+    stack = [iter((tree.get(DEPENDENCIES) or {}).values())]
+    while stack:
+        for node in stack[-1]:
+            if node is None:
+                continue
+            yield node
+            if node.get(DEPENDENCIES):
+                stack.append(iter(node[DEPENDENCIES].values()))
+            break
+        else:
+            stack.pop()
+
+
+def check_payload(payload, vulnerabilities=()):
+    """Response of the API for a decoded ``tree`` or ``graph`` payload
+    :param dict payload: the decoded payload
+    :param list vulnerabilities: canned vulnerabilities
+    :rtype: OrderedDict
+    """
+    if is_graph_payload(payload):
+        payload = expand_graph_payload(payload)
+
+    min_level = severity_rank(payload.get('severityLevel', 'High')) or severity_rank('High')
+    by_package = {}
+    for vuln in vulnerabilities:
+        if severity_rank(vuln.get('severity')) >= min_level:
+            key = (canonical_name(vuln['packageName']), vuln.get('version'))
+            by_package.setdefault(key, []).append(vuln)
+
+    packages = set()
+    found = []
+    for node in _iter_tree_nodes(payload):
+        packages.add((canonical_name(node[NAME]), node[VERSION]))
+        for vuln in by_package.get((canonical_name(node[NAME]), node[VERSION]), ()):
+            result = OrderedDict(vuln)
+            result['packageName'] = node[NAME]
+            result['version'] = node[VERSION]
+            result['from'] = node[FROM]
+            found.append(result)
+
+    return OrderedDict([
+        ('ok', not found),
+        ('dependencyCount', len(packages)),
+        ('vulnerabilities', found),
+    ])
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, body, content_type='application/json'):
+        headers = {'Content-Type': content_type}
+        if transport.GZIP in self.headers.get('Accept-Encoding', ''):
+            body = transport.encode_body(body, compress=True)[0]
+            headers['Content-Encoding'] = transport.GZIP
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_ndjson(self, status, records):
+        # chunked, every record is sent as soon as it is encoded
+        compressor = None
+        self.send_response(status)
+        self.send_header('Content-Type', transport.NDJSON_TYPE)
+        if transport.GZIP in self.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(transport.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.send_header('Content-Encoding', transport.GZIP)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for record in records:
+            data = json.dumps(record).encode('utf-8') + b'\n'
+            if compressor is not None:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._write_chunk(data)
+        if compressor is not None:
+            self._write_chunk(compressor.flush())
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'ok': False, 'message': message}).encode('utf-8'))
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # trailer headers end with a blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        body = self._read_body()
+        # the absolute url a client sends through a proxy is accepted too
+        if urllib.parse.urlsplit(self.path).path != API_PATH:
+            return self._send_error(404, 'Not Found')
+
+        content_encoding = self.headers.get('Content-Encoding')
+        if content_encoding and not self.server.accept_gzip:
+            return self._send_error(transport.UNSUPPORTED_MEDIA_TYPE, 'Unsupported Content-Encoding')
+        try:
+            body = transport.decode_body(body, content_encoding)
+            payload = json.loads(body.decode('utf-8'), object_pairs_hook=OrderedDict)
+        except (IOError, OSError, ValueError) as e:
+            return self._send_error(400, str(e))
+
+        self.server.record(self, payload)
+        if self.server.inject_fault(self):
+            return
+        if is_merkle_payload(payload):
+            try:
+                payload = self.server.resolve_merkle(payload)
+            except (KeyError, TypeError, ValueError) as e:
+                return self._send_error(400, str(e))
+            if UNKNOWN_HASHES in payload:
+                return self._send(200, json.dumps(payload).encode('utf-8'))
+        response = check_payload(payload, self.server.vulnerabilities)
+        if transport.NDJSON_TYPE in self.headers.get('Accept', ''):
+            summary = OrderedDict((k, v) for k, v in response.items() if k != 'vulnerabilities')
+            return self._send_ndjson(200, response['vulnerabilities'] + [summary])
+        self._send(200, json.dumps(response).encode('utf-8'))
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandinServer(_ThreadingHTTPServer):
+    """The stand-in API server
+
+    :param tuple address: (host, port), port 0 picks a free port
+    :param list vulnerabilities: canned vulnerabilities
+    :param bool accept_gzip: accept gzip compressed request bodies
+    :param bool verbose: log the requests to stderr
+    :param float latency: seconds to wait before every response
+    :param float jitter: up to this many more seconds, at random
+    :param float error_rate: part of the requests answered with error_status
+    :param int error_status: status of the injected errors
+    :param float drop_rate: part of the requests whose connection is closed
+        without a response
+    :param int seed: seed of the injected faults, for repeatable runs
+    """
+
+    # many concurrent clients connect at once, the default backlog of 5
+    # makes the extra connections wait for a SYN retransmit
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), vulnerabilities=(), accept_gzip=True, verbose=False,
+                 latency=0, jitter=0, error_rate=0, error_status=503, drop_rate=0, seed=None):
+        _ThreadingHTTPServer.__init__(self, address, StandinRequestHandler)
+        self.vulnerabilities = list(vulnerabilities)
+        self.accept_gzip = accept_gzip
+        self.verbose = verbose
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.requests = []
+        self.subtrees = {}
+        self.faults = {'errors': 0, 'drops': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, API_PATH)
+
+    def record(self, handler, payload):
+        """Keep the headers and decoded payload of every API request"""
+        with self._lock:
+            self.requests.append((dict(handler.headers.items()), payload))
+
+    def inject_fault(self, handler):
+        """Wait for the injected latency, then answer with an injected fault if drawn
+        :returns: True when the request was answered
+        """
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            draw = self._random.random()
+            fault = None
+            if draw < self.drop_rate:
+                fault = 'drops'
+            elif draw < self.drop_rate + self.error_rate:
+                fault = 'errors'
+            if fault:
+                self.faults[fault] += 1
+        if delay:
+            time.sleep(delay)
+        if fault == 'drops':
+            handler.close_connection = True
+            return True
+        if fault == 'errors':
+            handler._send_error(self.error_status, 'Injected error')
+            return True
+        return False
+
+    def resolve_merkle(self, payload):
+        """Store the subtrees of a merkle payload
+        :returns: the tree payload, or the unknown hashes to ask for
+        """
+        nodes = payload.get('nodes') or {}
+        for digest, record in nodes.items():
+            if subtree_hash(record) != digest:
+                raise ValueError("Subtree hash mismatch: {}".format(digest))
+        with self._lock:
+            self.subtrees.update(nodes)
+            unknown = unknown_subtrees(payload, self.subtrees)
+            if unknown:
+                return OrderedDict([(UNKNOWN_HASHES, unknown)])
+            return expand_merkle_payload(payload, self.subtrees)
+
+    def start(self):
+        """Serve in a daemon thread"""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def load_vulnerabilities(path):
+    if not path:
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mosec.standin",
+                                     description="本地模拟的漏洞检测 API")
+    parser.add_argument("--host",
+                        action="store",
+                        default="127.0.0.1")
+    parser.add_argument("--port",
+                        action="store",
+                        type=int,
+                        default=8000)
+    parser.add_argument("--vulns",
+                        action="store",
+                        default=None,
+                        help="预置漏洞列表 JSON 文件")
+    parser.add_argument("--no-gzip",
+                        action="store_true",
+                        help="不接受 gzip 压缩的请求")
+    parser.add_argument("--latency",
+                        action="store",
+                        type=float,
+                        default=0,
+                        help="每个请求返回前的延迟(毫秒)")
+    parser.add_argument("--jitter",
+                        action="store",
+                        type=float,
+                        default=0,
+                        help="随机增加的延迟上限(毫秒)")
+    parser.add_argument("--error-rate",
+                        action="store",
+                        type=float,
+                        default=0,
+                        help="返回错误状态码的请求比例, 0 到 1")
+    parser.add_argument("--error-status",
+                        action="store",
+                        type=int,
+                        default=503,
+                        help="注入错误的状态码. default: 503")
+    parser.add_argument("--drop-rate",
+                        action="store",
+                        type=float,
+                        default=0,
+                        help="不返回而直接断开连接的请求比例, 0 到 1")
+    parser.add_argument("--seed",
+                        action="store",
+                        type=int,
+                        default=None,
+                        help="注入故障的随机种子")
+    args = parser.parse_args(argv)
+
+    server = StandinServer((args.host, args.port), load_vulnerabilities(args.vulns),
+                           accept_gzip=not args.no_gzip, verbose=True,
+                           latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           drop_rate=args.drop_rate, seed=args.seed)
+    print("Serving {}".format(server.endpoint))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    main()
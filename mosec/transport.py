@@ -0,0 +1,569 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Upload of the payload to the vulnerability API
+
+Transport keeps ``http.client`` connections alive in a small pool per
+host, so the TLS handshake is done once per process. warm_up() resolves
+and connects in a background thread while the dependencies tree is being
+built. Requests which fail with a 5xx response or a reset connection are
+retried with exponential backoff and full jitter. close() aborts the
+requests still in flight, e.g. the shard uploads left by --fail-fast.
+
+A body may also be a callable returning an iterable of bytes, it is then
+sent with ``Transfer-Encoding: chunked`` as the chunks are produced, and
+called again for a retry.
+
+open_json() hands the response over before its body is read, so that an
+``application/x-ndjson`` response can be consumed record by record.
+
+Request bodies are gzip compressed when asked to, with a
+``Content-Encoding: gzip`` header. A backend which does not support it
+answers ``415 Unsupported Media Type``, the payload is then sent again
+uncompressed. Responses may be gzip compressed, ``Accept-Encoding: gzip``
+is always sent.
+"""
+import gzip
+import http.client
+import random
+import socket
+import ssl
+import threading
+import urllib.parse
+import urllib.request
+import weakref
+import zlib
+
+GZIP = 'gzip'
+GZIP_LEVEL = 6
+JSON_TYPE = 'application/json'
+NDJSON_TYPE = 'application/x-ndjson'
+READ_SIZE = 64 * 1024
+UNSUPPORTED_MEDIA_TYPE = 415
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_TIMEOUT = 15
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 8
+DEFAULT_POOL_SIZE = 4
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class HTTPError(Exception):
+    """Non 2xx response of the API, after the retries"""
+
+    def __init__(self, url, status, reason, body=b''):
+        Exception.__init__(self, "HTTP Error {}: {} ({})".format(status, reason, url))
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+def _content_type(headers):
+    return (headers.get('Content-Type') or '').split(';', 1)[0].strip().lower()
+
+
+class Response(object):
+    """A response whose body has been read and decoded"""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def content_type(self):
+        return _content_type(self.headers)
+
+    def read(self):
+        return self.body
+
+    def iter_lines(self):
+        return iter(self.body.splitlines())
+
+    def close(self):
+        pass
+
+
+class StreamResponse(object):
+    """A 2xx response whose body is decoded as it arrives. The connection
+    goes back to the pool when the body was read to the end, otherwise it
+    is closed.
+    """
+
+    def __init__(self, transport, origin, conn, response):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._transport = transport
+        self._origin = origin
+        self._conn = conn
+        self._response = response
+        self._done = False
+        content_encoding = (response.headers.get('Content-Encoding') or '').strip().lower()
+        if content_encoding in (GZIP, 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif content_encoding in ('', 'identity'):
+            self._decompressor = None
+        else:
+            self.close()
+            raise ValueError("Unsupported Content-Encoding: {}".format(content_encoding))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def content_type(self):
+        return _content_type(self.headers)
+
+    def iter_chunks(self):
+        """Decoded body in chunks, as they are received"""
+        # read1() returns what is available instead of waiting for a full buffer
+        read = getattr(self._response, 'read1', self._response.read)
+        while True:
+            data = read(READ_SIZE)
+            if not data:
+                break
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            if data:
+                yield data
+        if self._decompressor is not None:
+            data = self._decompressor.flush()
+            if data:
+                yield data
+        self._done = True
+
+    def iter_lines(self):
+        """Decoded body line by line, without the line ends"""
+        pending = b''
+        for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r')
+        if pending:
+            yield pending
+
+    def read(self):
+        return b''.join(self.iter_chunks())
+
+    def close(self):
+        if self._conn is None:
+            return
+        # read1() does not close a response read to its Content-Length,
+        # the connection refuses the next request until it is
+        self._response.close()
+        if self._done and not self._response.will_close:
+            self._transport._release(self._origin, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+
+def encode_body(body, compress=False):
+    """Request body and its headers
+    :param bytes body: the JSON payload
+    :param bool compress: gzip the body
+    :returns: (body, headers)
+    """
+    headers = {
+        'Content-Type': JSON_TYPE,
+        'Accept-Encoding': GZIP,
+    }
+    if compress:
+        body = gzip.compress(body, GZIP_LEVEL)
+        headers['Content-Encoding'] = GZIP
+    return body, headers
+
+
+def gzip_chunks(chunks):
+    """gzip compress a stream of bytes
+    :param chunks: iterable of bytes
+    :returns: generator of bytes, a gzip member
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode_stream(chunks_factory, compress=False):
+    """Streamed request body and its headers
+    :param callable chunks_factory: returns an iterable of bytes, called for every try
+    :param bool compress: gzip the body
+    :returns: (body factory, headers)
+    """
+    headers = {
+        'Content-Type': JSON_TYPE,
+        'Accept-Encoding': GZIP,
+    }
+    if not compress:
+        return chunks_factory, headers
+    headers['Content-Encoding'] = GZIP
+    return lambda: gzip_chunks(chunks_factory()), headers
+
+
+def decode_body(body, content_encoding=None):
+    """Decompress a request or response body
+    :param bytes body: the raw body
+    :param str content_encoding: value of the Content-Encoding header
+    :rtype: bytes
+    """
+    content_encoding = (content_encoding or '').strip().lower()
+    if content_encoding in (GZIP, 'x-gzip'):
+        return gzip.decompress(body)
+    if content_encoding in ('', 'identity'):
+        return body
+    raise ValueError("Unsupported Content-Encoding: {}".format(content_encoding))
+
+
+_ssl_context = None
+
+
+def ssl_context():
+    """The SSL context shared by every connection, certificates are not verified"""
+    global _ssl_context
+    if _ssl_context is None:
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        _ssl_context = ctx
+    return _ssl_context
+
+
+def _proxy_url(scheme, host):
+    # same environment variables as urllib.request, e.g. https_proxy and no_proxy
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    return proxy if '://' in proxy else 'http://' + proxy
+
+
+def connect_address(origin):
+    """Address to connect to for an origin, the proxy's when one is set
+    :param tuple origin: (scheme, host, port)
+    :returns: ((host, port), whether it is a proxy)
+    """
+    scheme, host, port = origin
+    proxy = _proxy_url(scheme, host)
+    if not proxy:
+        return (host, port), False
+    proxy = urllib.parse.urlsplit(proxy)
+    return (proxy.hostname, proxy.port or _DEFAULT_PORTS['http']), True
+
+
+def is_retryable_status(status):
+    return 500 <= status < 600
+
+
+class Transport(object):
+    """Keep-alive HTTP client with retries
+
+    :param float connect_timeout: seconds to resolve and connect, TLS handshake included
+    :param float timeout: seconds to wait for the response once connected
+    :param int retries: retries of a request after a 5xx response or a connection error
+    :param float backoff: first retry delay in seconds, doubled for every retry
+    :param float max_backoff: maximum retry delay in seconds
+    :param int pool_size: idle connections kept per host
+    """
+
+    def __init__(self,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._pool = {}
+        self._lock = threading.Lock()
+        self._warm_up_threads = {}
+        # every open connection, idle or in flight, to abort them on close()
+        self._connections = weakref.WeakSet()
+        self._closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the connections and refuse new requests. The requests in
+        flight are aborted and not retried. Connections released afterwards,
+        by a warm-up still connecting or a late response, are closed too.
+        """
+        with self._lock:
+            self._closed.set()
+            pools, self._pool = self._pool, {}
+            connections = list(self._connections)
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+        for conn in connections:
+            # wakes up a thread blocked reading the response, which closes it
+            if conn.sock is not None:
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def warm_up(self, url):
+        """Resolve the host and open a connection to it in a background thread,
+        the next request to this host uses it. Errors are left to the request.
+        :param str url: any url of the host
+        """
+        origin = _origin(url)
+        with self._lock:
+            if origin in self._warm_up_threads:
+                return
+            thread = threading.Thread(target=self._warm_up, args=(origin,))
+            thread.daemon = True
+            self._warm_up_threads[origin] = thread
+        thread.start()
+
+    def _warm_up(self, origin):
+        try:
+            conn = self._new_connection(origin)
+        except (OSError, http.client.HTTPException):
+            return
+        self._release(origin, conn)
+
+    def _wait_warm_up(self, origin):
+        with self._lock:
+            thread = self._warm_up_threads.pop(origin, None)
+        if thread is not None:
+            thread.join()
+
+    def _new_connection(self, origin):
+        if self._closed.is_set():
+            raise ConnectionAbortedError("Transport closed")
+        scheme, host, port = origin
+        address, proxy = connect_address(origin)
+
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(address[0], address[1], timeout=self.connect_timeout,
+                                               context=ssl_context())
+            if proxy:
+                conn.set_tunnel(host, port)
+        else:
+            conn = http.client.HTTPConnection(address[0], address[1], timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.timeout)
+        with self._lock:
+            if self._closed.is_set():
+                conn.close()
+                raise ConnectionAbortedError("Transport closed")
+            self._connections.add(conn)
+        # plain http through a proxy sends the absolute url
+        conn.absolute_url = bool(proxy) and scheme == 'http'
+        return conn
+
+    def _acquire(self, origin):
+        """An idle connection, or None"""
+        self._wait_warm_up(origin)
+        with self._lock:
+            connections = self._pool.get(origin)
+            if connections:
+                return connections.pop()
+        return None
+
+    def _release(self, origin, conn):
+        with self._lock:
+            if not self._closed.is_set():
+                connections = self._pool.setdefault(origin, [])
+                if len(connections) < self.pool_size:
+                    connections.append(conn)
+                    return
+        conn.close()
+
+    def _send(self, origin, target, method, body, headers, stream=False):
+        """Send once, on an idle connection if any. A reused connection may
+        have been closed by the server meanwhile, it is replaced by a new one.
+        """
+        conn = self._acquire(origin)
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = self._new_connection(origin)
+            request_target = target if not conn.absolute_url else _absolute(origin, target)
+            try:
+                if callable(body):
+                    _request_chunked(conn, method, request_target, body(), headers)
+                else:
+                    conn.request(method, request_target, body=body, headers=headers)
+                response = conn.getresponse()
+                if stream and 200 <= response.status < 300:
+                    return StreamResponse(self, origin, conn, response)
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and isinstance(e, (ConnectionError, http.client.BadStatusLine)):
+                    conn = None
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(origin, conn)
+            return Response(response.status, response.reason, response.headers,
+                            decode_body(data, response.headers.get('Content-Encoding')))
+
+    def retry_delay(self, attempt):
+        """Delay before a retry, exponential backoff with full jitter
+        :param int attempt: 0 for the first retry
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def request(self, method, url, body=None, headers=None, stream=False):
+        """Send a request, retrying on 5xx responses and connection errors
+        :param str method: e.g. POST
+        :param str url: the url
+        :param body: the request body, bytes or a callable returning an
+            iterable of bytes to send chunked
+        :param dict headers: the request headers
+        :param bool stream: return a StreamResponse, its body is not read yet
+        :rtype: Response or StreamResponse
+        :raises HTTPError: on a non 2xx response
+        :raises OSError: on a connection error
+        """
+        origin = _origin(url)
+        target = _target(url)
+        attempt = 0
+        while True:
+            try:
+                response = self._send(origin, target, method, body, headers or {}, stream)
+            except (ConnectionError, http.client.HTTPException):
+                if attempt >= self.retries or self._closed.is_set():
+                    raise
+            else:
+                if not is_retryable_status(response.status) or attempt >= self.retries:
+                    break
+            # cut short by close()
+            self._closed.wait(self.retry_delay(attempt))
+            attempt += 1
+
+        if not 200 <= response.status < 300:
+            raise HTTPError(url, response.status, response.reason, response.body)
+        return response
+
+    def open_json(self, url, payload, compress=False, accept=JSON_TYPE, content_encoding=None):
+        """POST a JSON payload, the body of the returned response is read
+        by the caller
+        :param str url: API url
+        :param payload: the JSON payload, bytes or a callable returning an
+            iterable of bytes to send chunked
+        :param bool compress: gzip the request body
+        :param str accept: value of the Accept header
+        :param str content_encoding: the payload bytes are already encoded,
+            e.g. gzip, they are sent as they are
+        :rtype: StreamResponse
+        """
+        if content_encoding:
+            body, headers = encode_body(payload)
+            headers['Content-Encoding'] = content_encoding
+        elif callable(payload):
+            body, headers = encode_stream(payload, compress)
+        else:
+            body, headers = encode_body(payload, compress)
+        headers['Accept'] = accept
+        try:
+            return self.request('POST', url, body, headers, stream=True)
+        except HTTPError as e:
+            if not (compress or content_encoding) or e.status != UNSUPPORTED_MEDIA_TYPE:
+                raise
+        # the backend does not accept compressed bodies
+        if content_encoding:
+            payload = decode_body(payload, content_encoding)
+        return self.open_json(url, payload, compress=False, accept=accept)
+
+    def post_json(self, url, payload, compress=False):
+        """POST a JSON payload and return the decoded response body
+        :param str url: API url
+        :param payload: the JSON payload, bytes or a callable returning an
+            iterable of bytes to send chunked
+        :param bool compress: gzip the request body
+        :rtype: bytes
+        """
+        with self.open_json(url, payload, compress) as response:
+            return response.read()
+
+
+def _request_chunked(conn, method, target, chunks, headers):
+    # http.client only chunks bodies by itself from python 3.6
+    conn.putrequest(method, target, skip_accept_encoding=True)
+    for name, value in headers.items():
+        conn.putheader(name, value)
+    conn.putheader('Transfer-Encoding', 'chunked')
+    conn.endheaders()
+    for chunk in chunks:
+        if chunk:
+            conn.send('{:x}\r\n'.format(len(chunk)).encode('ascii') + chunk + b'\r\n')
+    conn.send(b'0\r\n\r\n')
+
+
+def _origin(url):
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        raise ValueError("Unsupported url: {}".format(url))
+    return scheme, parts.hostname, parts.port or _DEFAULT_PORTS[scheme]
+
+
+def _target(url):
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+
+
+def _absolute(origin, target):
+    scheme, host, port = origin
+    if port == _DEFAULT_PORTS[scheme]:
+        return '{}://{}{}'.format(scheme, host, target)
+    return '{}://{}:{}{}'.format(scheme, host, port, target)
+
+
+def post_json(endpoint, payload, compress=False, timeout=DEFAULT_TIMEOUT):
+    """POST a JSON payload with a one-off Transport
+    :param str endpoint: API url
+    :param payload: the JSON payload, bytes or a callable returning an
+        iterable of bytes to send chunked
+    :param bool compress: gzip the request body
+    :param int timeout: seconds to wait for the response
+    :rtype: bytes
+    """
+    with Transport(timeout=timeout) as transport:
+        return transport.post_json(endpoint, payload, compress)
@@ -17,21 +17,91 @@ import sys
 import re
 from importlib import import_module
 
+try:
+    from functools import lru_cache
+except ImportError:
+    lru_cache = None
 
-def canonicalize_dist_name(name):
-    # https://packaging.python.org/guides/distributing-packages-using-setuptools/#name
-    name = name.lower().replace('-', '.').replace('_', '.')
-    name = re.sub(r'\.+', '.', name)
-    return name
+CANONICAL_NAME_REGEX = re.compile(r'[-_.]+')
 
+SEVERITY_LEVELS = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
 
-def guess_version(pkg_key, default='?'):
+
+def _memoize(func):
+    if lru_cache is not None:
+        return lru_cache(maxsize=None)(func)
+    cache = {}
+
+    def _wrapper(name):
+        if name not in cache:
+            cache[name] = func(name)
+        return cache[name]
+    return _wrapper
+
+
+@_memoize
+def canonical_name(name):
+    """PEP 503 normalized name, e.g. Typing_Extensions => typing-extensions"""
+    # https://www.python.org/dev/peps/pep-0503/#normalized-names
+    return CANONICAL_NAME_REGEX.sub('-', name).lower()
+
+
+class NameIndex(object):
+    """Items looked up by PEP 503 normalized package name
+
+    :param iterable items: items to index
+    :param callable name: item => package name, default to the
+        ``project_name`` attribute
+    """
+
+    def __init__(self, items=(), name=None):
+        self._name = name or (lambda item: item.project_name)
+        self._items = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        """Index an item, the first item added for a name wins"""
+        self._items.setdefault(canonical_name(self._name(item)), item)
+
+    def get(self, name, default=None):
+        return self._items.get(canonical_name(name), default)
+
+    def __contains__(self, name):
+        return canonical_name(name) in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+
+def severity_rank(severity):
+    """Rank of a severity level, e.g. High => 3, 0 when unknown"""
+    return SEVERITY_LEVELS.get(str(severity).strip().lower(), 0)
+
+
+def guess_version(pkg_key, default='?', allow_import=False):
     """Guess the version of a pkg when pip doesn't provide it
     :param str pkg_key: key of the package
     :param str default: default version to return if unable to find
+    :param bool allow_import: import the module to read its __version__
+        when no installed dist provides it
     :returns: version
     :rtype: string
     """
+    # imported here, dist_backend depends on this module
+    from mosec.dist_backend import module_dists
+
+    modules = module_dists()
+    for module_name in (pkg_key, pkg_key.replace('-', '_'), pkg_key.replace('.', '_')):
+        dist = modules.get(module_name.lower())
+        if dist is not None:
+            return dist.version or default
+
+    if not allow_import:
+        return default
     try:
         m = import_module(pkg_key)
     except ImportError:
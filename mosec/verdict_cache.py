@@ -0,0 +1,243 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""Local cache of the vulnerability API verdicts
+
+A verdict is the list of vulnerabilities the API reported for a package
+version at a severity level, without their ``from`` paths, which only
+depend on the project. Verdicts expire after a TTL.
+
+The cache is a JSON file in a directory that may be shared between
+machines, e.g. a CI cache volume. It is replaced atomically, and updates
+are made under an exclusive ``fcntl`` lock of a ``.lock`` file next to it,
+so concurrent scans merge their verdicts instead of overwriting them.
+
+Before an upload, lookup() splits the dependencies tree: the packages
+with a fresh verdict are left out of the payload, only the paths to the
+other packages are sent. VerdictLookup.merge_records() adds the cached
+vulnerabilities, on every path they are found, to the API response, and
+stores the verdicts of the packages which were sent.
+"""
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from mosec.deps_tree import FROM
+from mosec.utils import canonical_name
+
+CACHE_FORMAT_VERSION = 1
+CACHE_DIR_ENV = 'MOSEC_CACHE_DIR'
+CACHE_FILE_NAME = 'verdicts.json'
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def default_cache_dir():
+    """Cache directory, from MOSEC_CACHE_DIR or the user cache directory"""
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'mosec')
+
+
+def verdict_key(name, version, level):
+    return '{}@{}@{}'.format(canonical_name(name), version, str(level).lower())
+
+
+class VerdictCache(object):
+    """Vulnerability verdicts stored in a JSON file
+
+    :param str directory: cache directory, default MOSEC_CACHE_DIR or ~/.cache/mosec
+    :param int ttl: seconds a verdict stays fresh
+    """
+
+    def __init__(self, directory=None, ttl=DEFAULT_TTL):
+        self.directory = directory or default_cache_dir()
+        self.path = os.path.join(self.directory, CACHE_FILE_NAME)
+        self.ttl = ttl
+        self.entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if data.get('version') != CACHE_FORMAT_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def _is_fresh(self, entry, now):
+        return now - entry.get('time', 0) < self.ttl
+
+    def get(self, name, version, level, now=None):
+        """Cached vulnerabilities of a package version, None when unknown or expired
+        :rtype: list
+        """
+        entry = self.entries.get(verdict_key(name, version, level))
+        if entry is None or not self._is_fresh(entry, time.time() if now is None else now):
+            return None
+        return entry['vulnerabilities']
+
+    @contextmanager
+    def _locked(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def update(self, verdicts, now=None):
+        """Store verdicts, merged with the ones other scans stored meanwhile.
+        Expired verdicts are dropped.
+        :param dict verdicts: (name, version, level) => list of vulnerabilities
+        """
+        now = time.time() if now is None else now
+        with self._locked():
+            entries = self._read()
+            for (name, version, level), vulns in verdicts.items():
+                entries[verdict_key(name, version, level)] = {'time': now, 'vulnerabilities': vulns}
+            entries = dict((k, v) for k, v in entries.items() if self._is_fresh(v, now))
+            self._write(entries)
+        self.entries = entries
+
+    def _write(self, entries):
+        fd, tmp_path = tempfile.mkstemp(prefix='.verdicts-', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_FORMAT_VERSION, 'entries': entries}, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def lookup(self, deps_tree, level):
+        """Split a dependencies tree into cached verdicts and the tree to send
+        :param DepsTree deps_tree: the dependencies tree
+        :param str level: severity level of the scan
+        :rtype: VerdictLookup
+        """
+        return VerdictLookup(self, deps_tree, level)
+
+
+class VerdictLookup(object):
+    """Cached verdicts of the packages of a dependencies tree
+
+    :ivar DepsTree tree: the paths to the packages without a fresh verdict,
+        the payload to send; None when every verdict is cached
+    """
+
+    def __init__(self, cache, deps_tree, level):
+        self.cache = cache
+        self.deps_tree = deps_tree
+        self.level = level
+        now = time.time()
+        self.cached = {}
+        self.uncached = set()
+        for node in deps_tree.distinct_nodes():
+            if node.dependencies is None:
+                # not installed, there is nothing to check
+                continue
+            package = (canonical_name(node.name), node.version)
+            if package in self.cached or package in self.uncached:
+                continue
+            vulns = cache.get(node.name, node.version, level, now)
+            if vulns is None:
+                self.uncached.add(package)
+            else:
+                self.cached[package] = vulns
+
+        tree = deps_tree.pruned(self._is_uncached)
+        self.tree = tree if self.uncached else None
+        sent = set(self._package(node) for node in tree.distinct_nodes() if node.dependencies is not None)
+        # cached packages which are only on the paths to uncached ones are sent as well
+        self.cached_not_sent = len(set(self.cached) - sent)
+
+    @staticmethod
+    def _package(node):
+        return canonical_name(node.name), node.version
+
+    def _is_uncached(self, node):
+        return node.dependencies is not None and self._package(node) in self.uncached
+
+    def cached_vulnerabilities(self):
+        """Cached vulnerabilities, on every path to their package
+        :returns: generator of vulnerability dicts
+        """
+        vulnerable = self.deps_tree.pruned(
+            lambda node: node.dependencies is not None and bool(self.cached.get(self._package(node))))
+        for node, path in vulnerable.walk():
+            if node.dependencies is None:
+                continue
+            for vuln in self.cached.get(self._package(node)) or ():
+                record = OrderedDict(vuln)
+                record[FROM] = path
+                yield record
+
+    def merge_records(self, records):
+        """Merge the cached verdicts into the records of the API response,
+        and cache the verdicts of the packages which were sent
+        :param iterable records: vulnerabilities, then the summary holding ``ok``
+        :returns: generator of the merged records
+        """
+        cached_count = 0
+        for record in self.cached_vulnerabilities():
+            cached_count += 1
+            yield record
+
+        found = dict((package, []) for package in self.uncached)
+        sent_count = 0
+        for record in records:
+            if 'ok' in record:
+                # an error response is not ok and reports no vulnerability
+                if record.get('ok') or sent_count:
+                    self._store(found)
+                summary = OrderedDict(record)
+                summary['ok'] = bool(record.get('ok')) and not cached_count
+                summary['dependencyCount'] = record.get('dependencyCount', 0) + self.cached_not_sent
+                yield summary
+                return
+            package = (canonical_name(record.get('packageName', '')), record.get('version'))
+            if package in self.cached:
+                # a cached package on the path to an uncached one, already reported
+                continue
+            sent_count += 1
+            if package in found:
+                verdict = OrderedDict((k, v) for k, v in record.items() if k != FROM)
+                if verdict not in found[package]:
+                    found[package].append(verdict)
+            yield record
+
+    def _store(self, found):
+        if not found:
+            return
+        try:
+            self.cache.update(dict(((name, version, self.level), vulns) for (name, version), vulns in found.items()))
+        except (IOError, OSError):
+            # a read-only cache still saves the cached lookups
+            pass
@@ -0,0 +1,135 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import time
+import unittest
+from unittest import mock
+
+from mosec.batch import AsyncTransport, TokenBucket, latency_percentiles, submit_all
+from mosec.pip_resolve import batch_main
+from mosec.standin import StandinServer
+
+
+class RateTest(unittest.TestCase):
+
+    def test_rate_must_be_positive(self):
+        for rate in ('0', '-1', 'fast'):
+            with self.subTest(rate=rate):
+                with contextlib.redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit):
+                    batch_main(['requirements.txt', '--endpoint', 'http://127.0.0.1/api', '--rate', rate])
+                self.assertIn('--rate', stderr.getvalue())
+
+    def test_token_bucket_rate_must_be_positive(self):
+        for rate in (0, -1.5):
+            with self.subTest(rate=rate):
+                with self.assertRaises(ValueError):
+                    TokenBucket(rate)
+
+
+
+class LatencyPercentilesTest(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        latencies = [i / 100.0 for i in range(100, 0, -1)]
+        self.assertEqual(latency_percentiles(latencies), [0.5, 0.95, 0.99])
+        self.assertEqual(latency_percentiles([0.2]), [0.2, 0.2, 0.2])
+        self.assertEqual(latency_percentiles([]), [0.0, 0.0, 0.0])
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_rate_after_the_burst(self):
+        bucket = TokenBucket(rate=50, burst=2)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        starts = []
+
+        async def _acquire_all():
+            for _ in range(6):
+                await bucket.acquire()
+                starts.append(time.monotonic())
+
+        loop.run_until_complete(_acquire_all())
+        # the burst starts at once, then one start every 20 ms
+        self.assertLess(starts[1] - starts[0], 0.01)
+        self.assertGreaterEqual(starts[-1] - starts[0], 4 / 50.0 - 0.005)
+
+
+class AsyncTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer().start()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.server.stop()
+
+    def submit(self, client, url, count, concurrency):
+        payloads = [('scan-{}'.format(i), b'{"name": "project", "version": "1.0", "dependencies": {}}')
+                    for i in range(count)]
+        try:
+            return self.loop.run_until_complete(submit_all(client, url, payloads, concurrency))
+        finally:
+            client.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_idle_connections_capped(self):
+        client = AsyncTransport(retries=0, pool_size=2)
+        released = []
+        release = client._release
+
+        def _release(origin, conn):
+            release(origin, conn)
+            released.append(sum(len(c) for c in client._pool.values()))
+
+        client._release = _release
+        results = self.submit(client, self.server.endpoint, 8, 8)
+        self.assertEqual([r.error for r in results], [None] * 8)
+        self.assertEqual(max(released), 2)
+
+    def test_concurrency_cap(self):
+        self.server.latency = 0.05
+        client = AsyncTransport(retries=0)
+        in_flight = []
+        post_json = client.post_json
+
+        async def _post_json(*args):
+            in_flight.append(in_flight[-1] + 1 if in_flight else 1)
+            try:
+                return await post_json(*args)
+            finally:
+                in_flight.append(in_flight[-1] - 1)
+
+        client.post_json = _post_json
+        results = self.submit(client, self.server.endpoint, 8, 3)
+        self.assertEqual([r.error for r in results], [None] * 8)
+        self.assertEqual(max(in_flight), 3)
+        self.assertTrue(all(r.latency >= 0.05 for r in results))
+
+    def test_http_proxy(self):
+        # the host is only reachable through the proxy, the stand-in
+        proxy = self.server.endpoint.rsplit('/api/', 1)[0]
+        with mock.patch.dict(os.environ, {'http_proxy': proxy, 'no_proxy': ''}):
+            results = self.submit(AsyncTransport(retries=0), 'http://mosec.invalid/api/plugin', 2, 1)
+        self.assertEqual([r.status for r in results], [200, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import os
+import unittest
+
+from mosec.deps_tree import DistTree
+from mosec.payload import encode_payload
+from mosec.pip_resolve import build_deps_tree, create_deps_tree
+
+
+class FakeDist(object):
+    def __init__(self, name, version='1.0.0'):
+        self.project_name = name
+        self.key = name.lower()
+        self.version = version
+
+
+class FakeRequirement(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class NormalizedNamesTest(unittest.TestCase):
+
+    def test_required_dist_matched_normalized(self):
+        zope = FakeDist('zope.interface', '5.1.0')
+        app = FakeDist('app', '2.0')
+        dist_tree = {
+            app: [FakeDist('zope-interface', '5.1.0'), FakeDist('Zope_Interface', '5.1.0')],
+            zope: [],
+        }
+        deps_tree = build_deps_tree(dist_tree, [FakeRequirement('App')], 'requirements.txt')
+        app_node, = deps_tree.root.dependencies
+        self.assertEqual([(n.name, n.version) for n in app_node.dependencies], [('Zope_Interface', '5.1.0')])
+        # installed, not a missing node
+        self.assertEqual(app_node.dependencies[0].dependencies, ())
+
+
+def make_diamond(depth, width, cycle=False):
+    """``depth`` fully connected layers of ``width`` dists, the last layer
+    requires the first one when cycle
+    """
+    layers = [[FakeDist('pkg-{}-{}'.format(d, w)) for w in range(width)] for d in range(depth)]
+    dist_tree = {}
+    for d, layer in enumerate(layers):
+        for dist in layer:
+            if d + 1 < depth:
+                dist_tree[dist] = list(layers[d + 1])
+            else:
+                dist_tree[dist] = list(layers[0]) if cycle else []
+    return dist_tree, [FakeRequirement(dist.project_name) for dist in layers[0]]
+
+
+def recursive_deps_tree(dist_tree, top_level_requirements, req_file_path):
+    """The tree as create_deps_tree() built it before subtrees were shared,
+    one recursive call per path
+    """
+    key_tree = dict((dist.key, sorted(children, key=lambda d: d.key)) for dist, children in dist_tree.items())
+    names = [r.name.lower() for r in top_level_requirements]
+
+    def _node(dist, parent):
+        return {
+            'name': dist.project_name,
+            'version': dist.version,
+            'from': parent['from'] + [dist.project_name + '@' + dist.version],
+            'dependencies': {},
+        }
+
+    def _children(node, ancestors):
+        ancestors = ancestors | set([node['name'].lower()])
+        for child in key_tree[node['name'].lower()]:
+            if child.key not in ancestors:
+                child_node = _node(child, node)
+                _children(child_node, ancestors)
+                node['dependencies'][child_node['name']] = child_node
+        return node
+
+    root = {'name': os.path.basename(os.path.dirname(os.path.abspath(req_file_path))), 'version': '1.0.0',
+            'dependencies': {}}
+    root['from'] = [root['name'] + '@' + root['version']]
+    for dist in sorted((d for d in dist_tree if d.key in names), key=lambda d: d.key):
+        root['dependencies'][dist.project_name] = _children(_node(dist, root), set())
+    return root
+
+
+def walk(node, depth=0):
+    """Every node below ``node`` with its depth"""
+    for child in node.dependencies or ():
+        yield child, depth + 1
+        for item in walk(child, depth + 1):
+            yield item
+
+
+
+
+class LazyRequiresTest(unittest.TestCase):
+
+    def setUp(self):
+        dist_tree, self.top_level = make_diamond(3, 2)
+        self.loaded = []
+
+        def requires(dist):
+            self.loaded.append(dist.key)
+            return dist_tree[dist]
+
+        self.dist_tree = DistTree(dict((dist.key, dist) for dist in dist_tree), requires)
+
+    def test_provenance_does_not_load_requires(self):
+        deps_tree = build_deps_tree(self.dist_tree, self.top_level, 'requirements.txt', only_provenance=True)
+        self.assertEqual([node.name for node in deps_tree.root.dependencies], ['pkg-0-0', 'pkg-0-1'])
+        self.assertEqual(self.loaded, [])
+
+    def test_requires_loaded_once(self):
+        build_deps_tree(self.dist_tree, self.top_level, 'requirements.txt')
+        self.assertEqual(sorted(self.loaded), ['pkg-0-0', 'pkg-0-1', 'pkg-1-0', 'pkg-1-1', 'pkg-2-0', 'pkg-2-1'])
+
+
+class SharedSubtreesTest(unittest.TestCase):
+
+    def test_same_as_recursive_resolution(self):
+        for cycle in (False, True):
+            with self.subTest(cycle=cycle):
+                dist_tree, top_level = make_diamond(4, 3, cycle)
+                self.assertEqual(create_deps_tree(dist_tree, top_level, 'requirements.txt'),
+                                 recursive_deps_tree(dist_tree, top_level, 'requirements.txt'))
+
+    def test_deep_chain(self):
+        # far deeper than the recursion limit
+        chain = [FakeDist('pkg-{}'.format(i)) for i in range(5000)]
+        dist_tree = dict((dist, chain[i + 1:i + 2]) for i, dist in enumerate(chain))
+        deps_tree = build_deps_tree(dist_tree, [FakeRequirement('pkg-0')], 'requirements.txt')
+        # the payload is too deep for json.loads()
+        self.assertIn('"pkg-4999@1.0.0"]', encode_payload(deps_tree))
+        node, depth = create_deps_tree(dist_tree, [FakeRequirement('pkg-0')], 'requirements.txt'), 0
+        while node['dependencies']:
+            node, = node['dependencies'].values()
+            depth += 1
+        self.assertEqual(depth, len(chain))
+        self.assertEqual(len(node['from']), len(chain) + 1)
+
+
+class BoundedResolutionTest(unittest.TestCase):
+
+    def test_same_as_bounding_the_resolved_tree(self):
+        for cycle in (False, True):
+            dist_tree, top_level = make_diamond(4, 3, cycle)
+            unbounded = build_deps_tree(dist_tree, top_level, 'requirements.txt')
+            for max_depth, max_paths in ((1, None), (2, None), (3, None), (None, 1), (None, 4), (3, 2)):
+                with self.subTest(cycle=cycle, max_depth=max_depth, max_paths=max_paths):
+                    bounded = build_deps_tree(dist_tree, top_level, 'requirements.txt',
+                                              max_depth=max_depth, max_paths_per_package=max_paths)
+                    expected = unbounded.bounded(max_depth, max_paths)
+                    self.assertEqual(json.loads(encode_payload(bounded)), json.loads(encode_payload(expected)))
+                    self.assertEqual(bounded.truncated_count, expected.truncated_count)
+                    self.assertGreater(bounded.truncated_count, 0)
+
+    def test_untruncated_subtrees_stay_shared(self):
+        dist_tree, top_level = make_diamond(4, 3)
+        bounded = build_deps_tree(dist_tree, top_level, 'requirements.txt', max_paths_per_package=4)
+        # a layer 2 package is reached through 9 paths, the 4 expanded ones
+        # share the subtree of layer 3 leaves resolved for the package
+        expanded = [node for node, depth in walk(bounded.root) if depth == 3 and not node.truncated]
+        self.assertEqual(len(expanded), 4 * 3)
+        self.assertEqual(len(set((node.name, id(node.dependencies)) for node in expanded)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from mosec import dist_backend
+from mosec.dist_backend import ImportlibBackend, PkgResourcesBackend
+
+PKG_INFO = 'Metadata-Version: 1.1\nName: {}\nVersion: {}\n'
+
+
+def write_file(path, text):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class EggLayoutsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.site = os.path.join(self.directory, 'site-packages')
+
+        # an egg directory
+        egg_info = os.path.join(self.site, 'eggdir-1.0-py3.8.egg', 'EGG-INFO')
+        write_file(os.path.join(egg_info, 'PKG-INFO'), PKG_INFO.format('eggdir', '1.0'))
+        write_file(os.path.join(egg_info, 'requires.txt'), 'zipped>=2.0\n\n[test]\npytest\n')
+
+        # a zipped egg
+        with zipfile.ZipFile(os.path.join(self.site, 'zipped-2.1-py3.8.egg'), 'w') as egg:
+            egg.writestr('EGG-INFO/PKG-INFO', PKG_INFO.format('zipped', '2.1'))
+            egg.writestr('zipped/__init__.py', '')
+
+        # a develop install
+        project = os.path.join(self.directory, 'project')
+        write_file(os.path.join(project, 'develop.egg-info', 'PKG-INFO'), PKG_INFO.format('develop', '0.3'))
+        write_file(os.path.join(self.site, 'develop.egg-link'), '{}\n.\n'.format(project))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def installed(self, backend):
+        # the eggs and the develop project are put on sys.path by easy-install.pth
+        paths = [self.site, os.path.join(self.site, 'eggdir-1.0-py3.8.egg'),
+                 os.path.join(self.site, 'zipped-2.1-py3.8.egg'), os.path.join(self.directory, 'project')]
+        dists = backend.installed_dists(paths)
+        return dict((key, (dist.version, [r.key for r in dist.requires()])) for key, dist in dists.items())
+
+    def test_egg_layouts(self):
+        self.assertEqual(self.installed(ImportlibBackend()), {
+            'eggdir': ('1.0', ['zipped']),
+            'zipped': ('2.1', []),
+            'develop': ('0.3', []),
+        })
+
+    def test_inactive_eggs_and_egg_links(self):
+        # an egg not on sys.path is not importable, a develop install is
+        # found through its egg-link
+        self.assertEqual(list(ImportlibBackend().installed_dists([self.site])), ['develop'])
+
+    def test_same_as_pkg_resources(self):
+        try:
+            expected = self.installed(PkgResourcesBackend())
+        except ImportError:
+            self.skipTest('pkg_resources is not available')
+        self.assertEqual(self.installed(ImportlibBackend()), expected)
+
+
+
+class MarkerMatchesTest(unittest.TestCase):
+
+    def assert_markers(self):
+        self.assertTrue(dist_backend.marker_matches(None))
+        self.assertTrue(dist_backend.marker_matches('python_version >= "3"'))
+        self.assertFalse(dist_backend.marker_matches('python_version < "3"'))
+        self.assertFalse(dist_backend.marker_matches('extra == "test"'))
+        with self.assertLogs('mosec', 'DEBUG'):
+            self.assertFalse(dist_backend.marker_matches('python_version >> "3"'))
+
+    def test_packaging(self):
+        self.assert_markers()
+
+    def test_packaging_of_pkg_resources(self):
+        marker_class = dist_backend._pkg_resources_marker_class()
+        self.assertTrue(marker_class)
+        with mock.patch.object(dist_backend, '_marker_class', marker_class):
+            self.assert_markers()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from mosec import dist_index
+
+PKG_INFO = 'Metadata-Version: 1.1\nName: {}\nVersion: {}\n'
+
+
+def write_file(path, text):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def touch_later(path):
+    # a change within the timestamp granularity of the file system
+    # would not be noticed
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+class DefaultIndexPathTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': os.path.join(os.sep, 'cache')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(dist_index.INDEX_FILE_ENV, None)
+
+    def test_one_index_per_environment(self):
+        path = dist_index.default_index_path()
+        self.assertEqual(os.path.dirname(path), os.path.join(os.sep, 'cache', 'mosec'))
+        self.assertEqual(dist_index.default_index_path(), path)
+        with mock.patch.object(sys, 'prefix', os.path.join(os.sep, 'other', 'venv')):
+            self.assertNotEqual(dist_index.default_index_path(), path)
+
+    def test_index_file_environment_variable(self):
+        with mock.patch.dict(os.environ, {dist_index.INDEX_FILE_ENV: 'index.json'}):
+            self.assertEqual(dist_index.default_index_path(), 'index.json')
+
+
+
+class RefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.site = os.path.join(self.directory, 'site-packages')
+        write_file(os.path.join(self.site, 'plain-1.0.dist-info', 'METADATA'), PKG_INFO.format('plain', '1.0'))
+
+        # a develop install
+        self.project = os.path.join(self.directory, 'project')
+        write_file(os.path.join(self.project, 'develop.egg-info', 'PKG-INFO'), PKG_INFO.format('develop', '0.3'))
+        write_file(os.path.join(self.site, 'develop.egg-link'), '{}\n.\n'.format(self.project))
+
+        # a zipped egg on sys.path
+        self.egg = os.path.join(self.directory, 'zipped-2.1-py3.8.egg')
+        with zipfile.ZipFile(self.egg, 'w') as egg:
+            egg.writestr('EGG-INFO/PKG-INFO', PKG_INFO.format('zipped', '2.1'))
+
+        self.paths = [self.site, self.egg]
+        self.index_path = os.path.join(self.directory, 'index.json')
+        dist_index.build_index(self.index_path, self.paths)
+
+    def refresh(self):
+        index = dist_index.DistIndex(self.index_path)
+        dists = index.installed_dists(self.paths)
+        index.save()
+        return index, dict((key, dist.version) for key, dist in dists.items())
+
+    def test_unchanged_directories_are_not_listed(self):
+        with mock.patch.object(dist_index, 'list_metadata_entries') as list_entries:
+            index, dists = self.refresh()
+        self.assertEqual(list_entries.call_count, 0)
+        self.assertEqual(dists, {'plain': '1.0', 'develop': '0.3', 'zipped': '2.1'})
+        self.assertEqual(index.stats, {'reused': 3, 'loaded': 0, 'removed': 0})
+
+    def test_upgraded_dist_is_loaded_again(self):
+        shutil.rmtree(os.path.join(self.site, 'plain-1.0.dist-info'))
+        write_file(os.path.join(self.site, 'plain-2.0.dist-info', 'METADATA'), PKG_INFO.format('plain', '2.0'))
+        touch_later(self.site)
+        index, dists = self.refresh()
+        self.assertEqual(dists['plain'], '2.0')
+        self.assertEqual(index.stats, {'reused': 2, 'loaded': 1, 'removed': 1})
+
+    def test_removed_egg_link_is_pruned(self):
+        os.remove(os.path.join(self.site, 'develop.egg-link'))
+        touch_later(self.site)
+        index, dists = self.refresh()
+        self.assertNotIn('develop', dists)
+        self.assertEqual(index.stats['removed'], 1)
+        self.assertEqual(sorted(os.path.basename(p) for p in index.entries),
+                         ['plain-1.0.dist-info', 'zipped-2.1-py3.8.egg'])
+
+    def test_removed_egg_is_pruned(self):
+        os.remove(self.egg)
+        index, dists = self.refresh()
+        self.assertNotIn('zipped', dists)
+        self.assertEqual(index.stats['removed'], 1)
+        self.assertNotIn(self.egg, index.entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mosec.requirement_file_parser import get_requirements_list
+
+LOCK = {
+    "_meta": {"pipfile-spec": 6},
+    "default": {
+        "django": {"version": "==2.2.1"},
+        "futures": {"version": "==3.3.0", "markers": "python_version < '3.0'"},
+        "requests": {"version": "==2.22.0", "markers": "python_version >= '3.5'"},
+    },
+    "develop": {
+        "pytest": {"version": "==6.0.0", "markers": "python_version != '2.7'"},
+    },
+}
+
+
+class PipfileLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'Pipfile.lock')
+        with open(self.path, 'w') as f:
+            json.dump(LOCK, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_python_version_markers(self):
+        reqs = get_requirements_list(self.path, include_dev=True)
+        self.assertEqual([r.name for r in reqs], ['django', 'requests', 'pytest'])
+
+    def test_provenance_is_the_lock_file(self):
+        reqs = get_requirements_list(self.path)
+        self.assertEqual(set(r.provenance for r in reqs), {('Pipfile.lock', None, None)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import unittest
+
+from mosec.pytoml.core import TomlError
+from mosec.pytoml.parser import loads
+
+
+def with_pos(kind, text, value, pos):
+    if kind in ('int', 'str'):
+        return value, pos
+    return value
+
+
+class CursorTest(unittest.TestCase):
+
+    def test_tables_arrays_and_scalars(self):
+        data = loads('[a]\nx = 1\n[[b]]\ny = "s"\nz = [1, 2]\n[c.d]\ne = 1.5\n')
+        self.assertEqual(data, {'a': {'x': 1}, 'b': [{'y': 's', 'z': [1, 2]}], 'c': {'d': {'e': 1.5}}})
+
+    def test_value_positions(self):
+        data = loads('a = 1\n\n[t]\nb   = "x"\n', translate=with_pos)
+        self.assertEqual(data, {'a': (1, (1, 5)), 't': {'b': ('x', (4, 7))}})
+
+    def test_positions_far_into_a_large_file(self):
+        lines = ['[section{}]\nkey = {}\n'.format(i, i) for i in range(2000)]
+        data = loads(''.join(lines), translate=with_pos)
+        self.assertEqual(data['section0']['key'], (0, (2, 7)))
+        self.assertEqual(data['section1999']['key'], (1999, (4000, 7)))
+
+
+class ErrorPositionTest(unittest.TestCase):
+
+    def assert_error_at(self, text, line, col):
+        with self.assertRaises(TomlError) as ctx:
+            loads(text, 'Pipfile')
+        self.assertEqual((ctx.exception.line, ctx.exception.col), (line, col))
+        self.assertEqual(ctx.exception.filename, 'Pipfile')
+
+    def test_missing_value(self):
+        self.assert_error_at('a = 1\nb = \n', 2, 1)
+
+    def test_invalid_value_after_blank_line(self):
+        self.assert_error_at('[a]\nx = 1\n\n  y = @\n', 4, 3)
+
+    def test_duplicate_key(self):
+        self.assert_error_at('a = 1\na = 2\n', 2, 1)
+
+    def test_unterminated_table_header(self):
+        self.assert_error_at('[x\n', 1, 1)
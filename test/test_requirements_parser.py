@@ -0,0 +1,159 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+from mosec import requirements
+from mosec.requirement_file_parser import get_requirements_list
+from mosec.requirements.parser import IncludeGraph, logical_lines
+from mosec.requirements.requirement import Requirement
+
+
+class LogicalLinesTest(unittest.TestCase):
+
+    def test_continuation(self):
+        lines = ['requests==2.0 \\', '    --hash=sha256:abc', 'flask==1.0']
+        self.assertEqual(list(logical_lines(lines)), [
+            (1, 2, 'requests==2.0     --hash=sha256:abc'),
+            (3, 3, 'flask==1.0'),
+        ])
+
+    def test_comment_ending_with_backslash_does_not_continue(self):
+        reqs = list(requirements.parse('# see C:\\\nrequests==2.0\nflask==1.0\n'))
+        self.assertEqual([r.name for r in reqs], ['requests', 'flask'])
+        self.assertEqual(reqs[0].provenance, (None, 2, 2))
+
+    def test_comment_ends_continuation(self):
+        reqs = list(requirements.parse('requests==2.0 \\\n# comment \\\nflask==1.0\n'))
+        self.assertEqual([r.name for r in reqs], ['requests', 'flask'])
+        self.assertEqual([r.provenance for r in reqs], [(None, 1, 1), (None, 3, 3)])
+
+
+
+class PlainSpecifierTest(unittest.TestCase):
+
+    def test_classified_without_filesystem_access(self):
+        lines = {
+            'requests': ('requests', [], []),
+            'Flask[async, dotenv] >= 2.0, <3': ('Flask', ['async', 'dotenv'], [('>=', '2.0'), ('<', '3')]),
+            'zope.interface===5.1.0 ; python_version >= "3"': ('zope.interface', [], [('===', '5.1.0')]),
+            'typing_extensions~=4.0': ('typing_extensions', [], [('~=', '4.0')]),
+        }
+        with mock.patch('os.stat', side_effect=AssertionError('stat')), \
+                mock.patch('os.path.isfile', side_effect=AssertionError('isfile')):
+            for line, (name, extras, specs) in lines.items():
+                with self.subTest(line=line):
+                    req = Requirement.parse_line(line, 'requirements.txt')
+                    self.assertTrue(req.specifier)
+                    self.assertEqual((req.name, req.extras, req.specs), (name, extras, specs))
+
+    def test_paths_are_not_plain_specifiers(self):
+        for line in ('./project', '../project', 'src/project', 'project.tar.gz#egg=project'):
+            with self.subTest(line=line):
+                self.assertIsNone(Requirement.parse_specifier(line))
+
+
+class DuplicateRequirementsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def requirements_list(self, text):
+        path = os.path.join(self.directory, 'requirements.txt')
+        with open(path, 'w') as f:
+            f.write(text)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            req_list = get_requirements_list(path)
+        return req_list, [str(w.message) for w in caught]
+
+    def test_same_requirement_is_kept_once(self):
+        req_list, messages = self.requirements_list('Flask==1.0\nrequests\nflask == 1.0\n')
+        self.assertEqual([r.name for r in req_list], ['Flask', 'requests'])
+        self.assertEqual(messages, [])
+
+    def test_other_versions_are_warned_about(self):
+        req_list, messages = self.requirements_list('Flask==1.0\nrequests\nflask>=2.0\n')
+        self.assertEqual([(r.name, r.specs) for r in req_list], [('Flask', [('==', '1.0')]), ('requests', [])])
+        self.assertEqual(len(messages), 1)
+        self.assertIn('requirements.txt:1 and requirements.txt:3', messages[0])
+
+    def test_other_markers_are_warned_about(self):
+        req_list, messages = self.requirements_list(
+            'flask==1.0; python_version >= "3"\nflask==1.0; python_version >= "3.0"\n')
+        self.assertEqual(len(req_list), 1)
+        self.assertEqual(len(messages), 1)
+
+
+
+class IncludeGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_included_file_is_cached_until_it_changes(self):
+        base = self.write('base.txt', 'requests==2.0\n')
+        graph = IncludeGraph()
+        first = graph.load(base)
+        self.assertIs(graph.load(base), first)
+        self.write('base.txt', 'requests==2.0\nflask==1.0\n')
+        self.assertEqual([r.name for r in graph.load(base)], ['requests', 'flask'])
+
+    def test_shared_include_is_read_once(self):
+        self.write('base.txt', 'requests==2.0\n')
+        self.write('web.txt', '-r base.txt\nflask==1.0\n')
+        path = self.write('requirements.txt', '-r web.txt\n-r base.txt\n')
+        graph = IncludeGraph()
+        loads = []
+        load = graph.load
+        graph.load = lambda p: loads.append(os.path.basename(p)) or load(p)
+        reqs, constraints = graph.resolve(path)
+        self.assertEqual([r.name for r in reqs], ['requests', 'flask'])
+        self.assertEqual(constraints, [])
+        self.assertEqual(sorted(loads), ['base.txt', 'requirements.txt', 'web.txt'])
+
+    def test_cycle_is_skipped_with_a_warning(self):
+        self.write('a.txt', '-r b.txt\nrequests==2.0\n')
+        self.write('b.txt', '-r a.txt\nflask==1.0\n')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            reqs, _ = IncludeGraph().resolve(os.path.join(self.directory, 'a.txt'))
+        self.assertEqual([r.name for r in reqs], ['flask', 'requests'])
+        self.assertEqual(len(caught), 1)
+        self.assertIn('includes itself', str(caught[0].message))
+
+    def test_constraints_restrict_requirements(self):
+        self.write('constraints.txt', 'Flask<2.0\nrequests==2.0\nsix==1.0; python_version < "3"\n')
+        path = self.write('requirements.txt', '-c constraints.txt\nflask>=1.0\nsix\n')
+        req_list = get_requirements_list(path)
+        # a constraint never adds a requirement
+        self.assertEqual([(r.name, r.specs) for r in req_list], [('flask', [('>=', '1.0'), ('<', '2.0')]), ('six', [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
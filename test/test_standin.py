@@ -0,0 +1,188 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import time
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from mosec import pip_resolve
+from mosec import transport
+from mosec.deps_tree import DepNode, DepsTree
+from mosec.payload import (GRAPH_FORMAT, MERKLE_FORMAT, PAYLOAD_FORMATS, TREE_FORMAT, encode_payload,
+                           expand_graph_payload, expand_merkle_payload)
+from mosec.pip_resolve import iter_response_records, iter_sharded_records, open_payload_response, split_deps_tree
+from mosec.standin import StandinServer
+
+FIELDS = OrderedDict([
+    ('severityLevel', 'High'),
+    ('type', 'pip'),
+    ('language', 'python'),
+])
+
+VULNERABILITIES = [
+    {"packageName": "Shared", "version": "2.0", "severity": "High", "title": "RCE"},
+    {"packageName": "a", "version": "1.0", "severity": "Low", "title": "below the level"},
+]
+
+
+def make_deps_tree():
+    # a subtree shared by two parents, and a package which is not installed
+    shared = (DepNode('Shared', '2.0'),)
+    return DepsTree(DepNode('project', '1.0.0', (
+        DepNode('a', '1.0', shared),
+        DepNode('b', '1.5', shared),
+        DepNode('missing', '0.1', None),
+    )))
+
+
+class SlowShardServer(StandinServer):
+    """Answers the shards holding package b after a long delay"""
+
+    delay = 10
+
+    def record(self, handler, payload):
+        StandinServer.record(self, handler, payload)
+        handler.slow = 'b' in (payload.get('dependencies') or {})
+
+    def inject_fault(self, handler):
+        if handler.slow:
+            time.sleep(self.delay)
+        return False
+
+
+def _plain(value):
+    return json.loads(json.dumps(value))
+
+
+class StandinRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer(vulnerabilities=VULNERABILITIES).start()
+        self.client = transport.Transport(retries=0)
+        self.deps_tree = make_deps_tree()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def upload(self, payload_format, compress=False, stream=False):
+        with open_payload_response(self.client, self.server.endpoint, self.deps_tree, FIELDS, payload_format,
+                                   compress=compress, stream=stream) as response:
+            return list(iter_response_records(response))
+
+    def received_tree(self):
+        """The last payload received by the stand-in, as a tree payload"""
+        payload = self.server.requests[-1][1]
+        if payload.get('payloadFormat') == GRAPH_FORMAT:
+            payload = expand_graph_payload(payload)
+        elif payload.get('payloadFormat') == MERKLE_FORMAT:
+            payload = expand_merkle_payload(payload, self.server.subtrees)
+        return _plain(payload)
+
+    def assert_round_trip(self, records):
+        self.assertEqual(self.received_tree(), json.loads(encode_payload(self.deps_tree, FIELDS, TREE_FORMAT)))
+        vulns, summary = records[:-1], records[-1]
+        self.assertEqual(sorted(v['from'] for v in vulns), [
+            ['project@1.0.0', 'a@1.0', 'Shared@2.0'],
+            ['project@1.0.0', 'b@1.5', 'Shared@2.0'],
+        ])
+        self.assertEqual([v['title'] for v in vulns], ['RCE', 'RCE'])
+        # a, b and Shared, the missing package is not counted
+        self.assertEqual(summary, {'ok': False, 'dependencyCount': 3})
+
+    def test_payload_formats(self):
+        for payload_format in PAYLOAD_FORMATS:
+            for compress in (False, True):
+                with self.subTest(payload_format=payload_format, compress=compress):
+                    self.assert_round_trip(self.upload(payload_format, compress=compress))
+
+    def test_streamed_payload(self):
+        for payload_format in (TREE_FORMAT, GRAPH_FORMAT):
+            with self.subTest(payload_format=payload_format):
+                self.assert_round_trip(self.upload(payload_format, compress=True, stream=True))
+                headers = self.server.requests[-1][0]
+                self.assertEqual(headers.get('Transfer-Encoding'), 'chunked')
+                self.assertEqual(headers.get('Content-Encoding'), transport.GZIP)
+
+    def test_merkle_known_subtrees_not_sent_again(self):
+        self.upload(MERKLE_FORMAT)
+        first = len(self.server.requests)
+        self.assertEqual(first, 2)
+        self.assert_round_trip(self.upload(MERKLE_FORMAT))
+        # the stand-in already stores every subtree, only the hashes are sent
+        self.assertEqual(len(self.server.requests), first + 1)
+        self.assertEqual(self.server.requests[-1][1].get('nodes'), None)
+
+    def test_shards_merged(self):
+        shards = split_deps_tree(self.deps_tree)
+        records = list(iter_sharded_records(self.client, self.server.endpoint, shards, FIELDS, TREE_FORMAT,
+                                            workers=2))
+        self.assertEqual(len(self.server.requests), len(shards))
+        self.assertEqual(records[-1], self.upload(TREE_FORMAT)[-1])
+        self.assertEqual(len(records), 3)
+
+    def test_gzip_refused(self):
+        self.server.accept_gzip = False
+        self.assert_round_trip(self.upload(TREE_FORMAT, compress=True))
+        # the gzip request is refused before it is recorded, the plain one is checked
+        encodings = [headers.get('Content-Encoding') for headers, _ in self.server.requests]
+        self.assertEqual(encodings, [None])
+
+
+
+class ShardsFailFastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SlowShardServer(vulnerabilities=VULNERABILITIES).start()
+        self.client = transport.Transport(retries=3)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_uploads_in_flight_are_aborted(self):
+        started = []
+        finished = []
+
+        def upload_shard(*args):
+            started.append(time.time())
+            try:
+                return _upload_shard(*args)
+            finally:
+                finished.append(time.time())
+
+        _upload_shard = pip_resolve._upload_shard
+        # the shard of b is uploaded first
+        shards = sorted(split_deps_tree(make_deps_tree()), key=lambda shard: shard.root.dependencies[0].name != 'b')
+        with mock.patch.object(pip_resolve, '_upload_shard', side_effect=upload_shard):
+            records = iter_sharded_records(self.client, self.server.endpoint, shards, FIELDS, TREE_FORMAT,
+                                           workers=len(shards))
+            # the first vulnerability stops the scan, the shard of b is still in flight
+            self.assertEqual(next(records)['title'], 'RCE')
+            stopped = time.time()
+            records.close()
+            while len(finished) < len(started) and time.time() - stopped < SlowShardServer.delay:
+                time.sleep(0.05)
+        self.assertGreaterEqual(len(started), 2)
+        self.assertEqual(len(finished), len(started))
+        self.assertLess(max(finished) - stopped, 2)
+        # aborted, not retried, the shard of b may be aborted before it is received
+        self.assertLessEqual(len(self.server.requests), len(started))
+
+
+if __name__ == '__main__':
+    unittest.main()
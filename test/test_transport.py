@@ -0,0 +1,127 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mosec import transport
+from mosec.standin import StandinServer
+
+
+class WarmUpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_warm_up_after_close_is_not_pooled(self):
+        client = transport.Transport(retries=0)
+        client.close()
+        # the warm-up connection is released once the client is closed, the
+        # way a warm-up still connecting when every verdict is cached is
+        client.warm_up(self.server.endpoint)
+        client._wait_warm_up(transport._origin(self.server.endpoint))
+        self.assertEqual(client._pool, {})
+
+    def test_warm_up_connection_reused(self):
+        with transport.Transport(retries=0) as client:
+            client.warm_up(self.server.endpoint)
+            client._wait_warm_up(transport._origin(self.server.endpoint))
+            self.assertEqual([len(c) for c in client._pool.values()], [1])
+
+
+
+class CloseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer(latency=10).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_close_aborts_the_requests_in_flight(self):
+        client = transport.Transport(retries=3)
+        errors = []
+
+        def post():
+            try:
+                client.post_json(self.server.endpoint, b'{}')
+            except (OSError, transport.HTTPError) as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=post)
+        thread.start()
+        while not self.server.requests:
+            time.sleep(0.01)
+        closed = time.time()
+        client.close()
+        thread.join(self.server.latency)
+        self.assertLess(time.time() - closed, 2)
+        self.assertEqual(len(errors), 1)
+        # not retried once closed
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertRaises(ConnectionAbortedError, client.post_json, self.server.endpoint, b'{}')
+
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer().start()
+        self.client = transport.Transport(retries=2, backoff=0.001, max_backoff=0.002)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def sends(self, url=None, payload=b'{}'):
+        with mock.patch.object(self.client, '_send', wraps=self.client._send) as send:
+            try:
+                self.client.post_json(url or self.server.endpoint, payload)
+            except (OSError, transport.HTTPError) as e:
+                return send.call_count, e
+        return send.call_count, None
+
+    def test_retried_on_5xx(self):
+        self.server.error_rate = 1
+        count, error = self.sends()
+        self.assertEqual(count, 3)
+        self.assertEqual(error.status, 503)
+
+    def test_retried_on_reset_connection(self):
+        self.server.drop_rate = 1
+        count, error = self.sends()
+        self.assertEqual(count, 3)
+        self.assertIsInstance(error, ConnectionError)
+
+    def test_not_retried_on_4xx(self):
+        count, error = self.sends(payload=b'not json')
+        self.assertEqual(count, 1)
+        self.assertEqual(error.status, 400)
+
+    def test_backoff_with_full_jitter(self):
+        client = transport.Transport(backoff=0.5, max_backoff=8)
+        for attempt, limit in ((0, 0.5), (1, 1), (3, 4), (4, 8), (10, 8)):
+            delays = [client.retry_delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= limit for delay in delays))
+            self.assertGreater(max(delays), limit / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mosec.deps_tree import DepNode, DepsTree
+from mosec.pip_resolve import render_ndjson_response, render_records, upload_main, write_payload_file
+from mosec.standin import StandinRequestHandler, StandinServer
+
+
+class MalformedRequestHandler(StandinRequestHandler):
+    """Answers the first requests with malformed results"""
+
+    def do_POST(self):
+        self._read_body()
+        self.server.record(self, None)
+        bodies = self.server.malformed_bodies
+        if len(self.server.requests) <= len(bodies):
+            return self._send(200, bodies[len(self.server.requests) - 1])
+        self._send(200, json.dumps({'ok': True, 'dependencyCount': 1}).encode('utf-8'))
+
+
+class RenderRecordsTest(unittest.TestCase):
+
+    def test_malformed_records(self):
+        for records in ([], [{'title': 'no summary'}], ['not an object']):
+            with self.subTest(records=records):
+                with self.assertRaises(ValueError):
+                    render_records(iter(records))
+
+
+def ndjson_lines(*records):
+    return [json.dumps(record).encode('utf-8') for record in records]
+
+
+class NdjsonResponseTest(unittest.TestCase):
+
+    high = {'packageName': 'a', 'version': '1.0', 'severity': 'High', 'title': 'RCE', 'from': ['p@1', 'a@1.0']}
+    low = {'packageName': 'b', 'version': '2.0', 'severity': 'Low', 'title': 'DoS', 'from': ['p@1', 'b@2.0']}
+    summary = {'ok': False, 'dependencyCount': 2}
+
+    def render(self, lines, fail_fast_level=None):
+        consumed = []
+
+        def _lines():
+            for line in lines:
+                consumed.append(line)
+                yield line
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            ok = render_ndjson_response(_lines(), fail_fast_level)
+        return ok, stdout.getvalue(), len(consumed)
+
+    def test_records_rendered(self):
+        ok, output, consumed = self.render(ndjson_lines(self.low, self.high, self.summary) + [b''])
+        self.assertFalse(ok)
+        self.assertEqual(output, '- from: p@1 > b@2.0\n\n- from: p@1 > a@1.0\n\n')
+        self.assertEqual(consumed, 4)
+
+    def test_no_vulnerability(self):
+        ok, output, _ = self.render(ndjson_lines({'ok': True, 'dependencyCount': 2}))
+        self.assertTrue(ok)
+        self.assertEqual(output, '')
+
+    def test_fail_fast_stops_reading(self):
+        ok, output, consumed = self.render(ndjson_lines(self.low, self.high, self.low, self.summary), 'High')
+        self.assertFalse(ok)
+        self.assertEqual(output, '- from: p@1 > b@2.0\n\n- from: p@1 > a@1.0\n\n')
+        # the low vulnerability is below the level, the rest of the response is not read
+        self.assertEqual(consumed, 2)
+
+    def test_fail_fast_needs_the_summary(self):
+        ok, _, consumed = self.render(ndjson_lines(self.low, self.summary), 'High')
+        self.assertFalse(ok)
+        self.assertEqual(consumed, 2)
+        with self.assertRaises(ValueError):
+            self.render(ndjson_lines(self.low), 'High')
+
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = StandinServer()
+        self.server.RequestHandlerClass = MalformedRequestHandler
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_malformed_response_fails_only_its_payload(self):
+        self.server.malformed_bodies = [b'{"unexpected": true}', b'[1, 2]', b'not json']
+        deps_tree = DepsTree(DepNode('project', '1.0.0', (DepNode('a', '1.0'),)))
+        paths = []
+        for i in range(4):
+            path = os.path.join(self.directory, 'payload-{}.json.gz'.format(i))
+            write_payload_file(path, deps_tree, {'severityLevel': 'High'})
+            paths.append(path)
+
+        code = upload_main(paths + ['--endpoint', self.server.endpoint, '--retries', '0'])
+        self.assertEqual(code, 1)
+        # every payload is uploaded, the last one succeeds
+        self.assertEqual(len(self.server.requests), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import unittest
+from unittest import mock
+
+from mosec import utils
+
+
+class FakeDist(object):
+    version = '2.3'
+
+
+class GuessVersionTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('mosec.dist_backend.module_dists', return_value={'yaml': FakeDist()})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_installed_metadata(self):
+        with mock.patch.object(utils, 'import_module') as import_module:
+            self.assertEqual(utils.guess_version('yaml'), '2.3')
+        import_module.assert_not_called()
+
+    def test_not_imported_by_default(self):
+        with mock.patch.object(utils, 'import_module') as import_module:
+            self.assertEqual(utils.guess_version('not-installed'), '?')
+        import_module.assert_not_called()
+
+    def test_imported_when_allowed(self):
+        module = mock.Mock(__version__='0.9')
+        with mock.patch.object(utils, 'import_module', return_value=module) as import_module:
+            self.assertEqual(utils.guess_version('not-installed', allow_import=True), '0.9')
+        import_module.assert_called_once_with('not-installed')
+
+
+if __name__ == '__main__':
+    unittest.main()
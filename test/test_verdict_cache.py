@@ -0,0 +1,98 @@
+"""
+Copyright 2020 momosecurity.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from mosec.deps_tree import DepNode, DepsTree
+from mosec.verdict_cache import VerdictCache
+
+RCE = OrderedDict([('packageName', 'Shared'), ('version', '2.0'), ('severity', 'High'), ('title', 'RCE')])
+
+
+def make_deps_tree():
+    shared = (DepNode('Shared', '2.0'),)
+    return DepsTree(DepNode('project', '1.0.0', (
+        DepNode('a', '1.0', shared),
+        DepNode('b', '1.5', shared),
+        DepNode('missing', '0.1', None),
+    )))
+
+
+def response(*vulns):
+    records = []
+    for vuln, path in vulns:
+        record = OrderedDict(vuln)
+        record['from'] = path
+        records.append(record)
+    records.append(OrderedDict([('ok', not vulns), ('dependencyCount', 3)]))
+    return records
+
+
+class VerdictCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_verdicts_expire(self):
+        cache = VerdictCache(self.directory, ttl=60)
+        cache.update({('Typing_Extensions', '4.0', 'High'): [RCE]}, now=1000)
+        self.assertEqual(cache.get('typing-extensions', '4.0', 'high', now=1059), [RCE])
+        self.assertIsNone(cache.get('typing-extensions', '4.0', 'high', now=1060))
+        self.assertIsNone(cache.get('typing-extensions', '4.0', 'Low', now=1000))
+        # expired verdicts are dropped by the next update
+        cache.update({('a', '1.0', 'High'): []}, now=1060)
+        self.assertEqual(list(VerdictCache(self.directory, ttl=60).entries), ['a@1.0@high'])
+
+    def test_concurrent_updates_merged(self):
+        first = VerdictCache(self.directory)
+        second = VerdictCache(self.directory)
+        first.update({('a', '1.0', 'High'): []})
+        second.update({('b', '1.5', 'High'): [RCE]})
+        cache = VerdictCache(self.directory)
+        self.assertEqual(cache.get('a', '1.0', 'High'), [])
+        self.assertEqual(cache.get('b', '1.5', 'High'), [RCE])
+
+    def test_verdicts_stored_then_replayed(self):
+        deps_tree = make_deps_tree()
+        lookup = VerdictCache(self.directory).lookup(deps_tree, 'High')
+        self.assertEqual(len(lookup.uncached), 3)
+        self.assertEqual([node.name for node in lookup.tree.root.dependencies], ['a', 'b'])
+        records = list(lookup.merge_records(response(
+            (RCE, ['project@1.0.0', 'a@1.0', 'Shared@2.0']), (RCE, ['project@1.0.0', 'b@1.5', 'Shared@2.0']))))
+        self.assertEqual(len(records), 3)
+
+        # every verdict is cached, nothing is sent and the vulnerabilities are replayed on every path
+        lookup = VerdictCache(self.directory).lookup(make_deps_tree(), 'High')
+        self.assertIsNone(lookup.tree)
+        # the summary run() renders when nothing is sent
+        records = list(lookup.merge_records([OrderedDict([('ok', True), ('dependencyCount', 0)])]))
+        self.assertEqual([record['from'] for record in records[:-1]], [
+            ['project@1.0.0', 'a@1.0', 'Shared@2.0'],
+            ['project@1.0.0', 'b@1.5', 'Shared@2.0'],
+        ])
+        self.assertEqual(records[-1], {'ok': False, 'dependencyCount': 3})
+
+    def test_error_response_not_stored(self):
+        lookup = VerdictCache(self.directory).lookup(make_deps_tree(), 'High')
+        list(lookup.merge_records([OrderedDict([('ok', False), ('dependencyCount', 0)])]))
+        self.assertEqual(VerdictCache(self.directory).entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()